@@ -0,0 +1,6 @@
+"""
+Benchmarks for the rapyd_db backends against locally running servers.
+
+Run ``python -m benchmarks --help`` for usage. Servers can be launched with
+``docker compose -f benchmarks/docker-compose.yml up -d``.
+"""
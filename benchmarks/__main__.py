@@ -0,0 +1,93 @@
+import argparse
+import json
+import sys
+
+from .runner import SCENARIOS, compare, run
+from .targets import TARGETS
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmarks the rapyd_db backends against local servers.",
+    )
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks.")
+    run_parser.add_argument(
+        "--backend",
+        action="append",
+        choices=sorted(TARGETS),
+        help="Backend to benchmark. Repeat for several. Defaults to all.",
+    )
+    run_parser.add_argument(
+        "--mode",
+        action="append",
+        choices=("connect_per_query", "pooled"),
+        help="Connection mode. Repeat for several. Defaults to both.",
+    )
+    run_parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        help="Scenario to run. Repeat for several. Defaults to all.",
+    )
+    run_parser.add_argument("--rows", type=int, default=100000)
+    run_parser.add_argument("--batch-size", type=int, default=1000)
+    run_parser.add_argument("--chunk-size", type=int, default=1000)
+    run_parser.add_argument("--connects", type=int, default=50)
+    run_parser.add_argument("--point-queries", type=int, default=1000)
+    run_parser.add_argument("--warmup", type=int, default=50)
+    run_parser.add_argument("--pool-size", type=int, default=8)
+    run_parser.add_argument(
+        "--keep", action="store_true", help="Keep the benchmark table afterwards."
+    )
+    run_parser.add_argument(
+        "--output", help="Write the results as JSON to this file instead of stdout."
+    )
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare two result files."
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    return parser
+
+
+def main(argv=None):
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        compare(args.baseline, args.current)
+        return 0
+    if args.command != "run":
+        parser.print_help()
+        return 2
+
+    options = dict(
+        rows=args.rows,
+        batch_size=args.batch_size,
+        chunk_size=args.chunk_size,
+        connects=args.connects,
+        point_queries=args.point_queries,
+        warmup=args.warmup,
+        pool_size=args.pool_size,
+        keep=args.keep,
+    )
+    results = run(
+        args.backend or sorted(TARGETS),
+        args.mode or ["connect_per_query", "pooled"],
+        args.scenario or list(SCENARIOS),
+        options,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
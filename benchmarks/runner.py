@@ -0,0 +1,205 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import traceback
+
+from datetime import datetime
+
+from .targets import SCAN_VARIANTS, TARGETS
+
+
+SCENARIOS = ("connect", "point_query", "bulk_insert", "scan")
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return dict()
+
+    def at(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    return dict(
+        count=len(samples),
+        mean=sum(samples) / len(samples),
+        min=samples[0],
+        p50=at(0.5),
+        p95=at(0.95),
+        p99=at(0.99),
+        max=samples[-1],
+    )
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def _run_scenario(target_name, mode, scenario, variant, options):
+    """Runs one scenario and returns its metrics. Called in a fresh process."""
+    target = TARGETS[target_name](pool_size=options["pool_size"])
+    db = target.backend(mode)
+    try:
+        if scenario == "connect":
+            samples = [_timed(target.connect, db)[0] for _ in range(options["connects"])]
+            metrics = dict(latency=_percentiles(samples))
+        elif scenario == "point_query":
+            for key in range(options["warmup"]):
+                target.point_query(db, key)
+            samples = [
+                _timed(target.point_query, db, key)[0]
+                for key in range(options["point_queries"])
+            ]
+            metrics = dict(latency=_percentiles(samples))
+        elif scenario == "bulk_insert":
+            # the same rows are inserted again, so the table is as loaded by _load after
+            target.setup(db)
+            elapsed, rows = _timed(
+                target.bulk_insert, db, options["rows"], options["batch_size"]
+            )
+            metrics = dict(rows=rows, seconds=elapsed, rows_per_second=rows / elapsed)
+        else:
+            elapsed, rows = _timed(target.scan, db, variant, options["chunk_size"])
+            metrics = dict(rows=rows, seconds=elapsed, rows_per_second=rows / elapsed)
+    finally:
+        db.close()
+    metrics["peak_rss_bytes"] = _peak_rss_bytes()
+    return metrics
+
+
+def _child(queue, *args):
+    try:
+        queue.put(("ok", _run_scenario(*args)))
+    except Exception:
+        queue.put(("error", traceback.format_exc()))
+
+
+def _in_process(*args):
+    # every scenario gets its own interpreter so peak RSS is not inflated by earlier ones
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(queue,) + args)
+    process.start()
+    status, payload = queue.get()
+    process.join()
+    if status == "error":
+        return dict(error=payload)
+    return payload
+
+
+def _load(target, mode, options, log):
+    """Creates the benchmark table and loads the rows every scenario but connect reads."""
+    log.write("{} loading {} rows...\n".format(target.name, options["rows"]))
+    db = target.backend(mode)
+    try:
+        target.setup(db)
+        target.bulk_insert(db, options["rows"], options["batch_size"])
+    finally:
+        db.close()
+
+
+def _cases(target_name, modes, scenarios):
+    """Yields (mode, scenario, variant)."""
+    for mode in modes:
+        for scenario in SCENARIOS:
+            if scenario not in scenarios:
+                continue
+            if scenario == "scan":
+                for variant in SCAN_VARIANTS[target_name]:
+                    yield mode, scenario, variant
+            else:
+                yield mode, scenario, None
+
+
+def run(targets, modes, scenarios, options, log=sys.stderr):
+    """Runs the scenarios for every target and mode and returns the results document."""
+    results = []
+    for target_name in targets:
+        target = TARGETS[target_name]()
+        target_modes = [m for m in modes if m in target.modes]
+        if not target_modes:
+            continue
+        loaded = bool(set(scenarios) - set(["connect"]))
+        if loaded:
+            _load(target, target_modes[0], options, log)
+        for mode, scenario, variant in _cases(target_name, target_modes, scenarios):
+            label = " ".join(part for part in (target_name, mode, scenario, variant) if part)
+            log.write("{}...\n".format(label))
+            metrics = _in_process(target_name, mode, scenario, variant, options)
+            results.append(
+                dict(
+                    backend=target_name,
+                    mode=mode,
+                    scenario=scenario,
+                    variant=variant,
+                    metrics=metrics,
+                )
+            )
+        if loaded and not options["keep"]:
+            db = target.backend(target_modes[0])
+            try:
+                target.teardown(db)
+            except Exception as e:
+                log.write("{} teardown failed: {}\n".format(target_name, e))
+            finally:
+                db.close()
+
+    return dict(
+        meta=dict(
+            started_at=datetime.now().isoformat(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+            options=options,
+        ),
+        results=results,
+    )
+
+
+def _key(result):
+    return (result["backend"], result["mode"], result["scenario"], result["variant"])
+
+
+def _headline(metrics):
+    """The number compared between runs: p50 latency or rows per second."""
+    if "latency" in metrics:
+        return "p50 seconds", metrics["latency"]["p50"]
+    if "rows_per_second" in metrics:
+        return "rows/second", metrics["rows_per_second"]
+    return None, None
+
+
+def compare(baseline_path, current_path, out=sys.stdout):
+    """Prints the change of every scenario's headline number between two result files."""
+    with open(baseline_path) as f:
+        baseline = dict((_key(result), result) for result in json.load(f)["results"])
+    with open(current_path) as f:
+        current = json.load(f)["results"]
+
+    for result in current:
+        before = baseline.get(_key(result))
+        unit, value = _headline(result["metrics"])
+        label = " ".join(str(part) for part in _key(result) if part)
+        if before is None or value is None:
+            out.write("{:<50} {}\n".format(label, "n/a"))
+            continue
+        _, previous = _headline(before["metrics"])
+        if not previous:
+            out.write("{:<50} {}\n".format(label, "n/a"))
+            continue
+        out.write(
+            "{:<50} {:>14.6g} -> {:<14.6g} {:+.1%} ({})\n".format(
+                label, previous, value, value / previous - 1, unit
+            )
+        )
@@ -0,0 +1,240 @@
+import abc
+import os
+
+import six
+
+
+# rows loaded before the scenarios run and inserted again by the bulk insert scenario
+ROW = (0, 50000, "2000-01-01", "2001-01-01")
+
+
+def _rows(count):
+    for emp_no in range(count):
+        yield (emp_no,) + ROW[1:]
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Target(object):
+    """A backend under test and the statements each scenario runs against it."""
+
+    name = None
+    modes = ("connect_per_query", "pooled")
+
+    def __init__(self, pool_size=8):
+        self._pool_size = pool_size
+
+    @abc.abstractmethod
+    def backend(self, mode):
+        """Returns a backend instance configured for `mode`."""
+
+    @abc.abstractmethod
+    def setup(self, db):
+        """Creates an empty benchmark table."""
+
+    @abc.abstractmethod
+    def teardown(self, db):
+        """Drops the benchmark table."""
+
+    def connect(self, db):
+        # a new connection per query, a checkout and return when pooled
+        connection = db._acquire()
+        db._release(connection)
+
+    @abc.abstractmethod
+    def point_query(self, db, key):
+        """Reads the row with the `key`."""
+
+    @abc.abstractmethod
+    def bulk_insert(self, db, count, batch_size):
+        """Inserts `count` rows, `batch_size` at a time, and returns the number inserted."""
+
+    @abc.abstractmethod
+    def scan(self, db, variant, chunk_size):
+        """Reads the whole table and returns the number of rows read."""
+
+    def _pool_kwargs(self, mode):
+        return dict(pool_size=self._pool_size) if mode == "pooled" else dict()
+
+
+class _SQLTarget(Target):
+    table = None
+    create_table = None
+    drop_table = None
+
+    def setup(self, db):
+        db.execute(self.drop_table)
+        db.execute(self.create_table)
+
+    def teardown(self, db):
+        db.execute(self.drop_table)
+
+    def point_query(self, db, key):
+        db.execute(
+            "SELECT * FROM {} WHERE emp_no = %s".format(self.table), (key,)
+        )
+
+    def bulk_insert(self, db, count, batch_size):
+        query = (
+            "INSERT INTO {} (emp_no, salary, from_date, to_date)"
+            " VALUES (%s, %s, %s, %s)".format(self.table)
+        )
+        return db.execute_many(query, _rows(count), batch_size=batch_size)
+
+    def scan(self, db, variant, chunk_size):
+        query = "SELECT * FROM {}".format(self.table)
+        if variant == "buffered":
+            return len(db.execute(query)[2])
+        if variant == "columns":
+            return db.execute(query, result_format="columns")[0]
+        if variant == "stream":
+            return sum(1 for _ in db.execute(query, stream=True))
+        if variant == "stream_tuples":
+            return sum(1 for _ in db.execute(query, stream=True, row_type="tuple"))
+        if variant == "stream_chunks":
+            chunks = db.execute(query, stream=True, chunk_size=chunk_size)
+            return sum(len(chunk) for chunk in chunks)
+        raise ValueError("Unknown scan variant {!r}".format(variant))
+
+
+class MySQLTarget(_SQLTarget):
+    name = "mysql"
+
+    def __init__(self, pool_size=8):
+        super(MySQLTarget, self).__init__(pool_size)
+        # a database of the benchmark's own, dropped afterwards unless kept
+        self._database = os.environ.get("MYSQL_BENCH_DB") or "rapyd_db_bench"
+        self.table = "`{}`.rapyd_db_bench".format(self._database)
+        self.create_table = (
+            "CREATE TABLE {} ("
+            " emp_no int NOT NULL PRIMARY KEY,"
+            " salary int NOT NULL,"
+            " from_date date NOT NULL,"
+            " to_date date NOT NULL)".format(self.table)
+        )
+        self.drop_table = "DROP TABLE IF EXISTS {}".format(self.table)
+
+    def backend(self, mode):
+        from rapyd_db.backends.mysql import MySQL
+
+        return MySQL(
+            host=os.environ.get("MYSQL_HOST") or "127.0.0.1",
+            port=int(os.environ.get("MYSQL_PORT") or 3306),
+            user=os.environ.get("MYSQL_USER") or "root",
+            password=os.environ.get("MYSQL_PASSWORD") or "rapyd_db",
+            **self._pool_kwargs(mode)
+        )
+
+    def setup(self, db):
+        db.execute("CREATE DATABASE IF NOT EXISTS `{}`".format(self._database))
+        super(MySQLTarget, self).setup(db)
+
+    def teardown(self, db):
+        db.execute("DROP DATABASE IF EXISTS `{}`".format(self._database))
+
+
+class MSSQLTarget(_SQLTarget):
+    name = "mssql"
+    table = "rapyd_db_bench"
+    create_table = (
+        "CREATE TABLE rapyd_db_bench ("
+        " emp_no int NOT NULL PRIMARY KEY,"
+        " salary int NOT NULL,"
+        " from_date date NOT NULL,"
+        " to_date date NOT NULL)"
+    )
+    drop_table = "DROP TABLE IF EXISTS rapyd_db_bench"
+
+    def backend(self, mode):
+        from rapyd_db.backends.mssql import MSSQL
+
+        return MSSQL(
+            host=os.environ.get("MSSQL_HOST") or "127.0.0.1",
+            port=int(os.environ.get("MSSQL_PORT") or 1433),
+            user=os.environ.get("MSSQL_USER") or "sa",
+            password=os.environ.get("MSSQL_PASSWORD") or "Rapyd_db1",
+            database=os.environ.get("MSSQL_TEST_DB") or "tempdb",
+            **self._pool_kwargs(mode)
+        )
+
+
+class MongoTarget(Target):
+    name = "mongo"
+
+    def __init__(self, pool_size=8):
+        super(MongoTarget, self).__init__(pool_size)
+        self._database = os.environ.get("MONGO_TEST_DB") or "rapyd_db_bench"
+        self._collection = "rapyd_db_bench"
+
+    def backend(self, mode):
+        from rapyd_db.backends.mongo import Mongo
+
+        return Mongo(
+            host=os.environ.get("MONGO_HOST") or "127.0.0.1",
+            port=int(os.environ.get("MONGO_PORT") or 27017),
+            username=os.environ.get("MONGO_USERNAME") or "root",
+            password=os.environ.get("MONGO_PASSWORD") or "rapyd_db",
+            **self._pool_kwargs(mode)
+        )
+
+    def connect(self, db):
+        # clients connect lazily so a round trip is needed to measure the handshake; the
+        # pooled client is shared and only checks a socket out of its pool
+        client = db._acquire()
+        client.admin.command("ping")
+        db._release(client)
+
+    def setup(self, db):
+        self.teardown(db)
+        # point queries look documents up by emp_no
+        db.execute(
+            "create_index",
+            "emp_no",
+            unique=True,
+            database=self._database,
+            collection=self._collection,
+        )
+
+    def teardown(self, db):
+        db.execute("drop_collection", self._collection, database=self._database)
+
+    def point_query(self, db, key):
+        db.execute(
+            "find",
+            {"emp_no": key},
+            database=self._database,
+            collection=self._collection,
+        )
+
+    def bulk_insert(self, db, count, batch_size):
+        keys = ("emp_no", "salary", "from_date", "to_date")
+        summary = db.bulk_write_stream(
+            self._database,
+            self._collection,
+            (dict(zip(keys, row)) for row in _rows(count)),
+            batch_size=batch_size,
+        )
+        if summary["errors"]:
+            raise RuntimeError("Bulk insert failed: {!r}".format(summary["errors"][0]))
+        return summary["inserted"]
+
+    def scan(self, db, variant, chunk_size):
+        kwargs = dict(database=self._database, collection=self._collection)
+        if variant == "buffered":
+            return len(db.execute("find", {}, **kwargs))
+        if variant == "stream":
+            return sum(1 for _ in db.execute("find", {}, stream=True, **kwargs))
+        if variant == "stream_chunks":
+            chunks = db.execute("find", {}, stream=True, chunk_size=chunk_size, **kwargs)
+            return sum(len(chunk) for chunk in chunks)
+        raise ValueError("Unknown scan variant {!r}".format(variant))
+
+
+TARGETS = dict(
+    (target.name, target) for target in (MySQLTarget, MSSQLTarget, MongoTarget)
+)
+
+SCAN_VARIANTS = dict(
+    mysql=("buffered", "columns", "stream", "stream_tuples", "stream_chunks"),
+    mssql=("buffered", "columns", "stream", "stream_tuples", "stream_chunks"),
+    mongo=("buffered", "stream", "stream_chunks"),
+)
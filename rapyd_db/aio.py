@@ -0,0 +1,185 @@
+"""
+Asyncio front-ends for the backends. Requires python 3.6 or later.
+
+Queries run on the regular backends in a bounded pool of worker threads so the event
+loop is never blocked, while pooling, caching, logging and instrumentation of the
+wrapped backend keep working as they do for synchronous callers.
+"""
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+
+# items read from a streaming generator per trip to a worker thread
+DEFAULT_PREFETCH = 500
+
+
+class AsyncBackend(object):
+    """
+    Runs the methods of a backend instance in a bounded pool of worker threads.
+
+    At most `max_workers` calls run at a time. Further callers wait on a semaphore
+    without queueing work in the executor, which gives backpressure under load.
+    """
+
+    def __init__(self, backend, max_workers=None, prefetch=DEFAULT_PREFETCH):
+        """
+        :param AbstractBackend backend: The backend instance to run queries on.
+        :param int max_workers:
+            Maximum number of queries running at a time. Defaults to the number of
+            connections the backend can open concurrently when pooled, or 4.
+        :param int prefetch:
+            Rows (or chunks when `chunk_size` is given) read per worker call while
+            streaming. Defaults to 500.
+        """
+        self._backend = backend
+        self._max_workers = max_workers or self._default_workers()
+        self._prefetch = prefetch
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        # created on first use so it belongs to the running event loop
+        self._semaphore = None
+
+    @property
+    def backend(self):
+        """The wrapped synchronous backend."""
+        return self._backend
+
+    def _default_workers(self):
+        pool = self._backend._pool
+        if pool is not None:
+            return pool._pool_size + pool._max_overflow
+        return 4
+
+    def _slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_workers)
+        return self._semaphore
+
+    def _call(self, func, *args, **kwargs):
+        return asyncio.get_event_loop().run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def _run(self, func, *args, **kwargs):
+        async with self._slot():
+            return await self._call(func, *args, **kwargs)
+
+    async def _iterate(self, open_stream):
+        """Pulls items from the generator returned by `open_stream` in a worker thread."""
+        # a stream keeps its connection between reads so it holds a slot until it ends,
+        # otherwise streams waiting for a connection could take every worker thread
+        async with self._slot():
+            generator = await self._call(open_stream)
+            prefetch = self._prefetch
+            try:
+                while True:
+                    items = await self._call(lambda: list(islice(generator, prefetch)))
+                    for item in items:
+                        yield item
+                    if len(items) < prefetch:
+                        break
+            finally:
+                # releases the connection held by the generator when iteration stops early
+                await self._call(generator.close)
+
+    async def close(self):
+        """Closes the backend and stops the worker threads."""
+        try:
+            await self._run(self._backend.close)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class _AsyncSQLBackend(AsyncBackend):
+    async def execute(self, query, params=None, **kwargs):
+        """
+        Executes the query in a worker thread and returns the result.
+        Takes the same arguments as the backend's `execute()` except `stream`; use `stream()`.
+        """
+        if kwargs.get("stream"):
+            raise ValueError("Use stream() to stream results")
+        return await self._run(self._backend.execute, query, params, **kwargs)
+
+    def stream(self, query, params=None, **kwargs):
+        """
+        Executes the query and returns an asynchronous iterator over the rows, or lists of
+        rows when `chunk_size` is given, to be consumed with `async for`.
+        Takes the same arguments as the backend's `execute()`.
+        """
+        kwargs["stream"] = True
+        return self._iterate(
+            functools.partial(self._backend.execute, query, params, **kwargs)
+        )
+
+    async def execute_many(self, query, rows, batch_size=1000):
+        """Runs the backend's `execute_many()` in a worker thread."""
+        return await self._run(self._backend.execute_many, query, rows, batch_size)
+
+
+class AsyncMySQL(_AsyncSQLBackend):
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the arguments of `MySQL` plus `max_workers` and `prefetch` of `AsyncBackend`.
+        """
+        from .backends.mysql import MySQL
+
+        max_workers = kwargs.pop("max_workers", None)
+        prefetch = kwargs.pop("prefetch", DEFAULT_PREFETCH)
+        super(AsyncMySQL, self).__init__(MySQL(*args, **kwargs), max_workers, prefetch)
+
+
+class AsyncMSSQL(_AsyncSQLBackend):
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the arguments of `MSSQL` plus `max_workers` and `prefetch` of `AsyncBackend`.
+        """
+        from .backends.mssql import MSSQL
+
+        max_workers = kwargs.pop("max_workers", None)
+        prefetch = kwargs.pop("prefetch", DEFAULT_PREFETCH)
+        super(AsyncMSSQL, self).__init__(MSSQL(*args, **kwargs), max_workers, prefetch)
+
+
+class AsyncMongo(AsyncBackend):
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the arguments of `Mongo` plus `max_workers` and `prefetch` of `AsyncBackend`.
+        """
+        from .backends.mongo import Mongo
+
+        max_workers = kwargs.pop("max_workers", None)
+        prefetch = kwargs.pop("prefetch", DEFAULT_PREFETCH)
+        super(AsyncMongo, self).__init__(Mongo(*args, **kwargs), max_workers, prefetch)
+
+    def _default_workers(self):
+        if self._backend._shared:
+            return self._backend._connection_params["maxPoolSize"]
+        return 4
+
+    async def execute(self, operation, *args, **kwargs):
+        """
+        Executes the operation in a worker thread and returns the result.
+        Takes the same arguments as the backend's `execute()` except `stream`; use `stream()`.
+        """
+        if kwargs.get("stream"):
+            raise ValueError("Use stream() to stream results")
+        return await self._run(self._backend.execute, operation, *args, **kwargs)
+
+    def stream(self, operation, *args, **kwargs):
+        """
+        Executes the operation and returns an asynchronous iterator over the documents,
+        or lists of documents when `chunk_size` is given, to be consumed with `async for`.
+        Takes the same arguments as the backend's `execute()`.
+        """
+        kwargs["stream"] = True
+        return self._iterate(
+            functools.partial(self._backend.execute, operation, *args, **kwargs)
+        )
@@ -1,44 +1,697 @@
 import abc
+import functools
 import logging
 
 import six
 
 from contextlib import contextmanager
 
+from ..cache import _cache_key, _is_read_only, _read_tags, _table_name, _write_tags
+from ..export import DEFAULT_BUFFER_SIZE, _check_export_format, _export
+from ..instrumentation import (
+    CONNECT_END,
+    CONNECT_START,
+    EVENTS,
+    FIRST_ROW,
+    STREAM_EXHAUSTED,
+    _ExecuteTimer,
+)
+from ..keyset import (
+    Page,
+    _decode_checkpoint,
+    _encode_checkpoint,
+    _keyset_condition,
+    _scope,
+    _with_retries,
+)
 from ..loggingadapter import LogIdAdapter
+from ..partition import _range_starts, _read_partitions
+from ..pool import ConnectionPool
+from ..results import _check_result_format, _check_row_type
+from ..stream import Stream
+from ..utils import _LogValue, _get_uuid, _monotonic
 
 _logger = logging.getLogger(__name__)
 
 
 @six.add_metaclass(abc.ABCMeta)
 class AbstractBackend:
+    """
+    Instances can be shared by any number of threads. Their configuration is not changed
+    after `__init__`, every query checks out its own connection and per query options
+    such as the cursor class are applied to that connection only. Pools, caches and
+    listeners are safe for concurrent use. Sessions and transactions hold one connection
+    and belong to the thread which opened them.
+    """
+
     _connection_params = None
+    _pool = None
+    _cache = None
+    _single_flight = None
+    _log_max_length = None
+    _listeners = None
+    # driver errors after which a statement can be retried on a new connection
+    _transient_errors = ()
 
     @abc.abstractmethod
     def _connect(self):
         """Connects to the backend and returns a connection."""
 
+    def _ping(self, connection):
+        """Returns `False` or raises when a pooled connection is no longer usable."""
+        return True
+
+    def _reset(self, connection):
+        """Clears any session state before a connection is returned to the pool."""
+
+    def _is_read(self, *args, **kwargs):
+        """Whether `execute()` with these arguments only reads, so it can run on a replica."""
+        return False
+
+    def _replica_lag(self):
+        """Returns the seconds a replica is behind its primary or `None` when unknown."""
+        raise NotImplementedError(
+            "{} cannot measure replication lag".format(type(self).__name__)
+        )
+
+    def add_listener(self, event, callback):
+        """
+        Registers a callback for one of the events in `rapyd_db.instrumentation.EVENTS`.
+
+        The callback is called as `callback(event, **info)` in the thread running the query.
+        `info` always holds `backend` and `log_id` and, depending on the event, `query`,
+        `elapsed` (seconds from a monotonic clock since the matching start event),
+        `rows` and `error`. Exceptions raised by callbacks are logged and ignored.
+        """
+        if event not in EVENTS:
+            raise ValueError("Unknown event {!r}".format(event))
+        listeners = dict(self._listeners or {})
+        listeners[event] = listeners.get(event, ()) + (callback,)
+        # replaced rather than mutated so queries running in other threads are unaffected
+        self._listeners = listeners
+
+    def remove_listener(self, event, callback):
+        listeners = dict(self._listeners or {})
+        listeners[event] = tuple(
+            listener for listener in listeners.get(event, ()) if listener != callback
+        )
+        self._listeners = listeners
+
+    def _emit(self, event, **info):
+        listeners = self._listeners
+        if not listeners:
+            return
+        for callback in listeners.get(event, ()):
+            try:
+                callback(event, backend=self, **info)
+            except Exception:
+                _logger.exception("Listener for %s failed", event)
+
+    def _timer(self, log_id, query):
+        """Times a statement and emits its `execute_start` and `execute_end` events."""
+        return _ExecuteTimer(self, log_id, query)
+
+    def _first_row(self, timer):
+        self._emit(
+            FIRST_ROW, log_id=timer.log_id, query=timer.query, elapsed=timer.since_start()
+        )
+
+    def _stream_exhausted(self, timer, rows):
+        self._emit(
+            STREAM_EXHAUSTED,
+            log_id=timer.log_id,
+            query=timer.query,
+            elapsed=timer.since_start(),
+            rows=rows,
+        )
+
+    def _log_payload(self, adapter, msg, *values):
+        """
+        Logs queries and parameters at INFO level. Values are only converted to text when
+        the message is emitted and are cut to `log_max_length` characters; a
+        `log_max_length` of 0 skips them altogether.
+        """
+        if self._log_max_length != 0 and adapter.isEnabledFor(logging.INFO):
+            adapter.info(
+                msg, *[_LogValue(value, self._log_max_length) for value in values]
+            )
+
+    def _init_pool(
+        self, pool_size, max_overflow=0, pool_timeout=30, pool_recycle=None
+    ):
+        """Sets up a connection pool when `pool_size` is given."""
+        if pool_size:
+            self._pool = ConnectionPool(
+                self._connect,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                timeout=pool_timeout,
+                recycle=pool_recycle,
+                ping=self._ping,
+                reset=self._reset,
+            )
+
+    def _acquire(self):
+        """Returns a connection from the pool if there is one or a new connection."""
+        if self._pool is not None:
+            return self._pool.acquire()
+        return self._connect()
+
+    def _release(self, connection):
+        """Hands the connection back to the pool if there is one or closes it."""
+        if self._pool is not None:
+            self._pool.release(connection)
+        else:
+            connection.close()
+
+    @property
+    def cache(self):
+        """The `QueryCache` results are served from, if any."""
+        return self._cache
+
+    @property
+    def single_flight(self):
+        """The `SingleFlight` coalescing identical concurrent reads, if `coalesce` is on."""
+        return self._single_flight
+
+    def _through_cache(self, query, params, run, use_cache=True, *options):
+        """
+        Serves read-only queries from the result cache when there is one, calling `run`
+        only on a miss, and shares one call of `run` between identical read-only queries
+        running at the same time when coalescing. Any other query invalidates the cached
+        results of the tables it writes.
+        """
+        if self._cache is None and self._single_flight is None:
+            return run()
+        if not _is_read_only(query):
+            try:
+                return run()
+            finally:
+                self._invalidate_cache(query)
+        if not use_cache:
+            return run()
+
+        key = _cache_key(query, params, *options)
+        if self._single_flight is not None:
+            run = functools.partial(self._single_flight.do, key, run)
+        if self._cache is None:
+            return run()
+        hit, result = self._cache.get(key)
+        if not hit:
+            tags = _read_tags(query)
+            generation = self._cache.generation(tags)
+            result = run()
+            self._cache.set(key, result, tags=tags, generation=generation)
+        return result
+
+    def _invalidate_cache(self, query):
+        """
+        Drops cached results of the tables a write query changes, or all of them when the
+        tables cannot be told, e.g. for stored procedures or multi-table updates.
+        """
+        if self._cache is None:
+            return
+        tags = _write_tags(query)
+        if tags is None:
+            self._cache.clear()
+        elif tags:
+            self._cache.invalidate_tags(*tags)
+
+    def _invalidate_table(self, table):
+        """Drops cached results of a table written to other than by a query, e.g. bulk loads."""
+        if self._cache is not None:
+            self._cache.invalidate_tags(_table_name(table))
+
+    def close(self):
+        """Closes all idle pooled connections. A no-op when pooling is not used."""
+        if self._pool is not None:
+            self._pool.dispose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def execute(self, stream=False, *args, **kwargs):
         """Executes the query and returns the result."""
 
 
+class AbstractSQLBackend(AbstractBackend):
+    """
+    Adds sessions, transactions, exports, paged and parallel scans to backends speaking DB-API.
+    """
+
+    def _is_read(self, query, *args, **kwargs):
+        return _is_read_only(query)
+
+    @contextmanager
+    def session(self, autocommit=True):
+        """
+        Holds a single connection for running many statements through the returned `Session`.
+
+        :param bool autocommit:
+            When `True` (default) every statement is committed as it runs. Otherwise nothing
+            is committed until `Session.commit()` is called and anything left uncommitted
+            is rolled back when the session ends.
+        """
+        with get_connection(self, _get_uuid()) as connection:
+            connection.autocommit(autocommit)
+            session = Session(self, connection, autocommit)
+            try:
+                yield session
+            finally:
+                if session._uncommitted:
+                    session.rollback()
+
+    @contextmanager
+    def transaction(self):
+        """
+        A session running all statements in one transaction, committed when the block
+        completes and rolled back if it raises.
+        """
+        with self.session(autocommit=False) as session:
+            yield session
+            session.commit()
+
+    def export(
+        self,
+        query,
+        path,
+        format="csv",
+        params=None,
+        chunk_size=10000,
+        compression=None,
+        buffer_size=DEFAULT_BUFFER_SIZE,
+        **options
+    ):
+        """
+        Streams the result of a query into a file, `chunk_size` rows at a time so memory
+        use does not grow with the number of rows.
+
+        :param str query: The query to execute.
+        :param str path: File to write.
+        :param str format:
+            `csv` (default), `arrow` for an Arrow IPC file or `parquet`.
+            The latter two require pyarrow.
+        :param tuple params: A tuple of parameters for substitution prior to executing the query.
+        :param int chunk_size:
+            Rows read and written at a time. Also the size of Arrow record batches and
+            Parquet row groups. Defaults to 10000.
+        :param str compression:
+            `gzip`, `bz2` or `xz` for csv. For arrow `lz4` or `zstd` and for parquet any codec
+            pyarrow supports, e.g. `snappy` (pyarrow's default) or `zstd`.
+            By default csv and arrow files are not compressed.
+        :param int buffer_size: Bytes buffered before writing to the file. Defaults to 1 MiB.
+        :param options:
+            For csv, `header` (default `True`), `encoding` (default `utf-8`) and any
+            `csv.writer()` format parameters, e.g. `delimiter`. For arrow and parquet,
+            `schema`, a `pyarrow.Schema` to use instead of the one inferred from the first
+            chunk, which is needed when a column is NULL throughout it.
+        :return:
+            A dictionary of the `rows` written, the `seconds` taken, `rows_per_second`
+            and the `bytes` of the file.
+        """
+        _check_export_format(format, compression)
+        # the header or schema of a file without rows
+        columns = []
+        # stops the query on the server if writing the file fails
+        with Stream(
+            functools.partial(
+                self._stream,
+                query,
+                params,
+                chunk_size,
+                "record",
+                columns_hook=columns.extend,
+            )
+        ) as chunks:
+            return _export(
+                chunks, path, format, compression, buffer_size, columns, **options
+            )
+
+    def keyset_pages(
+        self,
+        table,
+        key,
+        page_size=1000,
+        columns="*",
+        where=None,
+        params=None,
+        checkpoint=None,
+        row_type="dict",
+        retries=0,
+        retry_delay=1,
+    ):
+        """
+        Reads a table page by page in `key` order, each page with its own short query
+        continuing after the last key read, instead of one long running server side cursor.
+        Returns a generator of `Page` tuples of `rows` and a `checkpoint` string which can be
+        stored and passed back in to resume reading after that page, e.g. after a failure.
+        `table`, `key`, `columns` and `where` are put into the SQL as is and must be trusted.
+
+        :param str table: Table to read.
+        :param key:
+            Name of a unique, non NULL column to order by, or a tuple of names
+            when only their combination is unique, e.g. `("emp_no", "from_date")`.
+            The column(s) must be selected and should be indexed.
+        :param int page_size: Rows per page. Defaults to 1000.
+        :param str columns: Columns to select. Defaults to all.
+        :param str where:
+            Optional condition rows have to meet, with `%s` placeholders for `params`.
+        :param tuple params: Parameters for `where`.
+        :param str checkpoint:
+            A checkpoint of a previous page to resume after. It has to come from a read of
+            the same table, key, columns and condition.
+        :param str row_type: `dict` (default), `tuple` or `record`.
+        :param int retries:
+            Times a page is read again after a connection error before giving up.
+            Defaults to 0.
+        :param float retry_delay: Seconds before the first retry, doubled for every next one.
+        """
+        _check_row_type(row_type)
+        keys = [key] if isinstance(key, six.string_types) else list(key)
+        scope = _scope(table, tuple(keys), columns, where)
+        last = None
+        if checkpoint is not None:
+            last = _decode_checkpoint(scope, checkpoint)
+            if len(last) != len(keys):
+                raise ValueError("The checkpoint was taken for a different key")
+        return self._keyset_pages(
+            table,
+            keys,
+            page_size,
+            columns,
+            where,
+            tuple(params or ()),
+            last,
+            scope,
+            row_type,
+            retries,
+            retry_delay,
+        )
+
+    def _keyset_pages(
+        self,
+        table,
+        keys,
+        page_size,
+        columns,
+        where,
+        params,
+        last,
+        scope,
+        row_type,
+        retries,
+        retry_delay,
+    ):
+        keyset, positions = _keyset_condition(keys)
+        # key values of tuples are found by name through records
+        fetch_type = "record" if row_type == "tuple" else row_type
+        while True:
+            conditions = [] if where is None else ["({})".format(where)]
+            page_params = params
+            if last is not None:
+                conditions.append(keyset)
+                page_params += tuple(last[position] for position in positions)
+            query = self._select_page(
+                columns, table, " AND ".join(conditions), ", ".join(keys), page_size
+            )
+            _, _, rows = _with_retries(
+                functools.partial(
+                    self.execute,
+                    query,
+                    page_params or None,
+                    row_type=fetch_type,
+                    use_cache=False,
+                ),
+                self._transient_errors,
+                retries,
+                retry_delay,
+            )
+            if not rows:
+                return
+            if fetch_type == "dict":
+                last = [rows[-1][key] for key in keys]
+            else:
+                last = [getattr(rows[-1], key) for key in keys]
+            if row_type == "tuple":
+                rows = [tuple(row) for row in rows]
+            yield Page(rows, _encode_checkpoint(scope, last))
+            if len(rows) < page_size:
+                return
+
+    def _select_page(self, columns, table, condition, order_by, limit):
+        """Returns a query for the first `limit` rows in `order_by` order meeting `condition`."""
+        return "SELECT {} FROM {}{} ORDER BY {} LIMIT {}".format(
+            columns,
+            table,
+            " WHERE {}".format(condition) if condition else "",
+            order_by,
+            int(limit),
+        )
+
+    def parallel_scan(
+        self,
+        table,
+        key,
+        partitions=4,
+        columns="*",
+        where=None,
+        params=None,
+        split="range",
+        ordered=False,
+        chunk_size=None,
+        row_type="dict",
+        queue_size=1000,
+        timeout=None,
+    ):
+        """
+        Reads a whole table by splitting it into ranges of `key` and streaming each range over
+        its own connection concurrently. Returns a generator like `execute(stream=True)`.
+        `table`, `key`, `columns` and `where` are put into the SQL as is and must be trusted.
+        Rows where `key` is NULL are not read.
+
+        :param str table: Table to read.
+        :param str key: Indexed column to split on, usually the primary key.
+        :param int partitions:
+            Number of ranges read concurrently. Each holds a connection, so with pooling
+            `pool_size + max_overflow` must allow for that many.
+        :param str columns: Columns to select. Defaults to all.
+        :param str where:
+            Optional condition rows have to meet, with `%s` placeholders for `params`.
+        :param tuple params: Parameters for `where`.
+        :param str split:
+            `range` (default) splits between the minimum and maximum of a numeric or date
+            `key` into ranges of equal width. `ntile` splits any sortable `key` into ranges of
+            equal row counts using `NTILE()`, which costs a scan of the key's index.
+        :param bool ordered:
+            When `True`, rows are yielded in `key` order. Only the range being yielded and
+            the next one are read at a time, up to `queue_size` rows ahead, so a server does
+            not stop a range left unread. By default rows are yielded as they arrive.
+        :param int chunk_size: Yield lists of up to this many rows instead of single rows.
+        :param str row_type: `dict` (default), `tuple` or `record`.
+        :param int queue_size: Rows, or chunks, read ahead per range. Defaults to 1000.
+        :param float timeout:
+            Seconds to wait for a range's next row before raising `ScanTimeout`. A failing
+            range raises its own error.
+        """
+        _check_row_type(row_type)
+        conditions = [] if where is None else ["({})".format(where)]
+        params = tuple(params or ())
+        starts = self._scan_starts(table, key, partitions, conditions, params, split)
+
+        streams = []
+        for index, start in enumerate(starts):
+            bounds = ["{} >= %s".format(key)]
+            range_params = (start,)
+            if index + 1 < len(starts):
+                bounds.append("{} < %s".format(key))
+                range_params += (starts[index + 1],)
+            query = "SELECT {} FROM {} WHERE {}".format(
+                columns, table, " AND ".join(conditions + bounds)
+            )
+            if ordered:
+                query += " ORDER BY {}".format(key)
+            streams.append(
+                (
+                    index,
+                    # closing a range left unread stops its query on the server
+                    functools.partial(
+                        Stream,
+                        functools.partial(
+                            self._stream,
+                            query,
+                            params + range_params,
+                            chunk_size,
+                            row_type,
+                        ),
+                    ),
+                )
+            )
+        return _read_partitions(streams, ordered, timeout, queue_size)
+
+    def _scan_starts(self, table, key, partitions, conditions, params, split):
+        """Returns the lowest `key` of every range `parallel_scan()` reads."""
+        where = " WHERE {}".format(" AND ".join(conditions)) if conditions else ""
+        if split == "range":
+            _, _, rows = self.execute(
+                "SELECT MIN({key}) AS lo, MAX({key}) AS hi FROM {table}{where}".format(
+                    key=key, table=table, where=where
+                ),
+                params or None,
+                use_cache=False,
+            )
+            if not rows or rows[0]["lo"] is None:
+                return []
+            try:
+                return _range_starts(rows[0]["lo"], rows[0]["hi"], partitions)
+            except TypeError:
+                raise ValueError(
+                    "Column {} cannot be split into ranges of equal width; "
+                    "use split='ntile'".format(key)
+                )
+        if split == "ntile":
+            conditions = conditions + ["{} IS NOT NULL".format(key)]
+            _, _, rows = self.execute(
+                "SELECT MIN({key}) AS lo FROM ("
+                "SELECT {key}, NTILE({partitions}) OVER (ORDER BY {key}) AS part"
+                " FROM {table} WHERE {where}"
+                ") AS parts GROUP BY part ORDER BY lo".format(
+                    key=key,
+                    partitions=int(partitions),
+                    table=table,
+                    where=" AND ".join(conditions),
+                ),
+                params or None,
+                use_cache=False,
+            )
+            return [row["lo"] for row in rows]
+        raise ValueError("split must be one of range, ntile, not {!r}".format(split))
+
+
+class Session(object):
+    """
+    Runs many statements over one connection of a SQL backend.
+    Instances are returned by `session()` and `transaction()` of the backend.
+    Streamed results must be read to the end before the next statement is run.
+    """
+
+    def __init__(self, backend, connection, autocommit=True):
+        self._backend = backend
+        self._connection = connection
+        self._autocommit = autocommit
+        # writes whose cached results are invalidated once they are committed
+        self._pending = []
+        # whether statements have run since the last commit or rollback
+        self._uncommitted = False
+
+    @property
+    def connection(self):
+        """The underlying driver connection."""
+        return self._connection
+
+    def execute(
+        self,
+        query,
+        params=None,
+        stream=False,
+        chunk_size=None,
+        result_format="rows",
+        row_type="dict",
+    ):
+        """
+        Executes the query on the session's connection.
+        Takes the same arguments and returns the same results as the backend's `execute()`
+        except that results are never served from the cache and streams have no timeout.
+        """
+        _check_result_format(result_format, stream)
+        _check_row_type(row_type)
+        self._uncommitted = not self._autocommit
+        if stream:
+            return Stream(
+                functools.partial(
+                    self._backend._stream,
+                    query,
+                    params,
+                    chunk_size,
+                    row_type,
+                    connection=self._connection,
+                )
+            )
+        result = self._backend._no_stream(
+            query,
+            params,
+            chunk_size,
+            result_format,
+            row_type,
+            connection=self._connection,
+        )
+        if not _is_read_only(query):
+            self._written(query)
+        return result
+
+    def execute_many(self, query, rows, batch_size=1000):
+        """Same as the backend's `execute_many()` but nothing is committed per batch."""
+        self._uncommitted = not self._autocommit
+        try:
+            return self._backend.execute_many(
+                query, rows, batch_size, connection=self._connection
+            )
+        finally:
+            self._written(query)
+
+    def commit(self):
+        self._connection.commit()
+        self._uncommitted = False
+        for query in self._pending:
+            self._backend._invalidate_cache(query)
+        self._pending = []
+
+    def rollback(self):
+        self._connection.rollback()
+        self._uncommitted = False
+        self._pending = []
+
+    def _written(self, query):
+        if self._autocommit:
+            self._backend._invalidate_cache(query)
+        else:
+            self._pending.append(query)
+
+
 @contextmanager
-def get_connection(backend, log_id=None):
-    """Returns a DB connection."""
+def get_connection(backend, log_id=None, connection=None):
+    """
+    Returns a DB connection.
+    When `connection` is given, it is used as is and left open for its owner.
+    """
+    if connection is not None:
+        yield connection
+        return
+
     adapter = LogIdAdapter(_logger, dict(log_id=log_id))
 
+    backend._emit(CONNECT_START, log_id=log_id)
+    connect_start = _monotonic()
     try:
         adapter.info("Connecting to DB")
-        connection = backend._connect()
-    except:
+        connection = backend._acquire()
+    except Exception as e:
+        backend._emit(
+            CONNECT_END, log_id=log_id, elapsed=_monotonic() - connect_start, error=e
+        )
         adapter.exception("Cannot connect to DB")
         raise
+    backend._emit(
+        CONNECT_END, log_id=log_id, elapsed=_monotonic() - connect_start, error=None
+    )
 
     try:
         yield connection
     finally:
         try:
             adapter.info("Closed connection to DB")
-            connection.close()
+            backend._release(connection)
         except:
             pass
@@ -1,15 +1,59 @@
+import atexit
+import functools
 import logging
+import numbers
+import threading
 
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import InsertOne, MongoClient
+from pymongo.command_cursor import CommandCursor
+from pymongo.cursor import Cursor
+from pymongo.errors import BulkWriteError, ConnectionFailure
 
 from . import AbstractBackend, get_connection
+from ..keyset import (
+    Page,
+    _decode_checkpoint,
+    _encode_checkpoint,
+    _scope,
+    _with_retries,
+)
 from ..loggingadapter import LogIdAdapter
-from ..utils import _assign_if_not_none, _get_uuid
+from ..partition import _range_starts, _read_partitions
+from ..singleflight import SingleFlight
+from ..stream import Stream, _check_timeout
+from ..utils import _assign_if_not_none, _batched, _get_uuid
 
 
 _logger = logging.getLogger(__name__)
 
+# decodes documents lazily, only the fields accessed
+_RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+# operations with a `_raw_batches` variant returning undecoded batches
+_RAW_BATCH_OPERATIONS = ("find", "aggregate")
+
+# collection methods which only read and can run on a replica set secondary
+_READ_OPERATIONS = (
+    "find",
+    "find_one",
+    "find_raw_batches",
+    "aggregate",
+    "aggregate_raw_batches",
+    "count_documents",
+    "estimated_document_count",
+    "distinct",
+)
+
+
+def _describe(operation, database=None, collection=None):
+    """Names an operation for instrumentation, e.g. `find test_db.salaries`."""
+    namespace = ".".join(name for name in (database, collection) if name is not None)
+    return "{} {}".format(operation, namespace) if namespace else operation
+
 
 class Mongo(AbstractBackend):
     def __init__(
@@ -19,6 +63,9 @@ class Mongo(AbstractBackend):
         password=None,
         auth_source="admin",
         connect_timeout_ms=2000,
+        pool_size=None,
+        coalesce=False,
+        log_max_length=None,
         **kwargs
     ):
         """
@@ -31,10 +78,22 @@ class Mongo(AbstractBackend):
         :param int connect_timeout_ms:
             How long to wait when connecting to server before concluding server is unavailable.
             Defaults to 2000 (2 seconds).
+        :param int pool_size:
+            When set, a single `MongoClient` with `maxPoolSize=pool_size` is created on first use
+            and shared by every query and thread using this instance until `close()` is called
+            or the interpreter exits.
+            By default a new client is created and closed for every query.
+        :param bool coalesce:
+            When `True`, identical non streaming reads such as `find` or `aggregate`, including
+            their arguments, running at the same time share one execution and its result.
+            The shared result should not be modified.
+        :param int log_max_length:
+            Arguments are logged at INFO level cut to this many characters.
+            `0` does not log them at all. By default they are logged in full.
         :param kwargs:
             All other parameters supported by the MongoClient `__init__()` method.
             Refer https://api.mongodb.com/python/current/api/pymongo/mongo_client.html for additional examples.
-            Note: `maxPoolSize` is set to 1 only and cannot be changed.
+            Note: `maxPoolSize` is set to 1 unless `pool_size` is given.
             Note: `connect` is also set to False because a connection should only occur while querying
         """
         self._connection_params = dict()
@@ -47,11 +106,43 @@ class Mongo(AbstractBackend):
         )
         self._connection_params.update(kwargs)
         self._connection_params["connect"] = False
-        self._connection_params["maxPoolSize"] = 1
+        self._connection_params["maxPoolSize"] = pool_size or 1
+        self._shared = bool(pool_size)
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._log_max_length = log_max_length
+        if coalesce:
+            self._single_flight = SingleFlight()
 
     def _connect(self):
         return MongoClient(**self._connection_params)
 
+    def _acquire(self):
+        if not self._shared:
+            return self._connect()
+        # MongoClient is thread-safe so a single one is handed to every caller
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    client = self._connect()
+                    atexit.register(client.close)
+                    self._client = client
+        return self._client
+
+    def _release(self, connection):
+        if not self._shared:
+            connection.close()
+
+    def close(self):
+        """Closes the shared client if one was created. It is recreated on next use."""
+        with self._client_lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+            # not available on python 2 where the client simply stays registered
+            if hasattr(atexit, "unregister"):
+                atexit.unregister(client.close)
+
     def execute(self, operation, *args, **kwargs):
         """
         Executes the query and returns the result.
@@ -64,18 +155,38 @@ class Mongo(AbstractBackend):
             DB in a lazy fashion. Typically used when you want to
             return large volumes of data from the DB while while avoiding `MemoryError`.
             Parameters `database` and `collection` are required when `stream=True`.
+        :param int chunk_size:
+            When streaming, yield lists of up to this many documents instead of one document
+            at a time. The cursor's `batch_size` is set to match unless `batch_size` is given.
+        :param int batch_size:
+            When streaming, documents fetched from the server per round trip.
+        :param bool raw:
+            When streaming, yield `RawBSONDocument` objects which keep the BSON bytes as read
+            and only decode the fields accessed. Defaults to `False`.
+        :param bool raw_batches:
+            When streaming `find` or `aggregate`, yield the BSON bytes of every batch the
+            server sends as they are, using `find_raw_batches()` or
+            `aggregate_raw_batches()`. Nothing is decoded; use `bson.decode_all()` or
+            `bson.decode_iter()` for that. Cannot be combined with `chunk_size`.
+        :param float timeout:
+            When streaming, seconds after which the cursor is killed on the server and
+            reading the stream raises `QueryTimeout`.
         :param args:
             All other positional arguments supported by the method you are calling via operation.
         :param kwargs:
-            All other keyword arguments supported by the method you are calling via operation.
+            All other keyword arguments supported by the method you are calling via operation,
+            e.g. a `projection` for `find` so only the fields needed are sent and decoded.
         :return:
-            Returns a generator when `stream` is `True`. Otherwise returns a
-            the result of the method you are calling via operation.
+            Returns a `Stream` of the documents when `stream` is `True`, which can be closed
+            early or cancelled to kill the cursor on the server. Otherwise returns a list of
+            documents for methods returning a cursor and the result of the method as is for
+            others.
         """
         # in python 2 default arguments cannot be used with args and kwargs
         # https://stackoverflow.com/a/15302038/399435
         # so doing it this way
         stream = kwargs.pop("stream", False)
+        _check_timeout(kwargs.get("timeout"), stream)
 
         # the return has to be done this way to accommodate having
         # `yield` and `return` in the same method
@@ -83,10 +194,210 @@ class Mongo(AbstractBackend):
         # unfortunately there is a lot of code duplication here
         if stream:
             # when streaming, we want to keep results on the server side to reduce client side memory footprint
-            return self._stream(operation, *args, **kwargs)
+            timeout = kwargs.pop("timeout", None)
+            return Stream(
+                functools.partial(self._stream, operation, *args, **kwargs), timeout
+            )
+        elif self._single_flight is not None and self._is_read(operation, *args, **kwargs):
+            key = (operation, repr(args), repr(sorted(kwargs.items())))
+            return self._single_flight.do(
+                key, functools.partial(self._no_stream, operation, *args, **kwargs)
+            )
         else:
             return self._no_stream(operation, *args, **kwargs)
 
+    def _is_read(self, operation, *args, **kwargs):
+        if operation not in _READ_OPERATIONS:
+            return False
+        if operation.startswith("aggregate"):
+            pipeline = args[0] if args else kwargs.get("pipeline", [])
+            # these stages write their output to a collection
+            return not any("$out" in stage or "$merge" in stage for stage in pipeline)
+        return True
+
+    def _replica_lag(self):
+        """Seconds the last operation this member applied is behind the primary's."""
+        status = self.execute("command", "replSetGetStatus", database="admin")
+        members = status.get("members", [])
+        primary = [member for member in members if member.get("stateStr") == "PRIMARY"]
+        local = [member for member in members if member.get("self")]
+        if not primary or not local:
+            return None
+        return (primary[0]["optimeDate"] - local[0]["optimeDate"]).total_seconds()
+
+    def keyset_pages(
+        self,
+        database,
+        collection,
+        page_size=1000,
+        filter=None,
+        projection=None,
+        checkpoint=None,
+        retries=0,
+        retry_delay=1,
+    ):
+        """
+        Reads a collection page by page in `_id` order, each page with its own short query
+        continuing after the last `_id` read, instead of one long running cursor.
+        Returns a generator of `Page` tuples of `rows` and a `checkpoint` string which can be
+        stored and passed back in to resume reading after that page, e.g. after a failure.
+
+        :param str database: Database to use.
+        :param str collection: Collection to read.
+        :param int page_size: Documents per page. Defaults to 1000.
+        :param dict filter: Optional filter documents have to match.
+        :param projection: Optional projection passed to `find()`. `_id` must be included.
+        :param str checkpoint:
+            A checkpoint of a previous page to resume after. It has to come from a read of
+            the same collection and filter.
+        :param int retries:
+            Times a page is read again after a connection error before giving up.
+            Defaults to 0.
+        :param float retry_delay: Seconds before the first retry, doubled for every next one.
+        """
+        filter = dict(filter or {})
+        scope = _scope(database, collection, repr(sorted(filter.items())))
+        last = None
+        if checkpoint is not None:
+            last = _decode_checkpoint(scope, checkpoint)
+        return self._keyset_pages(
+            database,
+            collection,
+            page_size,
+            filter,
+            projection,
+            last,
+            scope,
+            retries,
+            retry_delay,
+        )
+
+    def _keyset_pages(
+        self,
+        database,
+        collection,
+        page_size,
+        filter,
+        projection,
+        last,
+        scope,
+        retries,
+        retry_delay,
+    ):
+        while True:
+            query = filter
+            if last is not None:
+                query = {"$and": [filter, {"_id": {"$gt": last[0]}}]}
+            rows = _with_retries(
+                functools.partial(
+                    self.execute,
+                    "find",
+                    query,
+                    projection,
+                    sort=[("_id", 1)],
+                    limit=page_size,
+                    database=database,
+                    collection=collection,
+                ),
+                (ConnectionFailure,),
+                retries,
+                retry_delay,
+            )
+            if not rows:
+                return
+            last = [rows[-1]["_id"]]
+            yield Page(rows, _encode_checkpoint(scope, last))
+            if len(rows) < page_size:
+                return
+
+    def parallel_scan(
+        self,
+        database,
+        collection,
+        partitions=4,
+        filter=None,
+        projection=None,
+        ordered=False,
+        chunk_size=None,
+        queue_size=1000,
+        timeout=None,
+    ):
+        """
+        Reads a whole collection by splitting it into `_id` ranges and streaming each range
+        with its own cursor concurrently. Returns a generator like `execute("find", stream=True)`.
+
+        :param str database: Database to use.
+        :param str collection: Collection to read.
+        :param int partitions:
+            Number of ranges read concurrently. Numeric and ObjectId `_id` values are split
+            into ranges of equal width, others into ranges of equal counts with `$bucketAuto`.
+            Each range holds a connection, so `pool_size` should allow for that many.
+        :param dict filter: Optional filter documents have to match.
+        :param projection: Optional projection passed to `find()`.
+        :param bool ordered:
+            When `True`, documents are yielded in `_id` order. Only the range being yielded
+            and the next one are read at a time, up to `queue_size` documents ahead, so a
+            server does not stop a range left unread. By default documents are yielded as
+            they arrive.
+        :param int chunk_size: Yield lists of up to this many documents instead of single ones.
+        :param int queue_size: Documents, or chunks, read ahead per range. Defaults to 1000.
+        :param float timeout:
+            Seconds to wait for a range's next document before raising `ScanTimeout`. A
+            failing range raises its own error.
+        """
+        filter = dict(filter or {})
+        starts = self._scan_starts(database, collection, partitions, filter)
+
+        streams = []
+        for index, start in enumerate(starts):
+            bounds = {"$gte": start}
+            if index + 1 < len(starts):
+                bounds["$lt"] = starts[index + 1]
+            if filter:
+                # keeps any condition on _id the filter has
+                range_filter = {"$and": [filter, {"_id": bounds}]}
+            else:
+                range_filter = {"_id": bounds}
+            kwargs = dict(database=database, collection=collection, chunk_size=chunk_size)
+            if ordered:
+                kwargs["sort"] = [("_id", 1)]
+            streams.append(
+                (
+                    index,
+                    # closing a range left unread stops its cursor on the server
+                    functools.partial(
+                        Stream,
+                        functools.partial(
+                            self._stream, "find", range_filter, projection, **kwargs
+                        ),
+                    ),
+                )
+            )
+        return _read_partitions(streams, ordered, timeout, queue_size)
+
+    def _scan_starts(self, database, collection, partitions, filter):
+        """Returns the lowest `_id` of every range `parallel_scan()` reads."""
+        with get_connection(self) as connection:
+            documents = connection[database][collection]
+            first = documents.find_one(filter, {"_id": 1}, sort=[("_id", 1)])
+            if first is None:
+                return []
+            last = documents.find_one(filter, {"_id": 1}, sort=[("_id", -1)])
+            lo, hi = first["_id"], last["_id"]
+            if isinstance(lo, ObjectId) and isinstance(hi, ObjectId):
+                # object ids sort like the 96 bit integers of their bytes
+                starts = _range_starts(int(str(lo), 16), int(str(hi), 16), partitions)
+                return [ObjectId("{:024x}".format(start)) for start in starts]
+            if isinstance(lo, numbers.Number) and isinstance(hi, numbers.Number):
+                return _range_starts(lo, hi, partitions)
+            buckets = documents.aggregate(
+                [
+                    {"$match": filter},
+                    {"$bucketAuto": {"groupBy": "$_id", "buckets": int(partitions)}},
+                ]
+            )
+            return [bucket["_id"]["min"] for bucket in buckets]
+
     def _stream(self, operation, *args, **kwargs):
         # setup logging
         log_id = _get_uuid()
@@ -95,35 +406,65 @@ class Mongo(AbstractBackend):
         # get some optional parms if present
         database = kwargs.pop("database", None)
         collection = kwargs.pop("collection", None)
+        chunk_size = kwargs.pop("chunk_size", None)
+        batch_size = kwargs.pop("batch_size", None)
+        raw = kwargs.pop("raw", False)
+        raw_batches = kwargs.pop("raw_batches", False)
+        cancel_hook = kwargs.pop("cancel_hook", None)
         if database is None or collection is None:
             raise KeyError(
                 "Parameters 'database' and 'collection' are required when stream=True"
             )
+        if raw_batches:
+            if operation not in _RAW_BATCH_OPERATIONS:
+                raise ValueError(
+                    "raw_batches is only supported for {}, not {!r}".format(
+                        ", ".join(_RAW_BATCH_OPERATIONS), operation
+                    )
+                )
+            if chunk_size:
+                raise ValueError("raw_batches cannot be combined with chunk_size")
+            operation = "{}_raw_batches".format(operation)
 
         with get_connection(self, log_id) as connection:
-            execution_start = datetime.now()
-            adapter.info("Using database {}".format(database))
-            adapter.info("Using collection {}".format(collection))
-            adapter.info("args: {}".format(args))
-            adapter.info("kwargs: {}".format(kwargs))
-            adapter.info(
-                "Started executing {} at {}".format(operation, execution_start)
-            )
-            adapter.info("Streaming results from DB.")
-            operation_callable = getattr(connection[database][collection], operation)
-            result = operation_callable(*args, **kwargs)
+            log_info = adapter.isEnabledFor(logging.INFO)
+            if log_info:
+                adapter.info("Using database %s", database)
+                adapter.info("Using collection %s", collection)
+                self._log_payload(adapter, "args: %s", args)
+                self._log_payload(adapter, "kwargs: %s", kwargs)
+                adapter.info("Started executing %s at %s", operation, datetime.now())
+                adapter.info("Streaming results from DB.")
+            documents = connection[database][collection]
+            if raw:
+                documents = documents.with_options(codec_options=_RAW_CODEC_OPTIONS)
+            operation_callable = getattr(documents, operation)
+            with self._timer(log_id, _describe(operation, database, collection)) as timer:
+                cursor = operation_callable(*args, **kwargs)
+            if cancel_hook is not None and hasattr(cursor, "close"):
+                # closing a cursor from any thread kills it on the server
+                cancel_hook(cursor.close)
+            result = cursor
+            batch_size = batch_size or chunk_size
+            if batch_size and hasattr(result, "batch_size"):
+                result.batch_size(batch_size)
+            if chunk_size:
+                result = _batched(result, chunk_size)
 
             # returns the generator object
+            result = iter(result)
+            # the first document is read on its own so timing it adds no work per document
+            for row in result:
+                self._first_row(timer)
+                yield row
+                break
             for row in result:
                 yield row
 
-            execution_end = datetime.now()
-            adapter.info(
-                "Executed in {} second(s)".format(
-                    (execution_end - execution_start).seconds
-                )
-            )
-            adapter.info("Ended {} execution at {}".format(operation, execution_end))
+            self._stream_exhausted(timer, getattr(cursor, "retrieved", None))
+            if log_info:
+                adapter.info("Executed in %.6f second(s)", timer.since_start())
+                adapter.info("Ended %s execution at %s", operation, datetime.now())
 
     def _no_stream(self, operation, *args, **kwargs):
         # setup logging
@@ -135,17 +476,16 @@ class Mongo(AbstractBackend):
         collection = kwargs.pop("collection", None)
 
         with get_connection(self, log_id) as connection:
-            execution_start = datetime.now()
-            if database is not None:
-                adapter.info("Using database {}".format(database))
-            if collection is not None:
-                adapter.info("Using collection {}".format(collection))
-            adapter.info("args: {}".format(args))
-            adapter.info("kwargs: {}".format(kwargs))
-            adapter.info(
-                "Started executing {} at {}".format(operation, execution_start)
-            )
-            adapter.info("Not streaming results from DB.")
+            log_info = adapter.isEnabledFor(logging.INFO)
+            if log_info:
+                if database is not None:
+                    adapter.info("Using database %s", database)
+                if collection is not None:
+                    adapter.info("Using collection %s", collection)
+                self._log_payload(adapter, "args: %s", args)
+                self._log_payload(adapter, "kwargs: %s", kwargs)
+                adapter.info("Started executing %s at %s", operation, datetime.now())
+                adapter.info("Not streaming results from DB.")
 
             if database is not None and collection is not None:
                 operation_callable = getattr(
@@ -155,13 +495,105 @@ class Mongo(AbstractBackend):
                 operation_callable = getattr(connection[database], operation)
             else:
                 operation_callable = getattr(connection, operation)
-            result = operation_callable(*args, **kwargs)
+            with self._timer(log_id, _describe(operation, database, collection)) as timer:
+                result = operation_callable(*args, **kwargs)
+                # cursors are read while the connection is open; other results such as
+                # `InsertManyResult` or `dict` are returned as they are
+                if isinstance(result, (Cursor, CommandCursor)):
+                    result = list(result)
+                if isinstance(result, list):
+                    timer.rows = len(result)
+
+            if log_info:
+                adapter.info("Executed in %.6f second(s)", timer.elapsed)
+                adapter.info("Ended %s execution at %s", operation, datetime.now())
+            return result
+
+    def bulk_write_stream(
+        self,
+        database,
+        collection,
+        operations,
+        batch_size=1000,
+        ordered=False,
+        **kwargs
+    ):
+        """
+        Sends write operations read from any iterable, including generators, to a collection
+        in `bulk_write` batches over a single client. Only `batch_size` operations are held
+        in memory at a time. Failed writes are collected and the following batches still sent.
 
-            execution_end = datetime.now()
-            adapter.info(
-                "Executed in {} second(s)".format(
-                    (execution_end - execution_start).seconds
+        :param str database: Database to use.
+        :param str collection: Collection to write to.
+        :param operations:
+            pymongo write operations, e.g. `InsertOne`, `UpdateOne(..., upsert=True)`,
+            `ReplaceOne` or `DeleteMany`. Plain documents are inserted.
+        :param int batch_size: Operations sent per `bulk_write`. Defaults to 1000.
+        :param bool ordered:
+            Whether the server stops a batch at its first error. Defaults to `False`,
+            which lets the server apply a batch's writes in parallel.
+        :param kwargs: All other keyword arguments supported by `bulk_write()`.
+        :return:
+            A dictionary of the `inserted`, `matched`, `modified`, `deleted` and `upserted`
+            counts, the number of `batches` sent and a list of `errors`, one per failed
+            batch, holding the `batch` number, the `offset` of its first operation and the
+            `write_errors` and `write_concern_errors` reported by the server.
+        """
+        log_id = _get_uuid()
+        adapter = LogIdAdapter(_logger, dict(log_id=log_id))
+        summary = dict(
+            inserted=0, matched=0, modified=0, deleted=0, upserted=0, batches=0, errors=[]
+        )
+
+        with get_connection(self, log_id) as connection:
+            documents = connection[database][collection]
+            log_info = adapter.isEnabledFor(logging.INFO)
+            if log_info:
+                adapter.info("Using database %s", database)
+                adapter.info("Using collection %s", collection)
+                adapter.info("Started executing bulk_write at %s", datetime.now())
+
+            offset = 0
+            description = _describe("bulk_write", database, collection)
+            with self._timer(log_id, description) as timer:
+                for batch in _batched(operations, batch_size):
+                    batch = [
+                        InsertOne(operation) if isinstance(operation, dict) else operation
+                        for operation in batch
+                    ]
+                    try:
+                        result = documents.bulk_write(batch, ordered=ordered, **kwargs)
+                        counts = result.bulk_api_result
+                    except BulkWriteError as e:
+                        counts = e.details
+                        summary["errors"].append(
+                            dict(
+                                batch=summary["batches"],
+                                offset=offset,
+                                write_errors=counts.get("writeErrors", []),
+                                write_concern_errors=counts.get("writeConcernErrors", []),
+                            )
+                        )
+                        adapter.warning(
+                            "Batch %s had %s write error(s)",
+                            summary["batches"],
+                            len(counts.get("writeErrors", [])),
+                        )
+                    summary["inserted"] += counts.get("nInserted", 0)
+                    summary["matched"] += counts.get("nMatched", 0)
+                    summary["modified"] += counts.get("nModified", 0)
+                    summary["deleted"] += counts.get("nRemoved", 0)
+                    summary["upserted"] += counts.get("nUpserted", 0)
+                    summary["batches"] += 1
+                    offset += len(batch)
+                timer.rows = offset
+
+            if log_info:
+                adapter.info(
+                    "%s operation(s) in %s batch(es) in %.6f second(s)",
+                    offset,
+                    summary["batches"],
+                    timer.elapsed,
                 )
-            )
-            adapter.info("Ended {} execution at {}".format(operation, execution_end))
-            return list(result)
+                adapter.info("Ended bulk_write execution at %s", datetime.now())
+        return summary
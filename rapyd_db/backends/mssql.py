@@ -1,18 +1,130 @@
+import functools
 import logging
 import pymssql
+import re
+import threading
 
 from datetime import datetime
 
-from . import AbstractBackend, get_connection
+from . import AbstractSQLBackend, get_connection
+from ..exceptions import PoolTimeout
 from ..loggingadapter import LogIdAdapter
-from ..utils import _assign_if_not_none, _get_uuid
+from ..results import (
+    _as_records,
+    _check_result_format,
+    _check_row_type,
+    _fetch_chunks,
+    _fetch_columns,
+)
+from ..singleflight import SingleFlight
+from ..stream import Stream, _cancellable, _check_timeout
+from ..utils import _assign_if_not_none, _batched, _get_uuid
 
 
 _logger = logging.getLogger(__name__)
 
+# puts a pooled connection back into the state of a fresh login
+_SESSION_RESET = (
+    "IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION;"
+    " SET IMPLICIT_TRANSACTIONS OFF;"
+    " SET XACT_ABORT OFF;"
+    " SET NOCOUNT OFF;"
+    " SET ROWCOUNT 0;"
+    " SET LOCK_TIMEOUT -1;"
+    " SET TRANSACTION ISOLATION LEVEL READ COMMITTED;"
+)
 
-class MSSQL(AbstractBackend):
-    def __init__(self, host=None, user=None, password=None, **kwargs):
+# redo backlog of the databases this server is an availability group secondary for
+_REDO_QUEUES = (
+    "SELECT redo_queue_size, redo_rate FROM sys.dm_hadr_database_replica_states"
+    " WHERE is_local = 1 AND is_primary_replica = 0"
+)
+
+# a statement can carry at most 2100 parameters and 1000 rows in a VALUES clause
+_MAX_PARAMS = 2100
+_MAX_VALUES_ROWS = 1000
+_VALUES_RE = re.compile(r"^(.*\bVALUES\s*)(\([^()]*\))\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+
+_max_connections_lock = threading.Lock()
+# connections reserved by the pools of all instances and pymssql's limit before any were
+_reservations = dict(count=0, base=None)
+
+
+def _reserve_connections(count):
+    """
+    Raises the process wide connection limit of pymssql by `count` so the pools of all
+    instances fit at once on top of what the limit was. Undone by `_release_connections()`.
+    """
+    with _max_connections_lock:
+        if _reservations["base"] is None:
+            _reservations["base"] = pymssql.get_max_connections()
+        _reservations["count"] += count
+        pymssql.set_max_connections(_reservations["base"] + _reservations["count"])
+
+
+def _release_connections(count):
+    """Lowers the connection limit by what `_reserve_connections(count)` raised it."""
+    with _max_connections_lock:
+        _reservations["count"] -= count
+        pymssql.set_max_connections(_reservations["base"] + _reservations["count"])
+        if not _reservations["count"]:
+            _reservations["base"] = None
+
+
+def _multi_row_statements(query, batch):
+    """
+    Rewrites a single row `INSERT ... VALUES (%s, ...)` into statements inserting many
+    rows at once. Yields tuples of the statement and its flattened parameters.
+    Returns nothing if the query cannot be rewritten.
+    """
+    match = _VALUES_RE.match(query)
+    if match is None or not isinstance(batch[0], (tuple, list)):
+        return
+    prefix, row_placeholder = match.groups()
+    params_per_row = row_placeholder.count("%s")
+    if params_per_row == 0 or params_per_row != len(batch[0]):
+        return
+    rows_per_statement = min(_MAX_VALUES_ROWS, (_MAX_PARAMS - 1) // params_per_row)
+    for chunk in _batched(batch, rows_per_statement):
+        statement = prefix + ", ".join([row_placeholder] * len(chunk))
+        yield statement, tuple(param for row in chunk for param in row)
+
+
+class _Counter(object):
+    """Iterates over rows counting them."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self._rows)
+        self.count += 1
+        return row
+
+    next = __next__
+
+
+class MSSQL(AbstractSQLBackend):
+    _transient_errors = (pymssql.OperationalError, PoolTimeout)
+
+    def __init__(
+        self,
+        host=None,
+        user=None,
+        password=None,
+        pool_size=None,
+        max_overflow=0,
+        pool_timeout=30,
+        pool_recycle=3600,
+        cache=None,
+        coalesce=False,
+        log_max_length=None,
+        **kwargs
+    ):
         """
         Initializes an instance of the MSSQL backend with the connection parameters.
 
@@ -22,10 +134,32 @@ class MSSQL(AbstractBackend):
         :param str database:
             Database to use.
             By default SQL Server selects the database which is set as default for specific user.
+        :param int pool_size:
+            When set, up to this many logged in connections are kept open and reused across
+            queries and threads. By default a new connection is opened and closed for every query.
+        :param int max_overflow:
+            Number of connections that can be opened beyond `pool_size` under load.
+            These are closed once returned. Defaults to 0.
+        :param float pool_timeout:
+            Seconds to wait for a pooled connection before raising `PoolTimeout`.
+            Defaults to 30.
+        :param float pool_recycle:
+            Pooled connections older than this many seconds are replaced. Defaults to 3600.
+        :param QueryCache cache:
+            When given, results of non streaming `SELECT` queries are served from this cache.
+            Other queries executed through this instance invalidate the cached results of
+            the tables they write to.
+        :param bool coalesce:
+            When `True`, identical non streaming `SELECT` queries, including their parameters,
+            running at the same time share one execution and its result instead of each
+            running on its own connection. The shared result should not be modified.
+        :param int log_max_length:
+            Queries and parameters are logged at INFO level cut to this many characters.
+            `0` does not log them at all. By default they are logged in full.
         :param kwargs:
             All other parameters supported by the MySQLdb `connect()` method.
             Refer http://www.pymssql.org/en/stable/ref/pymssql.html#pymssql.connect for additional examples.
-            Note: `as_dict` is limited to return dictionaries only and cannot be changed.
+            Note: `as_dict` cannot be changed. Use `row_type` when executing instead.
         """
         self._connection_params = dict()
         _assign_if_not_none(self._connection_params, "host", host)
@@ -34,12 +168,74 @@ class MSSQL(AbstractBackend):
         self._connection_params.update(kwargs)
         # we will force as_dict to True
         self._connection_params["as_dict"] = True
+        self._init_pool(pool_size, max_overflow, pool_timeout, pool_recycle)
+        self._cache = cache
+        if coalesce:
+            self._single_flight = SingleFlight()
+        self._log_max_length = log_max_length
+        self._reserved = 0
+        if self._pool is not None:
+            self._reserved = pool_size + max_overflow
+            _reserve_connections(self._reserved)
 
     def _connect(self):
-        pymssql.set_max_connections(1)
         return pymssql.connect(**self._connection_params)
 
-    def execute(self, query, params=None, stream=False):
+    def close(self):
+        """Closes all idle pooled connections and gives back the pool's share of the limit."""
+        super(MSSQL, self).close()
+        with _max_connections_lock:
+            reserved, self._reserved = self._reserved, 0
+        if reserved:
+            _release_connections(reserved)
+
+    def _ping(self, connection):
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+
+    def _reset(self, connection):
+        connection.rollback()
+        cursor = connection.cursor()
+        cursor.execute(_SESSION_RESET)
+
+    def _replica_lag(self):
+        """
+        Estimated seconds this availability group secondary needs to redo the log it has
+        received, `None` when it is not a secondary or redo has stalled.
+        """
+        _, _, rows = self.execute(_REDO_QUEUES)
+        if not rows:
+            return None
+        lag = 0
+        for row in rows:
+            if row["redo_queue_size"]:
+                if not row["redo_rate"]:
+                    return None
+                # both in KB, the rate per second
+                lag = max(lag, float(row["redo_queue_size"]) / row["redo_rate"])
+        return lag
+
+    def _select_page(self, columns, table, condition, order_by, limit):
+        return "SELECT TOP {} {} FROM {}{} ORDER BY {}".format(
+            int(limit),
+            columns,
+            table,
+            " WHERE {}".format(condition) if condition else "",
+            order_by,
+        )
+
+    def execute(
+        self,
+        query,
+        params=None,
+        stream=False,
+        chunk_size=None,
+        result_format="rows",
+        row_type="dict",
+        use_cache=True,
+        timeout=None,
+    ):
         """
         Executes the query and returns the result.
 
@@ -49,93 +245,319 @@ class MSSQL(AbstractBackend):
             When `True`, a generator is returned which will fetch data from the
             DB in a lazy fashion. Typically used when you want to
             return large volumes of data from the DB while while avoiding `MemoryError`.
+        :param int chunk_size:
+            When streaming, yield lists of up to this many rows fetched with `fetchmany()`
+            instead of one row at a time. Also the number of rows fetched at a time
+            for `result_format="columns"`. Defaults to 10000 in that case.
+        :param str result_format:
+            Either `rows` (default) for a list of dictionaries or `columns` for a mapping
+            of column name to a typed NumPy array (or `array.array` without NumPy) filled
+            `chunk_size` rows at a time. `columns` cannot be used with `stream=True`.
+        :param str row_type:
+            How rows are returned: `dict` (default), `tuple` for plain tuples or `record`
+            for namedtuples whose class is built once per result set.
+            Ignored for `result_format="columns"`.
+        :param bool use_cache:
+            Set to `False` to bypass the instance's cache for this query, e.g. for
+            `SELECT ... FOR UPDATE`. Cached results are shared so they should not be modified.
+        :param float timeout:
+            When streaming, seconds after which the query is cancelled and
+            reading the stream raises `QueryTimeout`.
         :return:
-            Returns a generator when `stream` is `True`. Otherwise returns a
+            Returns a `Stream` of the rows when `stream` is `True`, which can be closed
+            early or cancelled to stop the query on the server. Otherwise returns a
             tuple of the rows affected and a list of all rows returned after
             query execution.
         """
+        _check_result_format(result_format, stream)
+        _check_timeout(timeout, stream)
+        _check_row_type(row_type)
+
         # the return has to be done this way to accommodate having
         # `yield` and `return` in the same method
         # https://stackoverflow.com/a/43459115/399435
         # unfortunately there is a lot of code duplication here
         if stream:
             # when streaming, we want to keep results on the server side to reduce client side memory footprint
-            return self._stream(query, params)
+            return Stream(
+                functools.partial(self._stream, query, params, chunk_size, row_type),
+                timeout,
+            )
         else:
-            return self._no_stream(query, params)
+            run = functools.partial(
+                self._no_stream, query, params, chunk_size, result_format, row_type
+            )
+            return self._through_cache(
+                query, params, run, use_cache, chunk_size, result_format, row_type
+            )
 
-    def _stream(self, query, params):
+    def _stream(
+        self,
+        query,
+        params,
+        chunk_size=None,
+        row_type="dict",
+        connection=None,
+        cancel_hook=None,
+        columns_hook=None,
+    ):
         # setup logging
         log_id = _get_uuid()
         adapter = LogIdAdapter(_logger, dict(log_id=log_id))
 
-        with get_connection(self, log_id) as connection:
-            connection.autocommit(True)
-            cursor = connection.cursor()
-            execution_start = datetime.now()
-            adapter.info("Starting executing query at {}".format(execution_start))
-            adapter.info("Streaming results from DB.")
-
-            if params is not None:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-
-            adapter.info("Query: {}".format(query))
-            adapter.info("Params: {}".format(params))
-
-            # returns the generator object
-            for row in cursor:
-                yield row
-
-            execution_end = datetime.now()
-            adapter.info(
-                "Executed in {} second(s)".format(
-                    (execution_end - execution_start).seconds
-                )
-            )
-            adapter.info("Ended query execution at {}".format(execution_end))
+        # a connection is only passed in by a session which manages commits itself
+        in_session = connection is not None
+        with get_connection(self, log_id, connection) as connection:
+            if not in_session:
+                connection.autocommit(True)
+            cursor = connection.cursor(as_dict=row_type == "dict")
+            with _cancellable(
+                cancel_hook, connection._conn.cancel
+            ):
+                log_info = adapter.isEnabledFor(logging.INFO)
+                if log_info:
+                    adapter.info("Starting executing query at %s", datetime.now())
+                adapter.info("Streaming results from DB.")
+
+                with self._timer(log_id, query) as timer:
+                    if params is not None:
+                        cursor.execute(query, params)
+                    else:
+                        cursor.execute(query)
+                if columns_hook is not None:
+                    # known even when no rows are returned
+                    columns_hook([column[0] for column in cursor.description or ()])
+
+                self._log_payload(adapter, "Query: %s", query)
+                self._log_payload(adapter, "Params: %s", params)
+
+                rows = cursor if not chunk_size else _fetch_chunks(cursor, chunk_size)
+                if row_type == "record":
+                    rows = _as_records(
+                        rows, cursor.description, chunked=bool(chunk_size)
+                    )
+
+                # returns the generator object
+                rows = iter(rows)
+                # the first row is read on its own so timing it adds no work per row
+                for row in rows:
+                    self._first_row(timer)
+                    yield row
+                    break
+                for row in rows:
+                    yield row
+
+            self._stream_exhausted(timer, cursor.rownumber)
+            if log_info:
+                adapter.info("Executed in %.6f second(s)", timer.since_start())
+                adapter.info("Ended query execution at %s", datetime.now())
 
-    def _no_stream(self, query, params):
+    def _no_stream(
+        self,
+        query,
+        params,
+        chunk_size=None,
+        result_format="rows",
+        row_type="dict",
+        connection=None,
+    ):
         # setup logging
         log_id = _get_uuid()
         adapter = LogIdAdapter(_logger, dict(log_id=log_id))
 
-        with get_connection(self, log_id) as connection:
-            connection.autocommit(True)
-            cursor = connection.cursor()
-            execution_start = datetime.now()
-            adapter.info("Starting executing query at {}".format(execution_start))
+        # a connection is only passed in by a session which manages commits itself
+        in_session = connection is not None
+        with get_connection(self, log_id, connection) as connection:
+            if not in_session:
+                connection.autocommit(True)
+            columnar = result_format == "columns"
+            cursor = connection.cursor(as_dict=not columnar and row_type == "dict")
+            log_info = adapter.isEnabledFor(logging.INFO)
+            if log_info:
+                adapter.info("Starting executing query at %s", datetime.now())
             adapter.info("Not streaming results from DB.")
-            adapter.info("Query: {}".format(query))
-            adapter.info("Params: {}".format(params))
-
-            if params is not None:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-
-            # This driver seems to be having issues fetching results from MS SQL Server
-            # Not sure where the issue lies but for now I'm going to handle this
-            # I'll need to see if this can be done in a better fashion
-            try:
-                result = cursor.fetchall()
-            except pymssql.OperationalError as e:
-                expected_msg = (
-                    "Statement not executed or executed statement has no resultset"
-                )
-                if expected_msg == e.message:
-                    result = []
+            self._log_payload(adapter, "Query: %s", query)
+            self._log_payload(adapter, "Params: %s", params)
+
+            with self._timer(log_id, query) as timer:
+                if params is not None:
+                    cursor.execute(query, params)
                 else:
-                    raise e
+                    cursor.execute(query)
 
-            execution_end = datetime.now()
-            adapter.info(
-                "{} row(s) affected in {} second(s)".format(
-                    cursor.rowcount, (execution_end - execution_start).seconds
+                # This driver seems to be having issues fetching results from MS SQL Server
+                # Not sure where the issue lies but for now I'm going to handle this
+                # I'll need to see if this can be done in a better fashion
+                try:
+                    if columnar:
+                        _, result = _fetch_columns(cursor, chunk_size or 10000)
+                    elif row_type == "record":
+                        result = list(
+                            _as_records(cursor.fetchall(), cursor.description)
+                        )
+                    else:
+                        result = cursor.fetchall()
+                except pymssql.OperationalError as e:
+                    expected_msg = (
+                        "Statement not executed or executed statement has no resultset"
+                    )
+                    if expected_msg == e.message:
+                        result = {} if columnar else []
+                    else:
+                        raise e
+                timer.rows = cursor.rowcount
+
+            if log_info:
+                adapter.info(
+                    "%s row(s) affected in %.6f second(s)", cursor.rowcount, timer.elapsed
                 )
-            )
-            adapter.info("Ended query execution at {}".format(execution_end))
+                adapter.info("Ended query execution at %s", datetime.now())
 
             # returns rows affected and all results
             return cursor.rowcount, cursor.lastrowid, result
+
+    def execute_many(self, query, rows, batch_size=1000, connection=None):
+        """
+        Executes the query once for every set of parameters in `rows` over a single connection.
+
+        A single row `INSERT ... VALUES (%s, ...)` is rewritten into multi-row `VALUES`
+        statements, within SQL Server's limits of 1000 rows and 2100 parameters per statement.
+        Any other query is executed row by row.
+
+        :param str query: The query to execute.
+        :param rows:
+            Any iterable, including generators, of parameter tuples.
+            Only `batch_size` of them are held in memory at a time.
+        :param int batch_size: Number of rows sent and committed together. Defaults to 1000.
+        :param connection:
+            Used by sessions to run on their connection. Batches are then neither committed
+            nor rolled back here.
+        :return: The total number of rows affected.
+        """
+        log_id = _get_uuid()
+        adapter = LogIdAdapter(_logger, dict(log_id=log_id))
+
+        rows_affected = 0
+        in_session = connection is not None
+        with get_connection(self, log_id, connection) as connection:
+            if not in_session:
+                connection.autocommit(False)
+            cursor = connection.cursor()
+            log_info = adapter.isEnabledFor(logging.INFO)
+            if log_info:
+                adapter.info("Starting executing query at %s", datetime.now())
+            self._log_payload(adapter, "Query: %s", query)
+
+            with self._timer(log_id, query) as timer:
+                try:
+                    for batch in _batched(rows, batch_size):
+                        statements = list(_multi_row_statements(query, batch)) or [
+                            (query, params) for params in batch
+                        ]
+                        for statement, params in statements:
+                            cursor.execute(statement, params)
+                            rows_affected += cursor.rowcount
+                        timer.rows = rows_affected
+                        if not in_session:
+                            connection.commit()
+                except:
+                    if not in_session:
+                        connection.rollback()
+                    raise
+                finally:
+                    # earlier batches may have been committed even if a later one failed;
+                    # a session invalidates once its own changes are committed
+                    if not in_session:
+                        self._invalidate_cache(query)
+
+            if log_info:
+                adapter.info(
+                    "%s row(s) affected in %.6f second(s)", rows_affected, timer.elapsed
+                )
+                adapter.info("Ended query execution at %s", datetime.now())
+
+        return rows_affected
+
+    def bulk_load(
+        self,
+        table,
+        rows,
+        columns=None,
+        batch_size=10000,
+        tablock=False,
+        check_constraints=False,
+        fire_triggers=False,
+    ):
+        """
+        Loads rows into a table with the bulk copy API of pymssql, which is much faster than
+        `INSERT` statements. Rows are sent as they are read from `rows`.
+        Requires pymssql 2.2.0 or newer.
+
+        :param str table: Table to load into, e.g. `test_db.dbo.salaries`.
+        :param rows: Any iterable, including generators, of row tuples.
+        :param columns:
+            Names of the columns the values of each row go to, in order.
+            Defaults to all columns of the table.
+        :param int batch_size: Rows committed together. Defaults to 10000.
+        :param bool tablock: Takes a table lock for the duration of the load. Defaults to `False`.
+        :param bool check_constraints: Checks constraints while loading. Defaults to `False`.
+        :param bool fire_triggers: Fires insert triggers while loading. Defaults to `False`.
+        :return: The total number of rows loaded.
+        """
+        if not hasattr(pymssql.Connection, "bulk_copy"):
+            raise NotImplementedError(
+                "bulk_load requires pymssql 2.2.0 or newer, not {}".format(
+                    pymssql.__version__
+                )
+            )
+        log_id = _get_uuid()
+        adapter = LogIdAdapter(_logger, dict(log_id=log_id))
+        description = "BULK INSERT {}".format(table)
+        counter = _Counter(rows)
+
+        with get_connection(self, log_id) as connection:
+            connection.autocommit(True)
+            column_ids = None
+            if columns:
+                column_ids = self._column_ids(connection, table, columns)
+            log_info = adapter.isEnabledFor(logging.INFO)
+            if log_info:
+                adapter.info("Starting bulk load at %s", datetime.now())
+            self._log_payload(adapter, "Query: %s", description)
+
+            with self._timer(log_id, description) as timer:
+                try:
+                    connection.bulk_copy(
+                        table,
+                        counter,
+                        column_ids=column_ids,
+                        batch_size=batch_size,
+                        tablock=tablock,
+                        check_constraints=check_constraints,
+                        fire_triggers=fire_triggers,
+                    )
+                finally:
+                    timer.rows = counter.count
+                    self._invalidate_table(table)
+
+            if log_info:
+                adapter.info(
+                    "%s row(s) loaded in %.6f second(s)", counter.count, timer.elapsed
+                )
+                adapter.info("Ended bulk load at %s", datetime.now())
+
+        return counter.count
+
+    def _column_ids(self, connection, table, columns):
+        """Returns the positions of columns in a table, as the bulk copy API numbers them."""
+        cursor = connection.cursor(as_dict=False)
+        cursor.execute(
+            "SELECT name, ROW_NUMBER() OVER (ORDER BY column_id)"
+            " FROM sys.columns WHERE object_id = OBJECT_ID(%s)",
+            (table,),
+        )
+        positions = dict((name.lower(), position) for name, position in cursor.fetchall())
+        try:
+            return [positions[column.strip("[]").lower()] for column in columns]
+        except KeyError as e:
+            raise ValueError("Table {} has no column {}".format(table, e))
@@ -1,42 +1,211 @@
+import datetime as dt
+import decimal
+import functools
+import itertools
 import logging
 import MySQLdb
+import os
+import tempfile
 
 from datetime import datetime
-from MySQLdb.cursors import DictCursor, SSDictCursor
+import six
 
-from . import AbstractBackend, get_connection
+from MySQLdb.cursors import Cursor, DictCursor, SSCursor, SSDictCursor
+
+from . import AbstractSQLBackend, get_connection
+from ..exceptions import PoolTimeout
 from ..loggingadapter import LogIdAdapter
-from ..utils import _assign_if_not_none, _get_uuid
+from ..results import (
+    _as_records,
+    _check_result_format,
+    _check_row_type,
+    _fetch_chunks,
+    _fetch_columns,
+)
+from ..singleflight import SingleFlight
+from ..stream import Stream, _cancellable, _check_timeout
+from ..utils import _assign_if_not_none, _batched, _get_uuid
 
 
 _logger = logging.getLogger(__name__)
 
+# puts the session variables a pooled connection's last user is most likely to have
+# changed back to the server's defaults, as for a fresh login
+_SESSION_RESET = (
+    "SET SESSION sql_mode = DEFAULT, time_zone = DEFAULT,"
+    " foreign_key_checks = DEFAULT, unique_checks = DEFAULT"
+)
+
+# escapes of LOAD DATA for the characters that would otherwise end a field or line
+_LOAD_DATA_ESCAPES = {
+    ord("\\"): u"\\\\",
+    ord("\t"): u"\\t",
+    ord("\n"): u"\\n",
+    ord("\r"): u"\\r",
+    ord("\0"): u"\\0",
+}
+
+
+def _load_data_field(value):
+    """Encodes a value as a field of a tab separated `LOAD DATA` file."""
+    if value is None:
+        return b"\\N"
+    if isinstance(value, bool):
+        return b"1" if value else b"0"
+    if isinstance(value, (six.integer_types, decimal.Decimal, dt.date, dt.time)):
+        # str of a datetime uses the space separated format MySQL expects
+        return str(value).encode("ascii")
+    if isinstance(value, float):
+        return repr(value).encode("ascii")
+    if isinstance(value, bytes):
+        value = value.decode("latin-1").translate(_LOAD_DATA_ESCAPES)
+        return value.encode("latin-1")
+    return six.text_type(value).translate(_LOAD_DATA_ESCAPES).encode("utf-8")
+
+
+def _load_data_lines(rows):
+    return b"".join(
+        b"\t".join([_load_data_field(value) for value in row]) + b"\n" for row in rows
+    )
+
+
+def _cursor_class(stream, row_type):
+    """Returns the cursor class for a query; only `dict` rows need a dictionary cursor."""
+    if row_type == "dict":
+        return SSDictCursor if stream else DictCursor
+    return SSCursor if stream else Cursor
 
-class MySQL(AbstractBackend):
-    def __init__(self, host=None, user=None, password=None, **kwargs):
+
+class MySQL(AbstractSQLBackend):
+    _transient_errors = (MySQLdb.OperationalError, PoolTimeout)
+
+    def __init__(
+        self,
+        host=None,
+        user=None,
+        password=None,
+        pool_size=None,
+        max_overflow=0,
+        pool_timeout=30,
+        pool_recycle=3600,
+        cache=None,
+        coalesce=False,
+        log_max_length=None,
+        **kwargs
+    ):
         """
         Initializes an instance of the MySQL backend with the connection parameters.
 
         :param str host: Name of the host to connect to.
         :param str user: User to authenticate as.
         :param str password: Password to authenticate with.
+        :param int pool_size:
+            When set, up to this many connections are kept open and reused across queries.
+            Returned connections are rolled back and have their database and common session
+            variables restored; see `_reset()` for what is not.
+            By default a new connection is opened and closed for every query.
+        :param int max_overflow:
+            Number of connections that can be opened beyond `pool_size` under load.
+            These are closed once returned. Defaults to 0.
+        :param float pool_timeout:
+            Seconds to wait for a pooled connection before raising `PoolTimeout`.
+            Defaults to 30.
+        :param float pool_recycle:
+            Pooled connections older than this many seconds are replaced.
+            Should be lower than the server's `wait_timeout`. Defaults to 3600.
+        :param QueryCache cache:
+            When given, results of non streaming `SELECT` queries are served from this cache.
+            Other queries executed through this instance invalidate the cached results of
+            the tables they write to.
+        :param bool coalesce:
+            When `True`, identical non streaming `SELECT` queries, including their parameters,
+            running at the same time share one execution and its result instead of each
+            running on its own connection. The shared result should not be modified.
+        :param int log_max_length:
+            Queries and parameters are logged at INFO level cut to this many characters.
+            `0` does not log them at all. By default they are logged in full.
         :param kwargs:
             All other parameters supported by the MySQLdb `connect()` method.
             Refer https://mysqlclient.readthedocs.io/user_guide.html#functions-and-attributes for additional examples.
-            Note: `cursorclass` is limited to return dictionaries only and cannot be changed.
+            Note: `cursorclass` cannot be changed. Use `row_type` when executing instead.
         """
         self._connection_params = dict()
         _assign_if_not_none(self._connection_params, "host", host)
         _assign_if_not_none(self._connection_params, "user", user)
         _assign_if_not_none(self._connection_params, "password", password)
         self._connection_params.update(kwargs)
-        # we will remove cursor class from as this will be set in the underlying methods
+        # the cursor class is set per query by the underlying methods, never here, so the
+        # parameters are not changed after this and can be read by any thread
         self._connection_params.pop("cursorclass", None)
+        self._init_pool(pool_size, max_overflow, pool_timeout, pool_recycle)
+        self._cache = cache
+        if coalesce:
+            self._single_flight = SingleFlight()
+        self._log_max_length = log_max_length
 
     def _connect(self):
         return MySQLdb.connect(**self._connection_params)
 
-    def execute(self, query, params=None, stream=False):
+    def _ping(self, connection):
+        connection.ping()
+
+    def _replica_lag(self):
+        """Seconds this replica is behind its source, `None` when it is not replicating."""
+        try:
+            _, _, rows = self.execute("SHOW REPLICA STATUS")
+        except MySQLdb.ProgrammingError:
+            # before MySQL 8.0.22 and MariaDB 10.5.1
+            _, _, rows = self.execute("SHOW SLAVE STATUS")
+        if not rows:
+            return None
+        return rows[0].get("Seconds_Behind_Source", rows[0].get("Seconds_Behind_Master"))
+
+    def _kill_query(self, thread_id):
+        """Stops the statement running on the connection with `thread_id` from a new connection."""
+        connection = self._connect()
+        try:
+            connection.cursor().execute("KILL QUERY {:d}".format(thread_id))
+        finally:
+            connection.close()
+
+    def _reset(self, connection):
+        """
+        Discards anything left uncommitted, selects the configured database again and puts
+        `sql_mode`, `time_zone`, `foreign_key_checks` and `unique_checks` back as they were
+        after connecting, including any `sql_mode` or `init_command` given.
+        Not reset are user variables, temporary tables, prepared statements, named locks,
+        the character set and other session variables; change these on pooled connections
+        only if they are changed back before the connection is returned.
+        """
+        connection.rollback()
+        database = self._connection_params.get(
+            "db", self._connection_params.get("database")
+        )
+        if database is not None:
+            connection.select_db(database)
+        cursor = connection.cursor()
+        try:
+            cursor.execute(_SESSION_RESET)
+            if self._connection_params.get("sql_mode") is not None:
+                cursor.execute(
+                    "SET SESSION sql_mode = %s", (self._connection_params["sql_mode"],)
+                )
+            if self._connection_params.get("init_command") is not None:
+                cursor.execute(self._connection_params["init_command"])
+        finally:
+            cursor.close()
+
+    def execute(
+        self,
+        query,
+        params=None,
+        stream=False,
+        chunk_size=None,
+        result_format="rows",
+        row_type="dict",
+        use_cache=True,
+        timeout=None,
+    ):
         """
         Executes the query and returns the result.
 
@@ -46,79 +215,314 @@ class MySQL(AbstractBackend):
             When `True`, a generator is returned which will fetch data from the
             DB in a lazy fashion. Typically used when you want to
             return large volumes of data from the DB while while avoiding `MemoryError`.
+        :param int chunk_size:
+            When streaming, yield lists of up to this many rows fetched with `fetchmany()`
+            instead of one row at a time. Also the number of rows fetched at a time
+            for `result_format="columns"`. Defaults to 10000 in that case.
+        :param str result_format:
+            Either `rows` (default) for a list of dictionaries or `columns` for a mapping
+            of column name to a typed NumPy array (or `array.array` without NumPy) filled
+            `chunk_size` rows at a time. `columns` cannot be used with `stream=True`.
+        :param str row_type:
+            How rows are returned: `dict` (default), `tuple` for plain tuples or `record`
+            for namedtuples whose class is built once per result set.
+            Ignored for `result_format="columns"`.
+        :param bool use_cache:
+            Set to `False` to bypass the instance's cache for this query, e.g. for
+            `SELECT ... FOR UPDATE`. Cached results are shared so they should not be modified.
+        :param float timeout:
+            When streaming, seconds after which the query is killed with `KILL QUERY` and
+            reading the stream raises `QueryTimeout`.
         :return:
-            Returns a generator when `stream` is `True`. Otherwise returns a
+            Returns a `Stream` of the rows when `stream` is `True`, which can be closed
+            early or cancelled to stop the query on the server. Otherwise returns a
             tuple of the rows affected and a list of all rows returned after
             query execution.
         """
+        _check_result_format(result_format, stream)
+        _check_timeout(timeout, stream)
+        _check_row_type(row_type)
+
         # the return has to be done this way to accommodate having
         # `yield` and `return` in the same method
         # https://stackoverflow.com/a/43459115/399435
         # unfortunately there is a lot of code duplication here
         if stream:
             # when streaming, we want to keep results on the server side to reduce client side memory footprint
-            self._connection_params["cursorclass"] = SSDictCursor
-            return self._stream(query, params)
+            # the cursor class is picked per query so nothing shared between threads is changed
+            return Stream(
+                functools.partial(self._stream, query, params, chunk_size, row_type),
+                timeout,
+            )
         else:
-            self._connection_params["cursorclass"] = DictCursor
-            return self._no_stream(query, params)
+            run = functools.partial(
+                self._no_stream, query, params, chunk_size, result_format, row_type
+            )
+            return self._through_cache(
+                query, params, run, use_cache, chunk_size, result_format, row_type
+            )
 
-    def _stream(self, query, params):
+    def _stream(
+        self,
+        query,
+        params,
+        chunk_size=None,
+        row_type="dict",
+        connection=None,
+        cancel_hook=None,
+        columns_hook=None,
+    ):
         # setup logging
         log_id = _get_uuid()
         adapter = LogIdAdapter(_logger, dict(log_id=log_id))
 
-        with get_connection(self, log_id) as connection:
-            connection.autocommit(True)
-            cursor = connection.cursor()
-            execution_start = datetime.now()
-            adapter.info("Starting executing query at {}".format(execution_start))
-            adapter.info("Streaming results from DB.")
+        # a connection is only passed in by a session which manages commits itself
+        in_session = connection is not None
+        with get_connection(self, log_id, connection) as connection:
+            if not in_session:
+                connection.autocommit(True)
+            # pooled connections may have been opened for either mode
+            # so the cursor class is picked per query
+            cursor = connection.cursor(_cursor_class(True, row_type))
+            with _cancellable(
+                cancel_hook, functools.partial(self._kill_query, connection.thread_id())
+            ):
+                log_info = adapter.isEnabledFor(logging.INFO)
+                if log_info:
+                    adapter.info("Starting executing query at %s", datetime.now())
+                adapter.info("Streaming results from DB.")
 
-            if params is not None:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
+                with self._timer(log_id, query) as timer:
+                    if params is not None:
+                        cursor.execute(query, params)
+                    else:
+                        cursor.execute(query)
+                if columns_hook is not None:
+                    # known even when no rows are returned
+                    columns_hook([column[0] for column in cursor.description or ()])
 
-            adapter.info("{}".format(cursor._executed.decode("utf8")))
+                self._log_payload(adapter, "%s", cursor._executed)
 
-            # returns the generator object
-            for row in cursor:
-                yield row
+                rows = cursor if not chunk_size else _fetch_chunks(cursor, chunk_size)
+                if row_type == "record":
+                    rows = _as_records(
+                        rows, cursor.description, chunked=bool(chunk_size)
+                    )
 
-            execution_end = datetime.now()
-            adapter.info(
-                "Executed in {} second(s)".format(
-                    (execution_end - execution_start).seconds
-                )
-            )
-            adapter.info("Ended query execution at {}".format(execution_end))
+                # returns the generator object
+                rows = iter(rows)
+                drain = True
+                try:
+                    # the first row is read on its own so timing it adds no work per row
+                    for row in rows:
+                        self._first_row(timer)
+                        yield row
+                        break
+                    for row in rows:
+                        yield row
+                except GeneratorExit:
+                    # a connection closed right after drops unread rows without reading
+                    # them, only one which is reused has to be drained
+                    drain = in_session or self._pool is not None
+                    raise
+                finally:
+                    if drain:
+                        cursor.close()
+
+            self._stream_exhausted(timer, cursor.rownumber)
+            if log_info:
+                adapter.info("Executed in %.6f second(s)", timer.since_start())
+                adapter.info("Ended query execution at %s", datetime.now())
 
-    def _no_stream(self, query, params):
+    def _no_stream(
+        self,
+        query,
+        params,
+        chunk_size=None,
+        result_format="rows",
+        row_type="dict",
+        connection=None,
+    ):
         # setup logging
         log_id = _get_uuid()
         adapter = LogIdAdapter(_logger, dict(log_id=log_id))
 
-        with get_connection(self, log_id) as connection:
-            connection.autocommit(True)
-            cursor = connection.cursor()
-            execution_start = datetime.now()
-            adapter.info("Starting executing query at {}".format(execution_start))
+        # a connection is only passed in by a session which manages commits itself
+        in_session = connection is not None
+        with get_connection(self, log_id, connection) as connection:
+            if not in_session:
+                connection.autocommit(True)
+            columnar = result_format == "columns"
+            # columns are filled from a server side cursor so the rows are never all in memory
+            cursor = connection.cursor(
+                SSCursor if columnar else _cursor_class(False, row_type)
+            )
+            log_info = adapter.isEnabledFor(logging.INFO)
+            if log_info:
+                adapter.info("Starting executing query at %s", datetime.now())
             adapter.info("Not streaming results from DB.")
 
-            if params is not None:
-                rows_affected = cursor.execute(query, params)
-            else:
-                rows_affected = cursor.execute(query)
+            with self._timer(log_id, query) as timer:
+                if params is not None:
+                    rows_affected = cursor.execute(query, params)
+                else:
+                    rows_affected = cursor.execute(query)
+
+                if columnar:
+                    rows_affected, result = _fetch_columns(cursor, chunk_size or 10000)
+                elif row_type == "record":
+                    result = list(_as_records(cursor.fetchall(), cursor.description))
+                else:
+                    result = cursor.fetchall()
+                timer.rows = rows_affected
 
-            execution_end = datetime.now()
-            adapter.info("{}".format(cursor._executed.decode("utf8")))
-            adapter.info(
-                "{} row(s) affected in {} second(s)".format(
-                    rows_affected, (execution_end - execution_start).seconds
+            self._log_payload(adapter, "%s", cursor._executed)
+            if log_info:
+                adapter.info(
+                    "%s row(s) affected in %.6f second(s)", rows_affected, timer.elapsed
                 )
-            )
-            adapter.info("Ended query execution at {}".format(execution_end))
+                adapter.info("Ended query execution at %s", datetime.now())
 
             # returns rows affected and all results
-            return rows_affected, cursor.lastrowid, cursor.fetchall()
+            return rows_affected, cursor.lastrowid, result
+
+    def execute_many(self, query, rows, batch_size=1000, connection=None):
+        """
+        Executes the query once for every set of parameters in `rows` over a single connection.
+
+        `INSERT` and `REPLACE` statements are rewritten by the driver into multi-row `VALUES`
+        statements so each batch is sent in as few round trips as possible.
+
+        :param str query: The query to execute.
+        :param rows:
+            Any iterable, including generators, of parameter tuples.
+            Only `batch_size` of them are held in memory at a time.
+        :param int batch_size: Number of rows sent and committed together. Defaults to 1000.
+        :param connection:
+            Used by sessions to run on their connection. Batches are then neither committed
+            nor rolled back here.
+        :return: The total number of rows affected.
+        """
+        log_id = _get_uuid()
+        adapter = LogIdAdapter(_logger, dict(log_id=log_id))
+
+        rows_affected = 0
+        in_session = connection is not None
+        with get_connection(self, log_id, connection) as connection:
+            if not in_session:
+                connection.autocommit(False)
+            cursor = connection.cursor()
+            log_info = adapter.isEnabledFor(logging.INFO)
+            if log_info:
+                adapter.info("Starting executing query at %s", datetime.now())
+            self._log_payload(adapter, "Query: %s", query)
+
+            with self._timer(log_id, query) as timer:
+                try:
+                    for batch in _batched(rows, batch_size):
+                        rows_affected += cursor.executemany(query, batch)
+                        timer.rows = rows_affected
+                        if not in_session:
+                            connection.commit()
+                except:
+                    if not in_session:
+                        connection.rollback()
+                    raise
+                finally:
+                    # earlier batches may have been committed even if a later one failed;
+                    # a session invalidates once its own changes are committed
+                    if not in_session:
+                        self._invalidate_cache(query)
+
+            if log_info:
+                adapter.info(
+                    "%s row(s) affected in %.6f second(s)", rows_affected, timer.elapsed
+                )
+                adapter.info("Ended query execution at %s", datetime.now())
+
+        return rows_affected
+
+    def bulk_load(self, table, rows, columns=None, batch_size=1000000, chunk_size=10000):
+        """
+        Loads rows into a table with `LOAD DATA LOCAL INFILE`, which is much faster than
+        `INSERT` statements. Rows are written to temporary tab separated files of up to
+        `batch_size` rows, each loaded and deleted in turn, so neither memory nor disk use
+        grows with the number of rows.
+
+        A separate connection with `local_infile` enabled is opened for this; the server
+        must allow it with `local_infile=ON`.
+        `table` and `columns` are put into the SQL as is and must be trusted.
+
+        :param str table: Table to load into.
+        :param rows: Any iterable, including generators, of row tuples.
+        :param columns:
+            Names of the columns the values of each row go to, in order.
+            Defaults to all columns of the table.
+        :param int batch_size:
+            Rows per temporary file. Every file is loaded in its own transaction.
+            Defaults to 1000000.
+        :param int chunk_size: Rows encoded and written to the file at a time. Defaults to 10000.
+        :return: The total number of rows loaded.
+        """
+        log_id = _get_uuid()
+        adapter = LogIdAdapter(_logger, dict(log_id=log_id))
+
+        query = (
+            "LOAD DATA LOCAL INFILE %s INTO TABLE {} CHARACTER SET utf8mb4"
+            " FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'"
+            " LINES TERMINATED BY '\\n'".format(table)
+        )
+        if columns:
+            query += " ({})".format(", ".join(columns))
+
+        rows_loaded = 0
+        log_info = adapter.isEnabledFor(logging.INFO)
+        if log_info:
+            adapter.info("Starting bulk load at %s", datetime.now())
+        self._log_payload(adapter, "Query: %s", query)
+
+        adapter.info("Connecting to DB with local_infile")
+        connection = MySQLdb.connect(**dict(self._connection_params, local_infile=1))
+        try:
+            connection.autocommit(True)
+            cursor = connection.cursor()
+            with self._timer(log_id, query) as timer:
+                try:
+                    rows = iter(rows)
+                    while True:
+                        # rows go from the iterator straight to the file
+                        loaded = self._load_data_file(
+                            cursor, query, itertools.islice(rows, batch_size), chunk_size
+                        )
+                        if loaded is None:
+                            break
+                        rows_loaded += loaded
+                        timer.rows = rows_loaded
+                finally:
+                    self._invalidate_table(table)
+        finally:
+            connection.close()
+            adapter.info("Closed connection to DB")
+
+        if log_info:
+            adapter.info("%s row(s) loaded in %.6f second(s)", rows_loaded, timer.elapsed)
+            adapter.info("Ended bulk load at %s", datetime.now())
+        return rows_loaded
+
+    def _load_data_file(self, cursor, query, rows, chunk_size):
+        """
+        Writes rows to a temporary file, loads it and returns the number of rows loaded,
+        or `None` without loading anything when there were no rows.
+        """
+        fd, path = tempfile.mkstemp(prefix="rapyd_db_", suffix=".tsv")
+        try:
+            written = 0
+            with os.fdopen(fd, "wb") as f:
+                for chunk in _batched(rows, chunk_size):
+                    f.write(_load_data_lines(chunk))
+                    written += len(chunk)
+            if not written:
+                return None
+            return cursor.execute(query, (path,))
+        finally:
+            os.remove(path)
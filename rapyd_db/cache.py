@@ -0,0 +1,364 @@
+import re
+import sys
+import threading
+
+from collections import OrderedDict
+
+from .routing import _is_replica_read
+from .utils import _monotonic
+
+
+# an identifier, optionally quoted and qualified, e.g. `test_db`.`salaries` or dbo.[t]
+_PART = r"(?:`(?:[^`]|``)*`|\[[^\]]*\]|\w+)"
+_QUALIFIED_NAME = _PART + r"(?:\s*\.\s*" + _PART + ")*"
+# quoted literals, comments, whitespace, names and single characters
+_TOKEN_RE = re.compile(
+    r"""'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|--[^\n]*|/\*.*?\*/|\s+|"""
+    + _QUALIFIED_NAME
+    + r"|.",
+    re.DOTALL,
+)
+# keywords ending the list of tables of a FROM
+_FROM_LIST_END = frozenset(
+    [
+        "WHERE",
+        "GROUP",
+        "HAVING",
+        "ORDER",
+        "LIMIT",
+        "OFFSET",
+        "FETCH",
+        "UNION",
+        "EXCEPT",
+        "INTERSECT",
+        "ON",
+        "USING",
+        "WINDOW",
+        "FOR",
+        "INTO",
+        "LOCK",
+        "SELECT",
+    ]
+)
+_NAME = r"[`\"\[\]\w.]+"
+_IDENTIFIER = "(" + _NAME + ")"
+_WRITE_TABLES_RE = re.compile(
+    r"^\s*(?:INSERT(?:\s+IGNORE)?(?:\s+INTO)?|REPLACE(?:\s+INTO)?|UPDATE|DELETE\s+FROM"
+    r"|MERGE(?:\s+INTO)?|ALTER\s+TABLE)\s+" + _IDENTIFIER,
+    re.IGNORECASE,
+)
+_TABLE_LIST_RE = re.compile(
+    r"^\s*(?:TRUNCATE(?:\s+TABLE)?|DROP\s+TABLE(?:\s+IF\s+EXISTS)?)\s+"
+    r"({name}(?:\s*,\s*{name})*)\s*;?\s*$".format(name=_NAME),
+    re.IGNORECASE,
+)
+# statements which change no table data
+_NON_WRITES = (
+    "SHOW",
+    "DESCRIBE",
+    "DESC",
+    "EXPLAIN",
+    "SET",
+    "USE",
+    "BEGIN",
+    "START",
+    "COMMIT",
+    "ROLLBACK",
+    "SAVEPOINT",
+    "RELEASE",
+)
+
+
+def _tokens(query):
+    """Yields the words, literals and symbols of a query without whitespace or comments."""
+    for token in _TOKEN_RE.findall(query):
+        if not (token.isspace() or token.startswith("--") or token.startswith("/*")):
+            yield token
+
+
+def _top_level(query):
+    """
+    Yields the upper cased words and symbols of a query outside parentheses, with `()` for
+    every parenthesized group, skipping whitespace and comments.
+    """
+    depth = 0
+    for token in _tokens(query):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+            if depth == 0:
+                yield "()"
+        elif depth == 0:
+            yield token.upper()
+
+
+def _statement_keyword(tokens):
+    """
+    Returns the keyword of the main statement, e.g. `SELECT`, after the common table
+    expressions of a `WITH` or `None` when it cannot be told.
+    """
+    if not tokens:
+        return None
+    if tokens[0] != "WITH":
+        return tokens[0]
+    # WITH [RECURSIVE] name [(columns)] AS [[NOT] MATERIALIZED] (query) [, ...] main
+    after_group = False
+    for token in tokens[1:]:
+        if after_group:
+            if token not in ("AS", ","):
+                return token
+            after_group = False
+        elif token == "()":
+            after_group = True
+    return None
+
+
+def _normalize_query(query):
+    """Collapses whitespace outside quoted literals and identifiers."""
+    return "".join(
+        " " if token.isspace() else token for token in _TOKEN_RE.findall(query)
+    ).strip()
+
+
+def _table_name(identifier):
+    """Returns the lower cased table name without schema or quoting, e.g. `salaries`."""
+    return identifier.split(".")[-1].strip().strip("`\"[]").lower()
+
+
+def _is_select(query, tokens):
+    """Whether the main statement is a `SELECT` which stores nothing with `INTO`."""
+    keyword = _statement_keyword(tokens)
+    if keyword == "()":
+        # a query in parentheses, e.g. (SELECT 1) UNION (SELECT 2)
+        words = (token.upper() for token in _tokens(query) if token != "(")
+        keyword = next(words, None)
+    return keyword == "SELECT" and "INTO" not in tokens
+
+
+def _is_read_only(query):
+    """
+    Whether a statement only reads, so its result can be cached, shared and read from a
+    replica: a `SELECT` which stores nothing with `INTO`, takes no locks and calls no lock
+    or sequence functions.
+    """
+    return _is_select(query, list(_top_level(query))) and _is_replica_read(query)
+
+
+def _read_tags(query):
+    """Returns the names of the tables after `FROM`, in its comma separated lists, and `JOIN`."""
+    tags = set()
+    depth = 0
+    # depths at which a FROM list is being read
+    from_lists = set()
+    expecting = False
+    for token in _tokens(query):
+        upper = token.upper()
+        if token == "(":
+            depth += 1
+            expecting = False
+        elif token == ")":
+            from_lists.discard(depth)
+            depth -= 1
+        elif upper == "FROM" or upper == "JOIN":
+            expecting = True
+            if upper == "FROM":
+                from_lists.add(depth)
+        elif token == "," and depth in from_lists:
+            expecting = True
+        elif upper in _FROM_LIST_END:
+            from_lists.discard(depth)
+            expecting = False
+        elif expecting:
+            if token[0] not in "'\"":
+                tags.add(_table_name(token))
+            # anything else up to the next comma or JOIN is an alias
+            expecting = False
+    return tags
+
+
+def _write_tags(query):
+    """
+    Returns the names of the tables a statement writes, an empty set when it writes no
+    table data or `None` when the tables cannot be told with confidence, e.g. for
+    multi-table updates, stored procedures or statements after a `WITH`.
+    """
+    tokens = list(_top_level(query))
+    keyword = _statement_keyword(tokens)
+    if keyword in _NON_WRITES or _is_select(query, tokens):
+        # including locking reads and lock or sequence functions
+        return set()
+    match = _TABLE_LIST_RE.match(query)
+    if match is not None:
+        return set(_table_name(table.strip()) for table in match.group(1).split(","))
+    match = _WRITE_TABLES_RE.match(query)
+    if match is None:
+        return None
+    if keyword in ("UPDATE", "DELETE"):
+        # only the target table up to SET or WHERE; joins, lists and a second FROM can
+        # write other tables
+        target = tokens[: tokens.index("SET") if "SET" in tokens else None]
+        target = target[: target.index("WHERE") if "WHERE" in target else None]
+        if (
+            set(target) & set(["JOIN", "USING", ","])
+            or tokens.count("FROM") > (keyword == "DELETE")
+        ):
+            return None
+    return set([_table_name(match.group(1))])
+
+
+def _cache_key(query, params, *options):
+    # params can be lists or dictionaries which cannot be hashed
+    return (_normalize_query(query), repr(params)) + options
+
+
+def _estimate_size(value, depth=3):
+    """A rough estimate of the memory held by a result, used to bound the cache in bytes."""
+    size = sys.getsizeof(value)
+    if depth:
+        if isinstance(value, dict):
+            items = list(value.keys()) + list(value.values())
+        elif isinstance(value, (list, tuple, set)):
+            items = value
+        else:
+            items = ()
+        size += sum(_estimate_size(item, depth - 1) for item in items)
+    return size
+
+
+class QueryCache(object):
+    """
+    A thread-safe LRU cache of query results bounded by entry count and bytes,
+    where every entry expires after a TTL and can be tagged with table names
+    for bulk invalidation.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None, ttl=60):
+        """
+        :param int max_entries: Maximum number of results kept. Defaults to 1000.
+        :param int max_bytes:
+            Maximum estimated size of all results kept. `None` (default) does not limit size.
+        :param float ttl: Seconds a result is served for. `None` keeps it until evicted.
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (value, expires_at, size, tags), least recently used first
+        self._entries = OrderedDict()
+        self._tags = dict()
+        # tag -> number of times it was invalidated, to tell results read before a write
+        self._generations = dict()
+        self._clears = 0
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        """Returns a dictionary of hit, miss and eviction counters and the current size."""
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                entries=len(self._entries),
+                bytes=self._bytes,
+            )
+
+    def get(self, key):
+        """Returns a tuple of whether the key was found and its value."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > _monotonic()):
+                self._move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return False, None
+
+    def generation(self, tags):
+        """
+        Returns a token which changes whenever any of the tags is invalidated or the cache
+        is cleared, to be taken before reading a value and given to `set`.
+        """
+        with self._lock:
+            return (self._clears,) + tuple(
+                self._generations.get(tag, 0) for tag in sorted(tags)
+            )
+
+    def set(self, key, value, ttl=None, tags=(), generation=None):
+        """
+        Stores a value. Values larger than `max_bytes` are not stored.
+
+        :param float ttl: Overrides the TTL the cache was created with.
+        :param tags: Names, usually tables, which can be used to invalidate the entry.
+        :param tuple generation:
+            What `generation(tags)` returned before the value was read. The value is not
+            stored if any of its tags was invalidated since, as it may predate a write.
+        """
+        ttl = self._ttl if ttl is None else ttl
+        expires_at = None if ttl is None else _monotonic() + ttl
+        size = _estimate_size(value) if self._max_bytes is not None else 0
+        if self._max_bytes is not None and size > self._max_bytes:
+            return
+        tags = frozenset(tags)
+        with self._lock:
+            if generation is not None and generation != (self._clears,) + tuple(
+                self._generations.get(tag, 0) for tag in sorted(tags)
+            ):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, size, tags)
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self._max_entries or (
+                self._max_bytes is not None and self._bytes > self._max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Removes a single entry."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate_tags(self, *tags):
+        """Removes all entries tagged with any of the given tags."""
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        """Removes all entries. Counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._generations.clear()
+            self._clears += 1
+            self._bytes = 0
+
+    def _move_to_end(self, key):
+        # OrderedDict.move_to_end is not available on python 2
+        self._entries[key] = self._entries.pop(key)
+
+    def _remove(self, key):
+        value, expires_at, size, tags = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
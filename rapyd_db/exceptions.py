@@ -0,0 +1,47 @@
+class RapydDBError(Exception):
+    """Base class for all errors raised by rapyd_db itself."""
+
+
+class PoolTimeout(RapydDBError):
+    """Raised when a connection could not be checked out of a pool in time."""
+
+
+class ShardTimeout(RapydDBError):
+    """Raised for a shard that did not complete within the fan-out timeout."""
+
+
+class ScanTimeout(RapydDBError):
+    """Raised for a range of a parallel scan that returned no rows within the timeout."""
+
+
+class FanOutError(RapydDBError):
+    """
+    Raised when a query failed on one or more shards.
+    `errors` maps shard names to exceptions and `results` holds the results of the others.
+    """
+
+    def __init__(self, errors, results=None):
+        super(FanOutError, self).__init__(
+            "Failed on {} shard(s): {}".format(
+                len(errors),
+                ", ".join("{} ({!r})".format(name, e) for name, e in errors.items()),
+            )
+        )
+        self.errors = errors
+        self.results = results
+
+
+class QueryCancelled(RapydDBError):
+    """Raised when reading a stream whose query was cancelled."""
+
+
+class QueryTimeout(QueryCancelled):
+    """Raised when reading a stream whose query was cancelled after its timeout."""
+
+
+class NoReplicaAvailable(RapydDBError):
+    """Raised when a read cannot be routed because no replica is within the allowed lag."""
+
+
+class WriterFull(RapydDBError):
+    """Raised when a row cannot be queued because a `BufferedWriter` is at capacity."""
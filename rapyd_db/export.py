@@ -0,0 +1,191 @@
+import bz2
+import csv
+import gzip
+import io
+import logging
+import os
+
+import six
+
+from .utils import _monotonic
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+_logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "arrow", "parquet")
+CSV_COMPRESSIONS = ("gzip", "bz2", "xz")
+
+# bytes buffered before the file is written to
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+def _check_export_format(export_format, compression):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(
+            "format must be one of {}, not {!r}".format(
+                ", ".join(EXPORT_FORMATS), export_format
+            )
+        )
+    if export_format == "csv":
+        if compression is not None and compression not in CSV_COMPRESSIONS:
+            raise ValueError(
+                "compression of csv must be one of {}, not {!r}".format(
+                    ", ".join(CSV_COMPRESSIONS), compression
+                )
+            )
+    elif pyarrow is None:
+        raise ImportError("pyarrow is required for format={!r}".format(export_format))
+
+
+def _open_binary(path, compression, buffer_size):
+    """Returns the stream to write to and the file under it, the same one when uncompressed."""
+    raw = io.open(path, "wb", buffering=buffer_size)
+    if compression is None:
+        return raw, raw
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb"), raw
+    if compression == "bz2":
+        return bz2.BZ2File(raw, "wb"), raw
+    if lzma is None:
+        raise ValueError("compression 'xz' is not available on python 2")
+    return lzma.LZMAFile(raw, "wb"), raw
+
+
+class _CSVWriter(object):
+    def __init__(self, path, compression, buffer_size, header, encoding, **fmtparams):
+        binary, self._raw = _open_binary(path, compression, buffer_size)
+        if six.PY2:
+            # the csv module writes byte strings on python 2
+            self._file = binary
+        else:
+            self._file = io.TextIOWrapper(binary, encoding=encoding, newline="")
+        self._writer = csv.writer(self._file, **fmtparams)
+        self._header = header
+
+    def write(self, columns, rows):
+        if self._header:
+            self._writer.writerow(columns)
+            self._header = False
+        self._writer.writerows(rows)
+
+    def close(self, columns=()):
+        if self._header and columns:
+            # no rows were written
+            self._writer.writerow(columns)
+        self._file.close()
+        # closing a compressed stream leaves the file under it open
+        self._raw.close()
+
+
+class _ArrowWriter(object):
+    def __init__(self, path, export_format, compression, buffer_size, schema):
+        self._path = path
+        self._format = export_format
+        self._compression = compression
+        self._buffer_size = buffer_size
+        self._schema = schema
+        self._sink = None
+        self._writer = None
+
+    def write(self, columns, rows):
+        if self._schema is None:
+            batch = pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(values) for values in zip(*rows)], names=list(columns)
+            )
+            self._schema = batch.schema
+        else:
+            batch = pyarrow.RecordBatch.from_arrays(
+                [
+                    pyarrow.array(values, type=field.type)
+                    for values, field in zip(zip(*rows), self._schema)
+                ],
+                schema=self._schema,
+            )
+        if self._writer is None:
+            self._open()
+        self._writer.write_batch(batch)
+
+    def _open(self):
+        if self._format == "parquet":
+            kwargs = dict()
+            if self._compression is not None:
+                kwargs["compression"] = self._compression
+            self._writer = pyarrow.parquet.ParquetWriter(
+                self._path, self._schema, **kwargs
+            )
+            return
+        options = pyarrow.ipc.IpcWriteOptions(compression=self._compression)
+        self._sink = pyarrow.OSFile(self._path, "wb")
+        self._sink = pyarrow.BufferedOutputStream(self._sink, self._buffer_size)
+        self._writer = pyarrow.ipc.new_file(self._sink, self._schema, options=options)
+
+    def close(self, columns=()):
+        if self._writer is None:
+            # no rows were read so the file holds the given schema or the column names
+            # without types
+            self._schema = self._schema or pyarrow.schema(
+                [pyarrow.field(name, pyarrow.null()) for name in columns]
+            )
+            self._open()
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+
+
+def _export(
+    chunks,
+    path,
+    export_format="csv",
+    compression=None,
+    buffer_size=DEFAULT_BUFFER_SIZE,
+    columns=(),
+    header=True,
+    encoding="utf-8",
+    schema=None,
+    **fmtparams
+):
+    """
+    Writes chunks of records to a file and returns a dictionary of `rows`, `seconds`,
+    `rows_per_second` and `bytes` written. `columns` are the names written as the header
+    or schema when there are no rows, and can be filled in while `chunks` is read.
+    """
+    start = _monotonic()
+    if export_format == "csv":
+        writer = _CSVWriter(path, compression, buffer_size, header, encoding, **fmtparams)
+    else:
+        writer = _ArrowWriter(path, export_format, compression, buffer_size, schema)
+    rows = 0
+    try:
+        for chunk in chunks:
+            if chunk:
+                writer.write(type(chunk[0])._columns, chunk)
+                rows += len(chunk)
+    finally:
+        writer.close(columns)
+    seconds = _monotonic() - start
+    stats = dict(
+        rows=rows,
+        seconds=seconds,
+        rows_per_second=rows / seconds if seconds else None,
+        bytes=os.path.getsize(path),
+    )
+    _logger.info(
+        "Exported %s row(s) to %s in %.6f second(s), %.0f row(s) per second",
+        rows,
+        path,
+        seconds,
+        stats["rows_per_second"] or 0,
+    )
+    return stats
@@ -0,0 +1,339 @@
+import heapq
+import logging
+import operator
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from six.moves import queue
+
+from .exceptions import FanOutError, ShardTimeout
+from .utils import _monotonic
+
+
+_logger = logging.getLogger(__name__)
+
+ON_ERROR = ("raise", "skip")
+
+# markers put on a stream's queue by the worker reading it
+_ROW = 0
+_DONE = 1
+
+
+def _check_on_error(on_error):
+    if on_error not in ON_ERROR:
+        raise ValueError(
+            "on_error must be one of {}, not {!r}".format(", ".join(ON_ERROR), on_error)
+        )
+
+
+def _key_function(sort_key):
+    """Accepts a callable or a column name / index, e.g. `emp_no` or `0`."""
+    if sort_key is None or callable(sort_key):
+        return sort_key
+    return operator.itemgetter(sort_key)
+
+
+def _put(q, item, stop):
+    """Puts on a bounded queue until the reader stops. Returns whether it was put."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _pump(name, open_stream, q, stop):
+    """Reads a stream in a worker thread onto a bounded queue, ending with `_DONE`."""
+    error = None
+    iterator = None
+    try:
+        iterator = iter(open_stream())
+        for item in iterator:
+            if not _put(q, (name, _ROW, item), stop):
+                break
+    except Exception as e:
+        error = e
+    finally:
+        # releases the connection held by a generator the reader stopped early
+        if hasattr(iterator, "close"):
+            iterator.close()
+    _put(q, (name, _DONE, error), stop)
+
+
+def _failed(name, error, on_error):
+    if on_error == "raise":
+        raise FanOutError({name: error})
+    _logger.warning("Skipping shard %s: %r", name, error)
+
+
+def _merge_unordered(streams, executor, timeout, on_error, queue_size):
+    q = queue.Queue(queue_size)
+    stop = threading.Event()
+    running = OrderedDict((name, True) for name, _ in streams)
+    try:
+        for name, open_stream in streams:
+            executor.submit(_pump, name, open_stream, q, stop)
+        while running:
+            try:
+                name, kind, payload = q.get(timeout=timeout)
+            except queue.Empty:
+                errors = OrderedDict(
+                    (pending, ShardTimeout("No rows for {} second(s)".format(timeout)))
+                    for pending in running
+                )
+                if on_error == "raise":
+                    raise FanOutError(errors)
+                _logger.warning(
+                    "Skipping shard(s) %s: timed out", ", ".join(map(str, errors))
+                )
+                return
+            if kind == _ROW:
+                yield name, payload
+                continue
+            del running[name]
+            if payload is not None:
+                _failed(name, payload, on_error)
+    finally:
+        stop.set()
+
+
+def _drain(name, q, key, index, timeout, on_error):
+    while True:
+        try:
+            _, kind, payload = q.get(timeout=timeout)
+        except queue.Empty:
+            error = ShardTimeout("No rows for {} second(s)".format(timeout))
+            _failed(name, error, on_error)
+            return
+        if kind == _DONE:
+            if payload is not None:
+                _failed(name, payload, on_error)
+            return
+        # the index breaks ties so rows themselves are never compared
+        yield key(payload), index, name, payload
+
+
+def _merge_ordered(streams, executor, key, timeout, on_error, queue_size):
+    stop = threading.Event()
+    drains = []
+    try:
+        for index, (name, open_stream) in enumerate(streams):
+            q = queue.Queue(queue_size)
+            executor.submit(_pump, name, open_stream, q, stop)
+            drains.append(_drain(name, q, key, index, timeout, on_error))
+        for _, _, name, row in heapq.merge(*drains):
+            yield name, row
+    finally:
+        stop.set()
+
+
+def _merge_streams(
+    streams,
+    executor,
+    max_workers,
+    sort_key=None,
+    timeout=None,
+    on_error="raise",
+    queue_size=1000,
+):
+    """
+    Reads every `(name, open_stream)` in `streams` concurrently in `executor` and yields
+    `(name, item)` as items arrive or, with `sort_key`, merged in the order of that key.
+    At most `queue_size` items per stream are read ahead of the caller.
+    """
+    _check_on_error(on_error)
+    key = _key_function(sort_key)
+    if key is None:
+        return _merge_unordered(streams, executor, timeout, on_error, queue_size)
+    if len(streams) > max_workers:
+        # every stream has to produce its next item before any can be yielded
+        raise ValueError(
+            "An ordered merge of {} streams needs as many workers, not {}".format(
+                len(streams), max_workers
+            )
+        )
+    return _merge_ordered(streams, executor, key, timeout, on_error, queue_size)
+
+
+class ShardResults(OrderedDict):
+    """
+    Results by shard name in the order the shards were given.
+    `errors` holds the exceptions of shards skipped with `on_error="skip"`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ShardResults, self).__init__(*args, **kwargs)
+        self.errors = OrderedDict()
+
+
+class FanOut(object):
+    """
+    Runs the same query on many backend instances, e.g. the shards of a database,
+    concurrently in a bounded pool of threads.
+    """
+
+    def __init__(self, backends, max_workers=None, timeout=None, on_error="raise"):
+        """
+        :param backends:
+            A list of backend instances, named by position, or a dictionary of names to instances.
+        :param int max_workers:
+            Number of shards queried at a time. Defaults to one per shard, at most 32.
+        :param float timeout:
+            Seconds a shard may take once it started before it is treated as failed with
+            `ShardTimeout`. When streaming, seconds to wait for a shard's next row.
+            The query keeps running in its thread. `None` (default) waits forever.
+        :param str on_error:
+            `raise` (default) raises `FanOutError` once any shard failed, after waiting for the
+            others when not streaming. `skip` logs the failure and continues with the other shards.
+        """
+        _check_on_error(on_error)
+        if isinstance(backends, dict):
+            self._backends = OrderedDict(backends)
+        else:
+            self._backends = OrderedDict(enumerate(backends))
+        self._max_workers = max_workers or min(len(self._backends), 32) or 1
+        self._timeout = timeout
+        self._on_error = on_error
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def backends(self):
+        return self._backends
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        return self._executor
+
+    def run(self, func):
+        """
+        Calls `func(backend)` for every shard concurrently.
+
+        :return: `ShardResults` of the return values by shard name.
+        """
+        executor = self._get_executor()
+        started = dict()
+
+        def call(name, backend):
+            started[name] = _monotonic()
+            return func(backend)
+
+        futures = dict(
+            (executor.submit(call, name, backend), name)
+            for name, backend in self._backends.items()
+        )
+        values = dict()
+        errors = dict()
+        pending = set(futures)
+        while pending:
+            done, pending = wait(
+                pending,
+                timeout=self._next_deadline(pending, futures, started),
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                try:
+                    values[futures[future]] = future.result()
+                except Exception as e:
+                    errors[futures[future]] = e
+            if self._timeout is not None:
+                now = _monotonic()
+                for future in list(pending):
+                    name = futures[future]
+                    if name in started and now - started[name] >= self._timeout:
+                        pending.discard(future)
+                        errors[name] = ShardTimeout(
+                            "Did not complete in {} second(s)".format(self._timeout)
+                        )
+
+        results = ShardResults(
+            (name, values[name]) for name in self._backends if name in values
+        )
+        results.errors.update(
+            (name, errors[name]) for name in self._backends if name in errors
+        )
+        if results.errors:
+            if self._on_error == "raise":
+                raise FanOutError(results.errors, results)
+            for name, error in results.errors.items():
+                _logger.warning("Skipping shard %s: %r", name, error)
+        return results
+
+    def _next_deadline(self, pending, futures, started):
+        """Seconds until the first running shard times out."""
+        if self._timeout is None:
+            return None
+        deadlines = [
+            started[futures[future]] + self._timeout
+            for future in pending
+            if futures[future] in started
+        ]
+        if not deadlines:
+            # nothing has started yet; check again shortly
+            return 0.01
+        return max(0, min(deadlines) - _monotonic())
+
+    def execute(self, *args, **kwargs):
+        """
+        Executes a query on every shard concurrently.
+        Takes the same arguments as the backends' `execute()` except `stream`; use `stream()`.
+
+        :return: `ShardResults` of each shard's result by shard name.
+        """
+        if kwargs.get("stream"):
+            raise ValueError("Use stream() to stream results")
+        return self.run(lambda backend: backend.execute(*args, **kwargs))
+
+    def stream(self, *args, **kwargs):
+        """
+        Streams a query from every shard concurrently as one generator.
+        Takes the same arguments as the backends' `execute()` plus the following.
+
+        :param sort_key:
+            When given, rows are merged in ascending order of this column name, index or
+            callable. Each shard must return its rows sorted by it, e.g. with `ORDER BY`.
+            Requires `max_workers` to be at least the number of shards.
+            By default rows are yielded as they arrive.
+        :param bool with_shard: When `True`, `(name, row)` tuples are yielded. Defaults to `False`.
+        :param int queue_size: Rows read ahead per shard. Defaults to 1000.
+        """
+        sort_key = kwargs.pop("sort_key", None)
+        with_shard = kwargs.pop("with_shard", False)
+        queue_size = kwargs.pop("queue_size", 1000)
+        kwargs["stream"] = True
+
+        def opener(backend):
+            return lambda: backend.execute(*args, **kwargs)
+
+        merged = _merge_streams(
+            [(name, opener(backend)) for name, backend in self._backends.items()],
+            self._get_executor(),
+            self._max_workers,
+            sort_key,
+            self._timeout,
+            self._on_error,
+            queue_size,
+        )
+        if with_shard:
+            return merged
+        return (row for _, row in merged)
+
+    def close(self):
+        """Stops the worker threads. The backends are left open for their owner."""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
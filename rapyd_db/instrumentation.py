@@ -0,0 +1,223 @@
+import re
+import threading
+
+from collections import defaultdict
+
+from .utils import _monotonic
+
+
+CONNECT_START = "connect_start"
+CONNECT_END = "connect_end"
+EXECUTE_START = "execute_start"
+EXECUTE_END = "execute_end"
+FIRST_ROW = "first_row"
+STREAM_EXHAUSTED = "stream_exhausted"
+
+EVENTS = (
+    CONNECT_START,
+    CONNECT_END,
+    EXECUTE_START,
+    EXECUTE_END,
+    FIRST_ROW,
+    STREAM_EXHAUSTED,
+)
+
+# upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    float("inf"),
+)
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _fingerprint(query):
+    """
+    Reduces a query to its shape so executions with different literals are grouped,
+    e.g. `SELECT * FROM t WHERE id IN (1, 2)` becomes `SELECT * FROM t WHERE id IN (?)`.
+    """
+    query = _STRING_RE.sub("?", query)
+    query = _NUMBER_RE.sub("?", query)
+    query = query.replace("%s", "?")
+    query = _IN_LIST_RE.sub("(?)", query)
+    return _WHITESPACE_RE.sub(" ", query).strip()
+
+
+class _ExecuteTimer(object):
+    """
+    Emits `execute_start` when entered and `execute_end` when left, with the elapsed time,
+    the `rows` set on it and any exception raised.
+    """
+
+    __slots__ = ("backend", "log_id", "query", "start", "elapsed", "rows")
+
+    def __init__(self, backend, log_id, query):
+        self.backend = backend
+        self.log_id = log_id
+        self.query = query
+        self.start = None
+        self.elapsed = None
+        self.rows = None
+
+    def __enter__(self):
+        self.backend._emit(EXECUTE_START, log_id=self.log_id, query=self.query)
+        self.start = _monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = _monotonic() - self.start
+        self.backend._emit(
+            EXECUTE_END,
+            log_id=self.log_id,
+            query=self.query,
+            elapsed=self.elapsed,
+            rows=self.rows,
+            error=exc_value,
+        )
+
+    def since_start(self):
+        return _monotonic() - self.start
+
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, fraction):
+        """Estimates a percentile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return dict(
+            count=self.count,
+            total=self.total,
+            min=self.min,
+            max=self.max,
+            mean=self.total / self.count if self.count else None,
+            p50=self.percentile(0.5),
+            p95=self.percentile(0.95),
+            p99=self.percentile(0.99),
+            buckets=list(zip(self.buckets, self.counts)),
+        )
+
+
+class MetricsCollector(object):
+    """
+    An in-process listener keeping latency histograms, row counts and error counts per
+    query fingerprint plus connect time statistics for every backend it is attached to.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def attach(self, backend):
+        """Starts collecting from a backend. Returns the collector for chaining."""
+        for event in EVENTS:
+            backend.add_listener(event, self)
+        return self
+
+    def detach(self, backend):
+        for event in EVENTS:
+            backend.remove_listener(event, self)
+
+    def reset(self):
+        with self._lock:
+            self._queries = defaultdict(self._new_query_stats)
+            self._connect = _Histogram(self._buckets)
+            self._connect_errors = 0
+
+    def __call__(self, event, **info):
+        if event == CONNECT_END:
+            with self._lock:
+                if info.get("error") is not None:
+                    self._connect_errors += 1
+                else:
+                    self._connect.observe(info["elapsed"])
+            return
+        if event not in (EXECUTE_END, FIRST_ROW, STREAM_EXHAUSTED):
+            return
+
+        fingerprint = _fingerprint(info["query"])
+        with self._lock:
+            stats = self._queries[fingerprint]
+            if event == EXECUTE_END:
+                stats["execute"].observe(info["elapsed"])
+                if info.get("error") is not None:
+                    stats["errors"] += 1
+                if info.get("rows") is not None:
+                    stats["rows"] += info["rows"]
+            elif event == FIRST_ROW:
+                stats["first_row"].observe(info["elapsed"])
+            else:
+                stats["stream"].observe(info["elapsed"])
+                if info.get("rows") is not None:
+                    stats["rows"] += info["rows"]
+
+    def snapshot(self):
+        """Returns all statistics collected so far as plain dictionaries, e.g. to dump as JSON."""
+        with self._lock:
+            queries = dict()
+            for fingerprint, stats in self._queries.items():
+                queries[fingerprint] = dict(
+                    errors=stats["errors"],
+                    rows=stats["rows"],
+                    execute=stats["execute"].snapshot(),
+                    first_row=stats["first_row"].snapshot(),
+                    stream=stats["stream"].snapshot(),
+                )
+            return dict(
+                queries=queries,
+                connect=dict(
+                    errors=self._connect_errors, latency=self._connect.snapshot()
+                ),
+            )
+
+    def _new_query_stats(self):
+        return dict(
+            errors=0,
+            rows=0,
+            execute=_Histogram(self._buckets),
+            first_row=_Histogram(self._buckets),
+            stream=_Histogram(self._buckets),
+        )
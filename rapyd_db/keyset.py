@@ -0,0 +1,130 @@
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import time
+
+from collections import namedtuple
+
+import six
+
+try:
+    from bson import ObjectId
+except ImportError:
+    ObjectId = None
+
+
+_logger = logging.getLogger(__name__)
+
+# a page of rows and the checkpoint to resume reading after its last row
+Page = namedtuple("Page", ("rows", "checkpoint"))
+
+_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def _encode_value(value):
+    """Tags a key value with its type so it survives the round trip through JSON."""
+    if value is None:
+        return ["n", None]
+    if isinstance(value, bool):
+        return ["b", value]
+    if isinstance(value, six.integer_types):
+        return ["i", value]
+    if isinstance(value, float):
+        return ["f", repr(value)]
+    if isinstance(value, decimal.Decimal):
+        return ["d", str(value)]
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            raise ValueError("Timezone aware keys cannot be checkpointed")
+        return ["dt", value.strftime(_DATETIME_FORMAT)]
+    if isinstance(value, datetime.date):
+        return ["da", value.isoformat()]
+    if isinstance(value, bytes):
+        return ["x", base64.b64encode(value).decode("ascii")]
+    if isinstance(value, six.text_type):
+        return ["s", value]
+    if ObjectId is not None and isinstance(value, ObjectId):
+        return ["o", str(value)]
+    raise ValueError("Key values of type {} cannot be checkpointed".format(type(value)))
+
+
+def _decode_value(tagged):
+    tag, value = tagged
+    if tag in ("n", "b", "i", "s"):
+        return value
+    if tag == "f":
+        return float(value)
+    if tag == "d":
+        return decimal.Decimal(value)
+    if tag == "dt":
+        return datetime.datetime.strptime(value, _DATETIME_FORMAT)
+    if tag == "da":
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    if tag == "x":
+        return base64.b64decode(value)
+    if tag == "o" and ObjectId is not None:
+        return ObjectId(value)
+    raise ValueError("Unknown key type {!r} in checkpoint".format(tag))
+
+
+def _scope(*parts):
+    """Identifies the read a checkpoint belongs to so it cannot resume a different one."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _encode_checkpoint(scope, values):
+    document = dict(v=1, s=scope, k=[_encode_value(value) for value in values])
+    payload = json.dumps(document, separators=(",", ":"), sort_keys=True)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def _decode_checkpoint(scope, checkpoint):
+    """Returns the key values stored in a checkpoint. Raises `ValueError` if it is invalid."""
+    try:
+        document = json.loads(
+            base64.urlsafe_b64decode(checkpoint.encode("ascii")).decode("utf-8")
+        )
+        values = [_decode_value(tagged) for tagged in document["k"]]
+    except (TypeError, KeyError, ValueError, UnicodeError) as e:
+        raise ValueError("Invalid checkpoint: {}".format(e))
+    if document.get("s") != scope:
+        raise ValueError("The checkpoint was taken for a different read")
+    return values
+
+
+def _keyset_condition(keys):
+    """
+    Returns the condition selecting rows after a key in `keys` order and the positions of
+    the key values its `%s` placeholders take, e.g. `(a > %s OR (a = %s AND b > %s))`
+    with positions `[0, 0, 1]` for keys `a` and `b`.
+    """
+    condition = "{} > %s".format(keys[-1])
+    positions = [len(keys) - 1]
+    for index in range(len(keys) - 2, -1, -1):
+        condition = "({key} > %s OR ({key} = %s AND {rest}))".format(
+            key=keys[index], rest=condition
+        )
+        positions = [index, index] + positions
+    if len(keys) == 1:
+        condition = "({})".format(condition)
+    return condition, positions
+
+
+def _with_retries(fetch, transient_errors, retries, retry_delay):
+    """Calls `fetch`, retrying up to `retries` times with a doubling delay on transient errors."""
+    attempt = 0
+    while True:
+        try:
+            return fetch()
+        except transient_errors as e:
+            if attempt >= retries:
+                raise
+            delay = retry_delay * 2 ** attempt
+            attempt += 1
+            _logger.warning(
+                "Reading page failed (%r), retrying in %.1f second(s)", e, delay
+            )
+            time.sleep(delay)
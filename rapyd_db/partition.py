@@ -0,0 +1,113 @@
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import six
+
+from six.moves import queue
+
+from .exceptions import FanOutError, ScanTimeout, ShardTimeout
+from .fanout import _drain, _merge_streams, _pump
+
+
+# ranges opened ahead of the one being yielded by an ordered read
+_ORDERED_READ_AHEAD = 1
+
+
+def _range_starts(lo, hi, partitions):
+    """
+    Splits `[lo, hi]` into up to `partitions` ranges of equal width and returns the start
+    of each. Works for numbers, dates and anything else supporting subtraction and
+    division of the difference. Raises `TypeError` for other values.
+    """
+    if lo == hi:
+        return [lo]
+    if isinstance(lo, six.integer_types) and isinstance(hi, six.integer_types):
+        starts = [lo + (hi - lo) * i // partitions for i in range(partitions)]
+    else:
+        starts = [lo + (hi - lo) * i / partitions for i in range(partitions)]
+    # narrow ranges of integers give repeated starts
+    unique = []
+    for start in starts:
+        if not unique or start != unique[-1]:
+            unique.append(start)
+    return unique
+
+
+def _no_key(row):
+    return 0
+
+
+def _read_ordered(streams, executor, timeout, queue_size):
+    """
+    Yields the rows of every `(index, open_stream)` partition after partition, reading
+    `_ORDERED_READ_AHEAD` partitions ahead of the one being yielded. Later partitions are
+    only opened once earlier ones are done, as a server stops a query whose rows are left
+    unread for too long, e.g. after MySQL's `net_write_timeout`.
+    """
+    stop = threading.Event()
+    unopened = iter(streams)
+    opened = deque()
+
+    def open_next():
+        for index, open_stream in unopened:
+            q = queue.Queue(queue_size)
+            executor.submit(_pump, index, open_stream, q, stop)
+            opened.append((index, q))
+            return
+
+    try:
+        for _ in range(1 + _ORDERED_READ_AHEAD):
+            open_next()
+        while opened:
+            index, q = opened.popleft()
+            for _, _, _, row in _drain(index, q, _no_key, index, timeout, "raise"):
+                yield index, row
+            open_next()
+    finally:
+        stop.set()
+
+
+def _scan_error(error, timeout):
+    """
+    Returns the error of a failed range in place of the `FanOutError` of the shared
+    readers, or a `ScanTimeout` when ranges only timed out.
+    """
+    for e in error.errors.values():
+        if not isinstance(e, ShardTimeout):
+            return e
+    return ScanTimeout(
+        "No rows from range(s) {} for {} second(s)".format(
+            ", ".join(map(str, error.errors)), timeout
+        )
+    )
+
+
+def _read_partitions(streams, ordered=False, timeout=None, queue_size=1000):
+    """
+    Reads every `(index, open_stream)` concurrently, each in its own thread, and yields
+    the rows as they arrive or, when `ordered`, partition after partition. Raises the
+    error of a failed range, or `ScanTimeout` when a range has no next row in `timeout`.
+    """
+    if not streams:
+        return
+    if ordered:
+        executor = ThreadPoolExecutor(
+            max_workers=min(len(streams), 1 + _ORDERED_READ_AHEAD)
+        )
+        merged = _read_ordered(streams, executor, timeout, queue_size)
+    else:
+        executor = ThreadPoolExecutor(max_workers=len(streams))
+        merged = _merge_streams(
+            streams, executor, len(streams), timeout=timeout, queue_size=queue_size
+        )
+    try:
+        for _, row in merged:
+            yield row
+    except FanOutError as e:
+        six.raise_from(_scan_error(e, timeout), None)
+    finally:
+        # stops the readers when the caller stops early
+        merged.close()
+        executor.shutdown(wait=False)
@@ -0,0 +1,184 @@
+import logging
+import threading
+
+from collections import deque
+
+from .exceptions import PoolTimeout
+from .utils import _monotonic
+
+
+_logger = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    """
+    A bounded, thread-safe pool of live DB connections.
+
+    Up to `pool_size` idle connections are kept around for reuse. When all of
+    them are checked out, up to `max_overflow` additional connections can be
+    opened; these are closed as soon as they are returned to the pool.
+    """
+
+    def __init__(
+        self,
+        creator,
+        pool_size=5,
+        max_overflow=0,
+        timeout=30,
+        recycle=None,
+        ping=None,
+        reset=None,
+    ):
+        """
+        :param callable creator: Called without arguments to open a new connection.
+        :param int pool_size: Number of idle connections to keep. Defaults to 5.
+        :param int max_overflow:
+            Number of connections allowed beyond `pool_size` under load. Defaults to 0.
+        :param float timeout:
+            How long to wait, in seconds, for a connection when the pool is exhausted.
+            `None` waits forever. Defaults to 30.
+        :param float recycle:
+            Connections older than this many seconds are closed and replaced on checkout.
+            `None` disables recycling.
+        :param callable ping:
+            Called with a connection on checkout; should return `False` or raise
+            when the connection is no longer usable.
+        :param callable reset:
+            Called with a connection when it is returned to the pool to clear any
+            session state. A connection whose reset raises is discarded.
+        """
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        if max_overflow < 0:
+            raise ValueError("max_overflow cannot be negative")
+        self._creator = creator
+        self._pool_size = pool_size
+        self._max_overflow = max_overflow
+        self._timeout = timeout
+        self._recycle = recycle
+        self._ping = ping
+        self._reset = reset
+
+        self._condition = threading.Condition(threading.Lock())
+        # idle connections as (connection, created_at); reused LIFO so that
+        # rarely used connections age out through `recycle`
+        self._idle = deque()
+        self._created = dict()
+        self._open = 0
+        self._disposed = False
+
+    @property
+    def size(self):
+        """Number of connections currently open, idle or checked out."""
+        return self._open
+
+    @property
+    def idle(self):
+        """Number of idle connections waiting in the pool."""
+        return len(self._idle)
+
+    def acquire(self):
+        """Checks out a connection, opening a new one if required and allowed."""
+        deadline = None if self._timeout is None else _monotonic() + self._timeout
+        with self._condition:
+            while True:
+                if self._disposed:
+                    raise RuntimeError("Connection pool has been disposed")
+                if self._idle:
+                    connection, created_at = self._idle.pop()
+                    break
+                if self._open < self._pool_size + self._max_overflow:
+                    self._open += 1
+                    connection = None
+                    break
+                remaining = None if deadline is None else deadline - _monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeout(
+                        "Timed out waiting for a connection after {} second(s)".format(
+                            self._timeout
+                        )
+                    )
+                self._condition.wait(remaining)
+
+        if connection is None:
+            return self._open_connection()
+
+        if self._recycle is not None and _monotonic() - created_at > self._recycle:
+            _logger.debug("Recycling connection older than %s second(s)", self._recycle)
+            self._close_connection(connection)
+            # the slot of the closed connection is handed to its replacement
+            return self._open_connection()
+
+        if self._ping is not None and not self._is_alive(connection):
+            _logger.info("Discarding stale connection from pool")
+            self._close_connection(connection)
+            return self._open_connection()
+
+        self._created[id(connection)] = created_at
+        return connection
+
+    def release(self, connection, discard=False):
+        """
+        Returns a checked out connection to the pool.
+
+        :param connection: Connection previously returned by `acquire()`.
+        :param bool discard: When `True`, the connection is closed instead of reused.
+        """
+        created_at = self._created.pop(id(connection), None)
+        if not discard and self._reset is not None:
+            try:
+                self._reset(connection)
+            except Exception:
+                _logger.warning("Could not reset connection; discarding it", exc_info=True)
+                discard = True
+
+        with self._condition:
+            keep = (
+                not discard
+                and not self._disposed
+                and created_at is not None
+                and len(self._idle) < self._pool_size
+            )
+            if keep:
+                self._idle.append((connection, created_at))
+            else:
+                self._open -= 1
+            self._condition.notify()
+
+        if not keep:
+            self._close_connection(connection)
+
+    def dispose(self):
+        """Closes all idle connections. Checked out connections are closed when released."""
+        with self._condition:
+            self._disposed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for connection, _ in idle:
+            self._close_connection(connection)
+
+    def _open_connection(self):
+        try:
+            connection = self._creator()
+        except Exception:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+        self._created[id(connection)] = _monotonic()
+        return connection
+
+    def _is_alive(self, connection):
+        try:
+            return self._ping(connection) is not False
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_connection(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
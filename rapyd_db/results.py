@@ -0,0 +1,164 @@
+import array
+
+import six
+
+from collections import namedtuple
+from six.moves import map
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+RESULT_FORMATS = ("rows", "columns")
+ROW_TYPES = ("dict", "tuple", "record")
+
+
+def _check_result_format(result_format, stream):
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(
+            "result_format must be one of {}, not {!r}".format(
+                ", ".join(RESULT_FORMATS), result_format
+            )
+        )
+    if result_format == "columns" and stream:
+        raise ValueError("result_format='columns' cannot be used with stream=True")
+
+
+def _fetch_chunks(cursor, chunk_size):
+    """Yields lists of up to `chunk_size` rows fetched from a DB-API cursor."""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield list(rows)
+
+
+def _typecode(values):
+    """Returns the `array.array` typecode able to hold all values or `None`."""
+    if all(
+        isinstance(value, int)
+        and not isinstance(value, bool)
+        and -(2 ** 63) <= value < 2 ** 63
+        for value in values
+    ):
+        return "q"
+    if all(
+        isinstance(value, (int, float)) and not isinstance(value, bool)
+        for value in values
+    ):
+        return "d"
+    return None
+
+
+def _numpy_array(values):
+    """
+    Returns a typed array for numbers, booleans and datetimes and an object array for
+    anything else. Text and bytes are never given a fixed width type, which would pad every
+    value to the longest one and drop trailing NUL bytes.
+    """
+    if not any(isinstance(value, (six.text_type, bytes)) for value in values):
+        values = numpy.asarray(values)
+        if values.dtype.kind in "iufbM":
+            return values
+    column = numpy.empty(len(values), dtype=object)
+    column[:] = list(values)
+    return column
+
+
+def _new_column(values):
+    if numpy is not None:
+        return [_numpy_array(values)]
+    typecode = _typecode(values)
+    if typecode is None:
+        return list(values)
+    return array.array(typecode, values)
+
+
+def _extend_column(column, values):
+    if numpy is not None:
+        column.append(_numpy_array(values))
+        return column
+    if isinstance(column, array.array):
+        typecode = _typecode(values)
+        if typecode == column.typecode or (typecode == "q" and column.typecode == "d"):
+            column.extend(values)
+            return column
+        if typecode == "d":
+            column = array.array("d", column)
+        else:
+            # a value does not fit a typed array so this column holds objects from now on
+            column = list(column)
+    column.extend(values)
+    return column
+
+
+def _finish_column(column):
+    if numpy is not None:
+        kinds = set(chunk.dtype.kind for chunk in column)
+        if len(kinds) > 1 and not kinds <= set("iuf"):
+            # e.g. NULLs in only some chunks; objects keep every value as it was read
+            column = [chunk.astype(object) for chunk in column]
+        return numpy.concatenate(column)
+    return column
+
+
+def _fetch_columns(cursor, chunk_size=10000):
+    """
+    Reads all rows from a tuple returning cursor `chunk_size` rows at a time into a mapping
+    of column name to a typed NumPy array, or an `array.array` when NumPy is not installed.
+    Columns holding values that cannot be stored in a typed array fall back to object arrays
+    or lists.
+
+    :return: A tuple of the number of rows read and the mapping of columns.
+    """
+    names = [column[0] for column in cursor.description or ()]
+    columns = None
+    row_count = 0
+    for rows in _fetch_chunks(cursor, chunk_size):
+        row_count += len(rows)
+        if columns is None:
+            columns = [_new_column(values) for values in zip(*rows)]
+        else:
+            columns = [
+                _extend_column(column, values)
+                for column, values in zip(columns, zip(*rows))
+            ]
+
+    if columns is None:
+        columns = [_new_column(()) for _ in names]
+    return row_count, dict(zip(names, [_finish_column(column) for column in columns]))
+
+
+def _check_row_type(row_type):
+    if row_type not in ROW_TYPES:
+        raise ValueError(
+            "row_type must be one of {}, not {!r}".format(", ".join(ROW_TYPES), row_type)
+        )
+
+
+def _record_class(description):
+    """
+    Builds a namedtuple class for the columns of a result set.
+    The column names as returned by the DB are kept in `_columns`.
+    """
+    names = [column[0] for column in description]
+    # rename=True replaces column names that are not valid identifiers, e.g. `COUNT(*)`
+    record = namedtuple("Record", names, rename=True)
+    record._columns = tuple(names)
+    return record
+
+
+def _as_records(rows, description, chunked=False):
+    """
+    Converts tuple rows, or lists of tuple rows when `chunked`, into records of a class
+    built once from the cursor `description`.
+    """
+    if description is None:
+        # a statement without a result set, e.g. an INSERT, has no rows to convert
+        return iter(())
+    make = _record_class(description)._make
+    if chunked:
+        return (list(map(make, chunk)) for chunk in rows)
+    return map(make, rows)
@@ -0,0 +1,246 @@
+import logging
+import re
+import threading
+import types
+
+from .exceptions import NoReplicaAvailable
+from .stream import Stream
+from .utils import _monotonic
+
+
+_logger = logging.getLogger(__name__)
+
+# reads that take locks, call lock or sequence functions or write a file or table have
+# to run on the primary, and their results can be neither cached nor shared
+_PRIMARY_ONLY_READ_RE = re.compile(
+    r"\bFOR\s+(?:UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b|\bINTO\b"
+    r"|\b(?:UPDLOCK|XLOCK|HOLDLOCK)\b|\bNEXT\s+VALUE\s+FOR\b"
+    r"|\b(?:GET_LOCK|RELEASE_LOCK|RELEASE_ALL_LOCKS|IS_FREE_LOCK|IS_USED_LOCK"
+    r"|NEXTVAL|SETVAL|LASTVAL|LAST_INSERT_ID)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def _is_replica_read(query):
+    """Whether a statement starting with `SELECT` or `WITH` can run on a replica."""
+    return _PRIMARY_ONLY_READ_RE.search(query) is None
+
+
+class _Replica(object):
+    def __init__(self, backend):
+        self.backend = backend
+        # reads and streams running on the replica, changed under the router's lock
+        self.outstanding = 0
+        self.lag = None
+        self.checked_at = None
+        self.checking = threading.Lock()
+
+
+class _TrackedStream(object):
+    """Counts a stream as outstanding on its replica until it is exhausted or closed."""
+
+    def __init__(self, rows, release):
+        self._rows = rows
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._rows)
+        except BaseException:
+            self._done()
+            raise
+
+    # python 2
+    next = __next__
+
+    def cancel(self):
+        return self._rows.cancel()
+
+    def close(self):
+        try:
+            self._rows.close()
+        finally:
+            self._done()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # abandoned streams must not keep their replica looking busy
+        self._done()
+
+    def _done(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._release()
+
+
+class Router(object):
+    """
+    Splits reads from writes over one primary and any number of replicas of it, each a
+    backend instance of the same type. Reads run on the replica with the fewest reads
+    outstanding, skipping replicas lagging too far behind; everything else runs on the
+    primary. Reads on replicas can miss the latest writes, so reads which have to see
+    them should go through `primary` or `write()`.
+    """
+
+    def __init__(
+        self,
+        primary,
+        replicas,
+        max_lag=None,
+        lag_interval=5,
+        lag=None,
+        fallback_to_primary=True,
+    ):
+        """
+        :param primary: Backend instance writes, sessions and transactions run on.
+        :param replicas: A list of backend instances reads are spread over.
+        :param float max_lag:
+            Replicas more than this many seconds behind the primary, or whose lag cannot
+            be determined, are skipped. `None` (default) does not check the lag.
+        :param float lag_interval:
+            Seconds a replica's measured lag is used for before it is measured again.
+            Defaults to 5.
+        :param callable lag:
+            Called with a replica and returns its lag in seconds or `None` when unknown.
+            Defaults to the backend's own check: the seconds behind the source of
+            `SHOW REPLICA STATUS` on MySQL, the estimated redo time of an availability group
+            secondary on MSSQL and the optime behind the primary of `replSetGetStatus` on
+            mongoDB.
+        :param bool fallback_to_primary:
+            When `True` (default) reads run on the primary while no replica is usable,
+            otherwise `NoReplicaAvailable` is raised.
+        """
+        self._primary = primary
+        self._replicas = [_Replica(replica) for replica in replicas]
+        self._max_lag = max_lag
+        self._lag_interval = lag_interval
+        self._lag = lag or (lambda backend: backend._replica_lag())
+        self._fallback_to_primary = fallback_to_primary
+        self._lock = threading.Lock()
+        self._turn = 0
+
+    @property
+    def primary(self):
+        return self._primary
+
+    @property
+    def replicas(self):
+        return [replica.backend for replica in self._replicas]
+
+    def execute(self, *args, **kwargs):
+        """
+        Executes a statement on a replica when it only reads, streamed or not, otherwise
+        on the primary. Takes the same arguments as the backends' `execute()`.
+        """
+        if self._primary._is_read(*args, **kwargs):
+            return self.read(lambda backend: backend.execute(*args, **kwargs))
+        return self._primary.execute(*args, **kwargs)
+
+    def execute_many(self, *args, **kwargs):
+        """Runs the primary's `execute_many()`."""
+        return self._primary.execute_many(*args, **kwargs)
+
+    def session(self, *args, **kwargs):
+        """A session on the primary."""
+        return self._primary.session(*args, **kwargs)
+
+    def transaction(self):
+        """A transaction on the primary."""
+        return self._primary.transaction()
+
+    def read(self, func):
+        """
+        Calls `func(backend)` with the replica to read from, e.g. to run `export()` or
+        `parallel_scan()` there, and returns its result. A stream or generator returned is
+        counted as outstanding on the replica until it is exhausted or closed.
+        """
+        replica = self._choose()
+        if replica is None:
+            return func(self._primary)
+        try:
+            result = func(replica.backend)
+        except BaseException:
+            self._release(replica)
+            raise
+        if isinstance(result, (Stream, types.GeneratorType)):
+            return _TrackedStream(result, lambda: self._release(replica))
+        self._release(replica)
+        return result
+
+    def write(self, func):
+        """Calls `func(backend)` with the primary and returns its result."""
+        return func(self._primary)
+
+    def close(self):
+        """Closes the primary and all replicas."""
+        for backend in [self._primary] + self.replicas:
+            backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _choose(self):
+        """Returns the usable replica with the fewest reads outstanding and counts one more."""
+        replicas = [replica for replica in self._replicas if self._usable(replica)]
+        if not replicas:
+            if not self._fallback_to_primary:
+                raise NoReplicaAvailable(
+                    "None of {} replica(s) is within the allowed lag".format(
+                        len(self._replicas)
+                    )
+                )
+            _logger.warning("No replica is usable; reading from the primary")
+            return None
+        with self._lock:
+            # rotating the candidates spreads reads evenly over replicas equally busy
+            self._turn = (self._turn + 1) % len(replicas)
+            replicas = replicas[self._turn :] + replicas[: self._turn]
+            replica = min(replicas, key=lambda replica: replica.outstanding)
+            replica.outstanding += 1
+        return replica
+
+    def _release(self, replica):
+        with self._lock:
+            replica.outstanding -= 1
+
+    def _usable(self, replica):
+        if self._max_lag is None:
+            return True
+        if self._stale(replica) and replica.checking.acquire(False):
+            # one thread measures while the others use the last measurement
+            try:
+                if self._stale(replica):
+                    replica.lag = self._measure(replica.backend)
+                    replica.checked_at = _monotonic()
+            finally:
+                replica.checking.release()
+        lag = replica.lag
+        return lag is not None and lag <= self._max_lag
+
+    def _stale(self, replica):
+        return (
+            replica.checked_at is None
+            or _monotonic() - replica.checked_at >= self._lag_interval
+        )
+
+    def _measure(self, backend):
+        try:
+            return self._lag(backend)
+        except Exception:
+            _logger.warning("Could not measure the lag of a replica", exc_info=True)
+            return None
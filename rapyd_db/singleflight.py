@@ -0,0 +1,63 @@
+import sys
+import threading
+
+import six
+
+
+class _Call(object):
+    __slots__ = ("done", "result", "exc_info")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the function and
+    callers arriving while it runs wait for it and get the same result or exception.
+    Nothing is kept once the call completes, so later callers run the function again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> the call in flight
+        self._calls = dict()
+        self.executions = 0
+        self.shared = 0
+
+    @property
+    def stats(self):
+        """Returns a dictionary of the `executions` run and the callers given a `shared` result."""
+        with self._lock:
+            return dict(executions=self.executions, shared=self.shared)
+
+    def do(self, key, func):
+        """Returns the result of `func()`, called only if no call for `key` is in flight."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.exc_info is not None:
+                six.reraise(*call.exc_info)
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
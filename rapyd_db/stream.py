@@ -0,0 +1,198 @@
+import logging
+import threading
+import weakref
+
+import six
+
+from contextlib import contextmanager
+
+from .exceptions import QueryCancelled, QueryTimeout
+
+
+_logger = logging.getLogger(__name__)
+
+
+def _check_timeout(timeout, stream):
+    if timeout is not None and not stream:
+        raise ValueError("timeout can only be used with stream=True")
+
+
+@contextmanager
+def _cancellable(cancel_hook, cancel_query):
+    """
+    Lets a stream stop its query with `cancel_query` until the block is left, which must
+    happen before the query's connection is released to be reused by others.
+    """
+    if cancel_hook is None:
+        yield
+        return
+    cancel_hook(cancel_query)
+    try:
+        yield
+    finally:
+        cancel_hook(None)
+
+
+def _weak_method(obj, name):
+    """Returns a function calling the method `name` of `obj` without keeping `obj` alive."""
+    ref = weakref.ref(obj)
+
+    def call(*args):
+        target = ref()
+        if target is not None:
+            return getattr(target, name)(*args)
+
+    return call
+
+
+class Stream(object):
+    """
+    Iterates over the rows of a streamed query.
+
+    Closing it, directly or by leaving a `with` block, before the last row stops the query
+    on the server and releases its connection right away instead of reading the rest of
+    the result or waiting for garbage collection. A stream dropped unclosed, e.g. by
+    breaking out of a loop over it, is closed as soon as it is no longer referenced.
+    `cancel()` can be called from any thread; a thread reading the stream then gets
+    `QueryCancelled`.
+    """
+
+    def __init__(self, open_stream, timeout=None):
+        """
+        :param callable open_stream:
+            Called with `cancel_hook` and returns the generator of rows. The generator calls
+            `cancel_hook` with a function stopping its query once the query is about to run
+            and with `None` before it releases the query's connection.
+        :param float timeout:
+            Seconds after which the query is cancelled and reading raises `QueryTimeout`.
+        """
+        # held while reading so the generator is only ever closed between reads
+        self._reading = threading.Lock()
+        self._lock = threading.Lock()
+        # held while the query is being stopped so its connection is not released meanwhile
+        self._cancelling = threading.Lock()
+        self._cancel_query = None
+        self._error = None
+        self._done = False
+        self._closed = False
+        self._timer = None
+        # the generator and the timer only refer to the stream weakly, so it can be closed
+        # once its reader drops it
+        self._rows = open_stream(cancel_hook=_weak_method(self, "_set_cancel"))
+        if timeout is not None:
+            self._timer = threading.Timer(
+                timeout,
+                _weak_method(self, "_interrupt"),
+                (QueryTimeout("Cancelled after {} second(s)".format(timeout)),),
+            )
+            self._timer.daemon = True
+            self._timer.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._reading:
+            if self._closed:
+                raise StopIteration
+            if self._error is not None:
+                self._close_rows()
+                raise self._error
+            try:
+                return next(self._rows)
+            except StopIteration:
+                self._finish()
+                if self._error is not None:
+                    # a cursor closed on the server can end as if all rows were read
+                    raise self._error
+                raise
+            except Exception as e:
+                self._finish()
+                if self._error is not None:
+                    # the error the driver raised for the interrupted query
+                    six.raise_from(self._error, e)
+                raise
+
+    # python 2
+    next = __next__
+
+    def cancel(self):
+        """
+        Stops the query on the server. Returns `False` if it had already ended or been
+        cancelled.
+        """
+        return self._interrupt(QueryCancelled("Cancelled"))
+
+    def close(self):
+        """Stops the query on the server if rows are left unread and releases its connection."""
+        self._stop(QueryCancelled("The stream was closed"))
+        with self._reading:
+            self._closed = True
+            self._close_rows()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, "_rows"):
+            self.close()
+
+    def _set_cancel(self, cancel_query):
+        # waits for a cancel in progress, which must not reach a released connection
+        with self._cancelling:
+            with self._lock:
+                if cancel_query is None:
+                    # the query ended and its connection may be reused by others
+                    self._done = True
+                self._cancel_query = cancel_query
+                cancelled = self._error is not None
+            if cancelled and cancel_query is not None:
+                # cancelled while the query was being sent
+                self._call(cancel_query)
+
+    def _stop(self, error):
+        with self._lock:
+            if self._done or self._error is not None:
+                return False
+            self._error = error
+        if self._timer is not None:
+            self._timer.cancel()
+        with self._cancelling:
+            # None once the generator has released the connection
+            if self._cancel_query is not None:
+                self._call(self._cancel_query)
+        return True
+
+    def _interrupt(self, error):
+        if not self._stop(error):
+            return False
+        # a thread in the middle of a read closes the rows itself when the read fails
+        if self._reading.acquire(False):
+            try:
+                self._close_rows()
+            finally:
+                self._reading.release()
+        return True
+
+    def _finish(self):
+        with self._lock:
+            self._done = True
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def _close_rows(self):
+        self._finish()
+        try:
+            self._rows.close()
+        except Exception:
+            # the driver may complain about the query it was told to stop
+            _logger.debug("Error closing a cancelled stream", exc_info=True)
+
+    def _call(self, cancel_query):
+        try:
+            cancel_query()
+        except Exception:
+            _logger.warning("Could not cancel the query", exc_info=True)
@@ -0,0 +1,88 @@
+import sys
+import threading
+import time
+import unittest
+
+if sys.version_info >= (3, 7):
+    import asyncio
+
+    from rapyd_db.aio import AsyncBackend, _AsyncSQLBackend
+
+
+class FakeBackend(object):
+    _pool = None
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.closed_streams = 0
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def execute(self, query, params=None, stream=False, chunk_size=None):
+        if stream:
+            return self._stream(params)
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.01)
+        with self._lock:
+            self.running -= 1
+        return query
+
+    def _stream(self, count):
+        try:
+            for row in range(count):
+                yield dict(row=row)
+        finally:
+            self.closed_streams += 1
+
+    def close(self):
+        self.closed = True
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "asyncio front-ends require python 3.7")
+class TestAsyncBackend(unittest.TestCase):
+    def test_00_async_concurrency_is_bounded(self):
+        backend = FakeBackend()
+        db = _AsyncSQLBackend(backend, max_workers=2)
+
+        async def main():
+            results = await asyncio.gather(
+                *[db.execute("SELECT {}".format(i)) for i in range(10)]
+            )
+            await db.close()
+            return results
+
+        results = asyncio.run(main())
+        self.assertEqual(["SELECT {}".format(i) for i in range(10)], results)
+        self.assertLessEqual(backend.peak, 2)
+        self.assertTrue(backend.closed)
+
+    def test_01_async_stream(self):
+        backend = FakeBackend()
+        db = _AsyncSQLBackend(backend, prefetch=3)
+
+        async def main():
+            return [row async for row in db.stream("SELECT", 10)]
+
+        rows = asyncio.run(main())
+        self.assertEqual([dict(row=row) for row in range(10)], rows)
+        self.assertEqual(1, backend.closed_streams)
+
+    def test_02_async_stream_closed_early(self):
+        backend = FakeBackend()
+        db = _AsyncSQLBackend(backend, prefetch=3)
+
+        async def main():
+            stream = db.stream("SELECT", 10)
+            async for row in stream:
+                if row["row"] == 4:
+                    break
+            await stream.aclose()
+
+        asyncio.run(main())
+        self.assertEqual(1, backend.closed_streams)
+
+    def test_03_async_default_workers(self):
+        self.assertEqual(4, AsyncBackend(FakeBackend())._max_workers)
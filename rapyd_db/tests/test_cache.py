@@ -0,0 +1,148 @@
+import time
+import unittest
+
+from rapyd_db.backends import AbstractBackend
+from rapyd_db.cache import (
+    QueryCache,
+    _cache_key,
+    _is_read_only,
+    _read_tags,
+    _write_tags,
+)
+
+
+class FakeBackend(AbstractBackend):
+    def __init__(self, cache):
+        self._cache = cache
+        self.executed = []
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def execute(self, query, params=None, use_cache=True):
+        def run():
+            self.executed.append(query)
+            return len(self.executed)
+
+        return self._through_cache(query, params, run, use_cache)
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_00_table_tags(self):
+        self.assertEqual(
+            set(["salaries", "employees"]),
+            _read_tags(
+                "SELECT * FROM `test_db`.`salaries` s JOIN employees e ON s.emp_no = e.emp_no"
+            ),
+        )
+        self.assertEqual(
+            set(["salaries"]),
+            _write_tags("INSERT INTO [test_db].[dbo].[salaries] VALUES (%s)"),
+        )
+        self.assertEqual(set(["salaries"]), _write_tags("delete from salaries"))
+        self.assertEqual(
+            set(["a", "b", "c"]),
+            _read_tags("SELECT * FROM a, `b` AS x, (SELECT 1 FROM c) y WHERE 1"),
+        )
+        self.assertEqual(
+            _cache_key("SELECT  *\n FROM t", (1,)), _cache_key("SELECT * FROM t", (1,))
+        )
+        self.assertNotEqual(
+            _cache_key("SELECT * FROM t WHERE a = 'x  y'", ()),
+            _cache_key("SELECT * FROM t WHERE a = 'x y'", ()),
+        )
+
+    def test_01_statements_read_only_or_written_tables_unknown(self):
+        self.assertTrue(_is_read_only("WITH a (x) AS (SELECT 1) SELECT * FROM a"))
+        self.assertFalse(_is_read_only("WITH a AS (SELECT 1) DELETE FROM t"))
+        self.assertFalse(_is_read_only("SELECT * INTO t2 FROM t"))
+        self.assertTrue(_is_read_only("(SELECT a FROM t) UNION (SELECT a FROM u)"))
+        for query in (
+            "SELECT * FROM t WHERE id = 1 FOR UPDATE",
+            "SELECT * FROM t LOCK IN SHARE MODE",
+            "SELECT * FROM t WITH (UPDLOCK) WHERE id = 1",
+            "SELECT GET_LOCK('job', 10)",
+            "SELECT NEXT VALUE FOR seq",
+            "SELECT nextval('seq')",
+        ):
+            self.assertFalse(_is_read_only(query), query)
+            # they change no table data so nothing cached is dropped
+            self.assertEqual(set(), _write_tags(query), query)
+        for query in (
+            "WITH a AS (SELECT 1) DELETE FROM t",
+            "UPDATE a JOIN b ON a.id = b.id SET a.x = b.x",
+            "DELETE a FROM a, b WHERE a.id = b.id",
+            "CALL archive_salaries()",
+            "RENAME TABLE a TO b",
+            "DROP DATABASE test_db",
+            "LOAD DATA LOCAL INFILE 'salaries.csv' INTO TABLE salaries",
+        ):
+            self.assertIsNone(_write_tags(query), query)
+        self.assertEqual(set(), _write_tags("SET NAMES utf8mb4"))
+
+    def test_02_cache_lru_eviction(self):
+        cache = QueryCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((False, None), cache.get("b"))
+        self.assertEqual((True, 1), cache.get("a"))
+        self.assertEqual(1, cache.stats["evictions"])
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_03_cache_ttl_and_bytes(self):
+        cache = QueryCache(ttl=0.05, max_bytes=2000)
+        cache.set("a", [1, 2, 3])
+        self.assertTrue(cache.get("a")[0])
+        time.sleep(0.1)
+        self.assertFalse(cache.get("a")[0])
+        cache.set("big", list(range(1000)))
+        self.assertEqual(0, len(cache))
+
+    def test_04_cache_tags(self):
+        cache = QueryCache()
+        cache.set("a", 1, tags=["salaries"])
+        cache.set("b", 2, tags=["salaries", "employees"])
+        cache.set("c", 3, tags=["employees"])
+        cache.invalidate_tags("salaries")
+        self.assertEqual(1, len(cache))
+        self.assertTrue(cache.get("c")[0])
+
+    def test_05_backend_reads_are_cached_and_writes_invalidate(self):
+        db = FakeBackend(QueryCache())
+        query = "SELECT * FROM salaries WHERE emp_no = %s"
+        self.assertEqual(1, db.execute(query, (10001,)))
+        self.assertEqual(1, db.execute(query, (10001,)))
+        self.assertEqual(2, db.execute(query, (10002,)))
+        self.assertEqual(3, db.execute(query, (10001,), use_cache=False))
+        db.execute("UPDATE salaries SET salary = 1")
+        self.assertEqual(5, db.execute(query, (10001,)))
+        self.assertEqual(1, db.cache.hits)
+        self.assertEqual(3, db.cache.misses)
+
+    def test_06_backend_clears_cache_on_unknown_writes(self):
+        db = FakeBackend(QueryCache())
+        db.execute("SELECT * FROM salaries")
+        db.execute("SET NAMES utf8mb4")
+        self.assertEqual(1, len(db.cache))
+        db.execute("CALL archive_salaries()")
+        self.assertEqual(0, len(db.cache))
+
+    def test_07_cache_skips_results_read_before_a_write(self):
+        cache = QueryCache()
+        generation = cache.generation(["salaries"])
+        # a write commits while the read is running
+        cache.invalidate_tags("salaries")
+        cache.set("a", 1, tags=["salaries"], generation=generation)
+        generation = cache.generation(["salaries"])
+        cache.clear()
+        cache.set("a", 1, tags=["salaries"], generation=generation)
+        self.assertEqual(0, len(cache))
+        cache.set("a", 1, tags=["salaries"], generation=cache.generation(["salaries"]))
+        self.assertEqual(1, len(cache))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import csv
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from rapyd_db.export import _check_export_format, _export, pyarrow
+from rapyd_db.results import _as_records
+
+
+DESCRIPTION = (("emp_no",), ("COUNT(*)",))
+
+
+def _chunks(count, chunk_size):
+    rows = [(emp_no, emp_no % 7) for emp_no in range(count)]
+    chunks = [rows[i : i + chunk_size] for i in range(0, count, chunk_size)]
+    return _as_records(chunks, DESCRIPTION, chunked=True)
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_00_export_csv(self):
+        path = os.path.join(self._dir, "salaries.csv")
+        stats = _export(_chunks(250, 100), path)
+        self.assertEqual(250, stats["rows"])
+        self.assertEqual(os.path.getsize(path), stats["bytes"])
+        with io.open(path, newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(["emp_no", "COUNT(*)"], rows[0])
+        self.assertEqual(["249", "4"], rows[-1])
+        self.assertEqual(251, len(rows))
+
+    def test_01_export_csv_compressed(self):
+        path = os.path.join(self._dir, "salaries.csv.gz")
+        _export(_chunks(250, 100), path, compression="gzip", header=False, delimiter="\t")
+        with gzip.open(path, "rt") as f:
+            lines = f.read().splitlines()
+        self.assertEqual(250, len(lines))
+        self.assertEqual("0\t0", lines[0])
+
+    def test_02_export_checks_format(self):
+        self.assertRaises(ValueError, _check_export_format, "xlsx", None)
+        self.assertRaises(ValueError, _check_export_format, "csv", "zip")
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_03_export_arrow_and_parquet(self):
+        import pyarrow.parquet
+
+        path = os.path.join(self._dir, "salaries.arrow")
+        _export(_chunks(250, 100), path, "arrow")
+        table = pyarrow.ipc.open_file(path).read_all()
+        self.assertEqual(250, table.num_rows)
+        self.assertEqual(["emp_no", "COUNT(*)"], table.column_names)
+
+        path = os.path.join(self._dir, "salaries.parquet")
+        _export(_chunks(250, 100), path, "parquet", compression="zstd")
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(list(range(250)), table.column("emp_no").to_pylist())
+
+    def test_04_export_csv_without_rows(self):
+        path = os.path.join(self._dir, "salaries.csv")
+        stats = _export(iter(()), path, columns=["emp_no", "COUNT(*)"])
+        self.assertEqual(0, stats["rows"])
+        with io.open(path, newline="") as f:
+            self.assertEqual([["emp_no", "COUNT(*)"]], list(csv.reader(f)))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_05_export_arrow_and_parquet_without_rows(self):
+        import pyarrow.parquet
+
+        columns = []
+
+        def chunks():
+            # a backend learns the columns once the query ran
+            columns[:] = ["emp_no", "COUNT(*)"]
+            return iter(())
+
+        path = os.path.join(self._dir, "salaries.arrow")
+        _export(chunks(), path, "arrow", columns=columns)
+        table = pyarrow.ipc.open_file(path).read_all()
+        self.assertEqual(["emp_no", "COUNT(*)"], table.column_names)
+
+        path = os.path.join(self._dir, "salaries.parquet")
+        _export(chunks(), path, "parquet", columns=columns)
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual((0, 2), (table.num_rows, table.num_columns))
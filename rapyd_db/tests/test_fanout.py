@@ -0,0 +1,103 @@
+import time
+import unittest
+
+from rapyd_db.exceptions import FanOutError, ShardTimeout
+from rapyd_db.fanout import FanOut
+
+
+class FakeShard(object):
+    def __init__(self, rows, delay=0, error=None):
+        self.rows = rows
+        self.delay = delay
+        self.error = error
+        self.closed_streams = 0
+
+    def execute(self, query, params=None, stream=False):
+        if stream:
+            return self._stream()
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return list(self.rows)
+
+    def _stream(self):
+        try:
+            for row in self.rows:
+                time.sleep(self.delay)
+                yield row
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.closed_streams += 1
+
+
+class TestFanOut(unittest.TestCase):
+    def test_00_fanout_execute_runs_concurrently(self):
+        shards = [FakeShard([i], delay=0.1) for i in range(5)]
+        start = time.time()
+        with FanOut(shards) as fanout:
+            results = fanout.execute("SELECT 1")
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual([0, 1, 2, 3, 4], list(results.keys()))
+        self.assertEqual([[0], [1], [2], [3], [4]], list(results.values()))
+
+    def test_01_fanout_errors(self):
+        shards = dict(a=FakeShard([1]), b=FakeShard([2], error=RuntimeError("down")))
+        with FanOut(shards) as fanout:
+            with self.assertRaises(FanOutError) as context:
+                fanout.execute("SELECT 1")
+        self.assertEqual(["b"], list(context.exception.errors))
+        self.assertEqual([1], context.exception.results["a"])
+
+        with FanOut(shards, on_error="skip") as fanout:
+            results = fanout.execute("SELECT 1")
+        self.assertEqual(["a"], list(results))
+        self.assertIsInstance(results.errors["b"], RuntimeError)
+
+    def test_02_fanout_timeout(self):
+        shards = dict(fast=FakeShard([1]), slow=FakeShard([2], delay=1))
+        with FanOut(shards, timeout=0.1, on_error="skip") as fanout:
+            start = time.time()
+            results = fanout.execute("SELECT 1")
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(["fast"], list(results))
+        self.assertIsInstance(results.errors["slow"], ShardTimeout)
+
+    def test_03_fanout_stream(self):
+        shards = [FakeShard(range(0, 100, 2)), FakeShard(range(1, 100, 2))]
+        with FanOut(shards) as fanout:
+            rows = list(fanout.stream("SELECT 1", queue_size=3))
+            self.assertEqual(list(range(100)), sorted(rows))
+
+            ordered = list(fanout.stream("SELECT 1", sort_key=lambda row: row))
+            self.assertEqual(list(range(100)), ordered)
+
+            tagged = list(
+                fanout.stream("SELECT 1", with_shard=True, sort_key=lambda row: row)
+            )
+            self.assertEqual((0, 0), tagged[0])
+            self.assertEqual((1, 1), tagged[1])
+
+    def test_04_fanout_stream_closed_early(self):
+        shards = [FakeShard(range(1000)), FakeShard(range(1000))]
+        with FanOut(shards) as fanout:
+            stream = fanout.stream("SELECT 1", queue_size=2)
+            next(stream)
+            stream.close()
+        time.sleep(0.5)
+        self.assertEqual([1, 1], [shard.closed_streams for shard in shards])
+
+    def test_05_fanout_stream_errors(self):
+        shards = dict(
+            a=FakeShard([dict(id=1)]), b=FakeShard([dict(id=2)], error=RuntimeError())
+        )
+        with FanOut(shards) as fanout:
+            with self.assertRaises(FanOutError):
+                list(fanout.stream("SELECT 1", sort_key="id"))
+        with FanOut(shards, on_error="skip") as fanout:
+            rows = list(fanout.stream("SELECT 1", sort_key="id"))
+        self.assertEqual([dict(id=1), dict(id=2)], rows)
+
+    def test_06_fanout_ordered_needs_workers(self):
+        with FanOut([FakeShard([1]), FakeShard([2])], max_workers=1) as fanout:
+            self.assertRaises(ValueError, fanout.stream, "SELECT 1", sort_key=0)
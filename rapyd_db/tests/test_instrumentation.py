@@ -0,0 +1,95 @@
+import unittest
+
+from rapyd_db.backends import AbstractBackend, get_connection
+from rapyd_db.instrumentation import (
+    CONNECT_END,
+    EXECUTE_END,
+    EXECUTE_START,
+    MetricsCollector,
+    _fingerprint,
+)
+
+
+class FakeConnection(object):
+    def close(self):
+        pass
+
+
+class FakeBackend(AbstractBackend):
+    def _connect(self):
+        return FakeConnection()
+
+    def execute(self, query, rows=0, fail=False):
+        with get_connection(self, "log_id") as connection:
+            with self._timer("log_id", query) as timer:
+                if fail:
+                    raise ValueError("failed")
+                timer.rows = rows
+            return timer.elapsed
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_00_fingerprint(self):
+        self.assertEqual(
+            "SELECT * FROM t1 WHERE a = ? AND b IN (?) AND c = ?",
+            _fingerprint(
+                "SELECT *  FROM t1\n WHERE a = 'it''s' AND b IN (1, 2.5, 3) AND c = %s"
+            ),
+        )
+
+    def test_01_listeners(self):
+        db = FakeBackend()
+        events = []
+
+        def listener(event, **info):
+            events.append((event, info))
+
+        db.add_listener(EXECUTE_START, listener)
+        db.add_listener(EXECUTE_END, listener)
+        self.assertRaises(ValueError, db.add_listener, "nope", listener)
+        elapsed = db.execute("SELECT 1", rows=1)
+        self.assertEqual([EXECUTE_START, EXECUTE_END], [event for event, _ in events])
+        end = events[-1][1]
+        self.assertIs(db, end["backend"])
+        self.assertEqual(1, end["rows"])
+        self.assertEqual(elapsed, end["elapsed"])
+        self.assertIsInstance(end["elapsed"], float)
+
+        db.remove_listener(EXECUTE_START, listener)
+        db.remove_listener(EXECUTE_END, listener)
+        db.execute("SELECT 1")
+        self.assertEqual(2, len(events))
+
+    def test_02_failing_listener_does_not_fail_query(self):
+        db = FakeBackend()
+
+        def listener(event, **info):
+            raise RuntimeError("broken listener")
+
+        db.add_listener(CONNECT_END, listener)
+        db.execute("SELECT 1")
+
+    def test_03_metrics_collector(self):
+        db = FakeBackend()
+        collector = MetricsCollector().attach(db)
+        db.execute("SELECT * FROM t WHERE id = 1", rows=1)
+        db.execute("SELECT * FROM t WHERE id = 2", rows=1)
+        self.assertRaises(ValueError, db.execute, "SELECT * FROM t WHERE id = 3", fail=True)
+
+        snapshot = collector.snapshot()
+        stats = snapshot["queries"]["SELECT * FROM t WHERE id = ?"]
+        self.assertEqual(3, stats["execute"]["count"])
+        self.assertEqual(1, stats["errors"])
+        self.assertEqual(2, stats["rows"])
+        self.assertIsNotNone(stats["execute"]["p99"])
+        self.assertEqual(3, snapshot["connect"]["latency"]["count"])
+
+        collector.detach(db)
+        db.execute("SELECT 1")
+        self.assertNotIn("SELECT ?", collector.snapshot()["queries"])
+        collector.reset()
+        self.assertEqual({}, collector.snapshot()["queries"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import datetime
+import decimal
+import unittest
+
+from rapyd_db.keyset import (
+    _decode_checkpoint,
+    _encode_checkpoint,
+    _keyset_condition,
+    _scope,
+    _with_retries,
+)
+
+
+class TestKeyset(unittest.TestCase):
+    def test_00_checkpoint_round_trip(self):
+        scope = _scope("salaries", ("emp_no",))
+        values = [
+            10001,
+            1.5,
+            decimal.Decimal("1.10"),
+            u"näme",
+            b"\x00\xff",
+            datetime.date(2000, 1, 1),
+            datetime.datetime(2000, 1, 1, 12, 30, 15, 250),
+            None,
+        ]
+        checkpoint = _encode_checkpoint(scope, values)
+        self.assertEqual(values, _decode_checkpoint(scope, checkpoint))
+
+    def test_01_checkpoint_is_scoped(self):
+        checkpoint = _encode_checkpoint(_scope("salaries", ("emp_no",)), [1])
+        self.assertRaises(
+            ValueError, _decode_checkpoint, _scope("employees", ("emp_no",)), checkpoint
+        )
+        self.assertRaises(ValueError, _decode_checkpoint, "scope", "not a checkpoint")
+
+    def test_02_keyset_condition(self):
+        self.assertEqual(("(a > %s)", [0]), _keyset_condition(["a"]))
+        self.assertEqual(
+            ("(a > %s OR (a = %s AND b > %s))", [0, 0, 1]), _keyset_condition(["a", "b"])
+        )
+
+    def test_03_with_retries(self):
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            if len(calls) < 3:
+                raise IOError("blip")
+            return "page"
+
+        self.assertEqual("page", _with_retries(fetch, (IOError,), 2, 0))
+        del calls[:]
+        self.assertRaises(IOError, _with_retries, fetch, (IOError,), 1, 0)
+        del calls[:]
+        self.assertRaises(IOError, _with_retries, fetch, (), 5, 0)
+        self.assertEqual(1, len(calls))
@@ -4,6 +4,11 @@ import logging
 import os
 import unittest
 
+import bson
+
+from bson.raw_bson import RawBSONDocument
+from pymongo import UpdateOne
+
 from rapyd_db.backends.mongo import Mongo
 
 
@@ -60,6 +65,129 @@ class TestMongoBackend(unittest.TestCase):
             count += 1
         self.assertEqual(1000, count)
 
+    def test_04_mongo_stream_salaries_in_chunks(self):
+        chunks = self._db.execute(
+            "find",
+            {},
+            database=self._test_db,
+            collection=self._test_collection,
+            stream=True,
+            chunk_size=300,
+        )
+        self.assertEqual([300, 300, 300, 100], [len(chunk) for chunk in chunks])
+
+    def test_04_mongo_stream_salaries_raw(self):
+        rows = list(
+            self._db.execute(
+                "find",
+                {},
+                projection=dict(salary=1),
+                database=self._test_db,
+                collection=self._test_collection,
+                stream=True,
+                raw=True,
+                batch_size=250,
+            )
+        )
+        self.assertEqual(1000, len(rows))
+        self.assertIsInstance(rows[0], RawBSONDocument)
+        self.assertEqual(["_id", "salary"], sorted(rows[0].keys()))
+        batches = self._db.execute(
+            "find",
+            {},
+            database=self._test_db,
+            collection=self._test_collection,
+            stream=True,
+            raw_batches=True,
+            batch_size=250,
+        )
+        self.assertEqual(1000, sum(len(bson.decode_all(batch)) for batch in batches))
+
+    def test_05_mongo_shared_client_is_reused(self):
+        with Mongo(
+            host=self._host,
+            username=self._username,
+            password=self._password,
+            port=self._port,
+            pool_size=4,
+        ) as db:
+            db.execute("server_info")
+            client = db._client
+            db.execute(
+                "find",
+                {"emp_no": "10001"},
+                database=self._test_db,
+                collection=self._test_collection,
+            )
+            self.assertIs(client, db._client)
+        self.assertIsNone(db._client)
+
+    def test_06_mongo_parallel_scan(self):
+        rows = list(
+            self._db.parallel_scan(self._test_db, self._test_collection, partitions=4)
+        )
+        self.assertEqual(1000, len(rows))
+        rows = list(
+            self._db.parallel_scan(
+                self._test_db, self._test_collection, partitions=3, ordered=True
+            )
+        )
+        ids = [row["_id"] for row in rows]
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(1000, len(set(ids)))
+        rows = self._db.parallel_scan(
+            self._test_db,
+            self._test_collection,
+            partitions=2,
+            filter={"_id": {"$in": ids[::100]}},
+        )
+        self.assertEqual(10, len(list(rows)))
+
+    def test_07_mongo_keyset_pages(self):
+        pages = list(
+            self._db.keyset_pages(self._test_db, self._test_collection, page_size=300)
+        )
+        self.assertEqual([300, 300, 300, 100], [len(page.rows) for page in pages])
+        resumed = list(
+            self._db.keyset_pages(
+                self._test_db,
+                self._test_collection,
+                page_size=300,
+                checkpoint=pages[1].checkpoint,
+            )
+        )
+        self.assertEqual([300, 100], [len(page.rows) for page in resumed])
+        self.assertEqual(pages[2].rows, resumed[0].rows)
+
+    def test_08_mongo_bulk_write_stream(self):
+        collection = self._test_collection + "_bulk"
+        result = self._db.bulk_write_stream(
+            self._test_db,
+            collection,
+            (dict(_id=i, value=i) for i in range(2500)),
+            batch_size=1000,
+        )
+        self.assertEqual(2500, result["inserted"])
+        self.assertEqual(3, result["batches"])
+        self.assertEqual([], result["errors"])
+        result = self._db.bulk_write_stream(
+            self._test_db,
+            collection,
+            (
+                UpdateOne(dict(_id=i), {"$set": dict(value=-i)}, upsert=True)
+                for i in range(2000, 3000)
+            ),
+        )
+        self.assertEqual(500, result["modified"])
+        self.assertEqual(500, result["upserted"])
+        result = self._db.bulk_write_stream(
+            self._test_db, collection, [dict(_id=1), dict(_id=5000)], batch_size=1
+        )
+        self.assertEqual(1, result["inserted"])
+        self.assertEqual(1, len(result["errors"]))
+        self.assertEqual(0, result["errors"][0]["offset"])
+        self._db.execute("drop_collection", collection, database=self._test_db)
+
     def test_99_mongo_delete_test_db(self):
         self._db.execute("drop_database", self._test_db)
 
@@ -1,10 +1,16 @@
 import csv
 import getpass
+import gzip
 import itertools
 import logging
 import os
+import shutil
+import tempfile
+import threading
 import unittest
 
+import pymssql
+
 from rapyd_db.utils import _get_uuid
 from rapyd_db.backends import get_connection
 from rapyd_db.backends.mssql import MSSQL
@@ -73,6 +79,161 @@ class TestMSSQLBackend(unittest.TestCase):
             count += 1
         self.assertEqual(1000, count)
 
+    def test_04_mssql_stream_salaries_in_chunks(self):
+        query = "SELECT * FROM [{}].[dbo].[salaries]".format(self._test_db)
+        chunks = list(self._db.execute(query, stream=True, chunk_size=300))
+        self.assertEqual([300, 300, 300, 100], [len(chunk) for chunk in chunks])
+
+    def test_04_mssql_select_salaries_as_columns(self):
+        query = "SELECT * FROM [{}].[dbo].[salaries]".format(self._test_db)
+        rows_affected, last_row_id, columns = self._db.execute(
+            query, result_format="columns", chunk_size=300
+        )
+        self.assertEqual(1000, rows_affected)
+        self.assertEqual(1000, len(columns["salary"]))
+
+    def test_04_mssql_stream_salaries_as_records(self):
+        query = "SELECT * FROM [{}].[dbo].[salaries]".format(self._test_db)
+        rows = list(self._db.execute(query, stream=True, row_type="record"))
+        self.assertEqual(1000, len(rows))
+        self.assertEqual(10001, rows[0].emp_no)
+        _, _, rows = self._db.execute(query, row_type="tuple")
+        self.assertIsInstance(rows[0], tuple)
+
+    def test_05_mssql_pooled_concurrent_connections(self):
+        spids = []
+
+        def worker(db):
+            _, _, rows = db.execute(
+                "SELECT @@SPID AS 'spid' WAITFOR DELAY '00:00:01'"
+            )
+            spids.append(rows[0]["spid"])
+
+        with MSSQL(
+            host=self._host,
+            user=self._user,
+            password=self._password,
+            port=self._port,
+            pool_size=4,
+        ) as db:
+            threads = [threading.Thread(target=worker, args=(db,)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(4, len(set(spids)))
+            self.assertEqual(4, db._pool.idle)
+
+    def test_06_mssql_execute_many_salaries(self):
+        query = (
+            "INSERT INTO [{}].[dbo].[salaries] ([emp_no], [salary], [from_date], [to_date])"
+            " VALUES (%s, %s, %s, %s)".format(self._test_db)
+        )
+        rows = (
+            (900000 + i, 50000, "2000-01-01", "2001-01-01") for i in range(2500)
+        )
+        rows_affected = self._db.execute_many(query, rows, batch_size=1000)
+        self.assertEqual(2500, rows_affected)
+
+    def test_07_mssql_transaction(self):
+        table = "[{}].[dbo].[salaries]".format(self._test_db)
+        count_query = "SELECT COUNT(*) AS total FROM {} WHERE salary = 1".format(table)
+        update_query = "UPDATE {} SET salary = 1 WHERE emp_no = %s".format(table)
+        try:
+            with self._db.transaction() as session:
+                session.execute(update_query, (10001,))
+                _, _, rows = session.execute(count_query)
+                self.assertNotEqual(0, rows[0]["total"])
+                raise ValueError("roll back")
+        except ValueError:
+            pass
+        _, _, rows = self._db.execute(count_query)
+        self.assertEqual(0, rows[0]["total"])
+
+        with self._db.transaction() as session:
+            session.execute(update_query, (10001,))
+            session.execute(update_query, (10002,))
+        _, _, rows = self._db.execute(count_query)
+        self.assertNotEqual(0, rows[0]["total"])
+
+    def test_08_mssql_parallel_scan(self):
+        table = "[{}].[dbo].[salaries]".format(self._test_db)
+        _, _, rows = self._db.execute("SELECT COUNT(*) AS total FROM {}".format(table))
+        total = rows[0]["total"]
+        rows = list(self._db.parallel_scan(table, "emp_no", partitions=4))
+        self.assertEqual(total, len(rows))
+        rows = list(
+            self._db.parallel_scan(
+                table, "emp_no", partitions=3, split="ntile", ordered=True, queue_size=10
+            )
+        )
+        self.assertEqual(total, len(rows))
+        emp_nos = [row["emp_no"] for row in rows]
+        self.assertEqual(sorted(emp_nos), emp_nos)
+
+    def test_09_mssql_keyset_pages(self):
+        table = "[{}].[dbo].[salaries]".format(self._test_db)
+        _, _, rows = self._db.execute("SELECT COUNT(*) AS total FROM {}".format(table))
+        total = rows[0]["total"]
+        pages = list(
+            self._db.keyset_pages(table, ("emp_no", "from_date"), page_size=400)
+        )
+        self.assertEqual(total, sum(len(page.rows) for page in pages))
+        resumed = list(
+            self._db.keyset_pages(
+                table,
+                ("emp_no", "from_date"),
+                page_size=400,
+                checkpoint=pages[0].checkpoint,
+            )
+        )
+        self.assertEqual(pages[1].rows, resumed[0].rows)
+        self.assertEqual(len(pages) - 1, len(resumed))
+
+    def test_10_mssql_export_salaries(self):
+        table = "[{}].[dbo].[salaries]".format(self._test_db)
+        _, _, rows = self._db.execute("SELECT COUNT(*) AS total FROM {}".format(table))
+        path = os.path.join(tempfile.mkdtemp(), "salaries.csv.gz")
+        try:
+            stats = self._db.export(
+                "SELECT * FROM {}".format(table),
+                path,
+                compression="gzip",
+                chunk_size=300,
+            )
+            self.assertEqual(rows[0]["total"], stats["rows"])
+            with gzip.open(path, "rt") as f:
+                self.assertEqual(rows[0]["total"] + 1, len(f.read().splitlines()))
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    @unittest.skipUnless(
+        hasattr(pymssql.Connection, "bulk_copy"), "pymssql 2.2.0 or newer is required"
+    )
+    def test_11_mssql_bulk_load_salaries(self):
+        table = "{}.dbo.salaries".format(self._test_db)
+        rows = ((800000 + i, 50000, "2000-01-01", "2001-01-01") for i in range(5000))
+        rows_loaded = self._db.bulk_load(
+            table, rows, ("emp_no", "salary", "from_date", "to_date"), batch_size=2000
+        )
+        self.assertEqual(5000, rows_loaded)
+        _, _, rows = self._db.execute(
+            "SELECT COUNT(*) AS total FROM {} WHERE emp_no BETWEEN %s AND %s".format(table),
+            (800000, 899999),
+        )
+        self.assertEqual(5000, rows[0]["total"])
+
+    def test_12_mssql_pools_reserve_connections_together(self):
+        limit = pymssql.get_max_connections()
+        first = MSSQL(host=self._host, pool_size=limit, max_overflow=1)
+        second = MSSQL(host=self._host, pool_size=limit)
+        self.assertEqual(3 * limit + 1, pymssql.get_max_connections())
+        first.close()
+        first.close()
+        self.assertEqual(2 * limit, pymssql.get_max_connections())
+        second.close()
+        self.assertEqual(limit, pymssql.get_max_connections())
+
     def test_99_mssql_delete_test_db(self):
         rows_affected, last_row_id, rows = self._db.execute(
             "DROP DATABASE [{}]".format(self._test_db)
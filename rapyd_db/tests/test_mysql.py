@@ -1,12 +1,19 @@
 import csv
 import getpass
+import gzip
 import logging
 import os
+import shutil
+import tempfile
+import time
 import unittest
 
+from concurrent.futures import ThreadPoolExecutor
+
 from rapyd_db.utils import _get_uuid
 from rapyd_db.backends import get_connection
-from rapyd_db.backends.mysql import MySQL
+from rapyd_db.backends.mysql import MySQL, _load_data_lines
+from rapyd_db.exceptions import QueryTimeout
 
 
 logging.basicConfig(level=os.environ.get("RAPYD_DB_LOGLEVEL") or "WARNING")
@@ -74,6 +81,211 @@ class TestMySQLBackend(unittest.TestCase):
             count += 1
         self.assertEqual(1000, count)
 
+    def test_04_mysql_stream_salaries_in_chunks(self):
+        query = "SELECT * FROM {}.`salaries`".format(self._test_db)
+        chunks = list(self._db.execute(query, stream=True, chunk_size=300))
+        self.assertEqual([300, 300, 300, 100], [len(chunk) for chunk in chunks])
+
+    def test_04_mysql_select_salaries_as_columns(self):
+        query = "SELECT * FROM {}.`salaries`".format(self._test_db)
+        rows_affected, last_row_id, columns = self._db.execute(
+            query, result_format="columns", chunk_size=300
+        )
+        self.assertEqual(1000, rows_affected)
+        self.assertEqual(1000, len(columns["salary"]))
+
+    def test_04_mysql_stream_salaries_as_records(self):
+        query = "SELECT * FROM {}.`salaries`".format(self._test_db)
+        rows = list(self._db.execute(query, stream=True, row_type="record"))
+        self.assertEqual(1000, len(rows))
+        self.assertEqual(10001, rows[0].emp_no)
+        _, _, rows = self._db.execute(query, row_type="tuple")
+        self.assertIsInstance(rows[0], tuple)
+        rows_affected, _, rows = self._db.execute(
+            "UPDATE {}.`salaries` SET salary = salary WHERE emp_no = -1".format(
+                self._test_db
+            ),
+            row_type="record",
+        )
+        self.assertEqual((0, []), (rows_affected, list(rows)))
+
+    def test_05_mysql_pooled_connections_are_reused(self):
+        with MySQL(
+            host=self._host,
+            user=self._user,
+            password=self._password,
+            port=self._port,
+            pool_size=2,
+        ) as db:
+            _, _, first = db.execute("SELECT CONNECTION_ID() AS id")
+            _, _, second = db.execute("SELECT CONNECTION_ID() AS id")
+            self.assertEqual(first[0]["id"], second[0]["id"])
+
+    def test_06_mysql_execute_many_salaries(self):
+        query = (
+            "INSERT INTO `{}`.`salaries` (`emp_no`, `salary`, `from_date`, `to_date`)"
+            " VALUES (%s, %s, %s, %s)".format(self._test_db)
+        )
+        rows = (
+            (900000 + i, 50000, "2000-01-01", "2001-01-01") for i in range(2500)
+        )
+        rows_affected = self._db.execute_many(query, rows, batch_size=1000)
+        self.assertEqual(2500, rows_affected)
+
+    def test_07_mysql_transaction(self):
+        table = "`{}`.`salaries`".format(self._test_db)
+        count_query = "SELECT COUNT(*) AS total FROM {} WHERE salary = 1".format(table)
+        update_query = "UPDATE {} SET salary = 1 WHERE emp_no = %s".format(table)
+        try:
+            with self._db.transaction() as session:
+                session.execute(update_query, (10001,))
+                _, _, rows = session.execute(count_query)
+                self.assertNotEqual(0, rows[0]["total"])
+                raise ValueError("roll back")
+        except ValueError:
+            pass
+        _, _, rows = self._db.execute(count_query)
+        self.assertEqual(0, rows[0]["total"])
+
+        with self._db.transaction() as session:
+            session.execute(update_query, (10001,))
+            session.execute(update_query, (10002,))
+        _, _, rows = self._db.execute(count_query)
+        self.assertNotEqual(0, rows[0]["total"])
+
+    def test_08_mysql_parallel_scan(self):
+        table = "`{}`.`salaries`".format(self._test_db)
+        _, _, rows = self._db.execute("SELECT COUNT(*) AS total FROM {}".format(table))
+        total = rows[0]["total"]
+        rows = list(self._db.parallel_scan(table, "emp_no", partitions=4))
+        self.assertEqual(total, len(rows))
+        rows = list(
+            self._db.parallel_scan(
+                table, "emp_no", partitions=3, split="ntile", ordered=True, queue_size=10
+            )
+        )
+        self.assertEqual(total, len(rows))
+        emp_nos = [row["emp_no"] for row in rows]
+        self.assertEqual(sorted(emp_nos), emp_nos)
+
+    def test_09_mysql_keyset_pages(self):
+        table = "`{}`.`salaries`".format(self._test_db)
+        _, _, rows = self._db.execute("SELECT COUNT(*) AS total FROM {}".format(table))
+        total = rows[0]["total"]
+        pages = list(
+            self._db.keyset_pages(table, ("emp_no", "from_date"), page_size=400)
+        )
+        self.assertEqual(total, sum(len(page.rows) for page in pages))
+        resumed = list(
+            self._db.keyset_pages(
+                table,
+                ("emp_no", "from_date"),
+                page_size=400,
+                checkpoint=pages[0].checkpoint,
+            )
+        )
+        self.assertEqual(pages[1].rows, resumed[0].rows)
+        self.assertEqual(len(pages) - 1, len(resumed))
+
+    def test_10_mysql_export_salaries(self):
+        table = "`{}`.`salaries`".format(self._test_db)
+        _, _, rows = self._db.execute("SELECT COUNT(*) AS total FROM {}".format(table))
+        path = os.path.join(tempfile.mkdtemp(), "salaries.csv.gz")
+        try:
+            stats = self._db.export(
+                "SELECT * FROM {}".format(table),
+                path,
+                compression="gzip",
+                chunk_size=300,
+            )
+            self.assertEqual(rows[0]["total"], stats["rows"])
+            with gzip.open(path, "rt") as f:
+                self.assertEqual(rows[0]["total"] + 1, len(f.read().splitlines()))
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_11_mysql_bulk_load_salaries(self):
+        table = "`{}`.`salaries`".format(self._test_db)
+        rows = ((800000 + i, 50000, "2000-01-01", "2001-01-01") for i in range(5000))
+        rows_loaded = self._db.bulk_load(
+            table, rows, ("emp_no", "salary", "from_date", "to_date"), batch_size=2000
+        )
+        self.assertEqual(5000, rows_loaded)
+        _, _, rows = self._db.execute(
+            "SELECT COUNT(*) AS total FROM {} WHERE emp_no BETWEEN %s AND %s".format(table),
+            (800000, 899999),
+        )
+        self.assertEqual(5000, rows[0]["total"])
+        self.assertEqual(
+            b"1\t\\N\ta\\tb\\\\\n", _load_data_lines([(1, None, "a\tb\\")])
+        )
+
+    def test_12_mysql_shared_instance_across_threads(self):
+        db = MySQL(
+            host=self._host,
+            user=self._user,
+            password=self._password,
+            port=self._port,
+            pool_size=8,
+        )
+        query = "SELECT * FROM `{}`.`salaries` LIMIT 100".format(self._test_db)
+
+        def read(index):
+            # streaming and buffered queries interleave on the same instance
+            if index % 2:
+                return len(list(db.execute(query, stream=True)))
+            return len(db.execute(query)[2])
+
+        with db, ThreadPoolExecutor(max_workers=16) as executor:
+            counts = list(executor.map(read, range(64)))
+        self.assertEqual([100] * 64, counts)
+        self.assertNotIn("cursorclass", db._connection_params)
+
+    def test_13_mysql_stream_timeout_kills_query(self):
+        start = time.time()
+        with self.assertRaises(QueryTimeout):
+            list(self._db.execute("SELECT SLEEP(10)", stream=True, timeout=0.5))
+        self.assertLess(time.time() - start, 5)
+        with self._db.execute(
+            "SELECT * FROM `{}`.`salaries`".format(self._test_db), stream=True
+        ) as rows:
+            self.assertIn("salary", next(rows))
+        self.assertEqual([], list(rows))
+
+    def test_14_mysql_coalesce_identical_reads(self):
+        db = MySQL(
+            host=self._host,
+            user=self._user,
+            password=self._password,
+            port=self._port,
+            pool_size=16,
+            coalesce=True,
+        )
+        with db, ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(
+                executor.map(lambda _: db.execute("SELECT SLEEP(1) AS s"), range(16))
+            )
+        self.assertEqual([[{"s": 0}]] * 16, [rows for _, _, rows in results])
+        self.assertLess(db.single_flight.stats["executions"], 16)
+
+    def test_15_mysql_pooled_connections_are_reset(self):
+        with MySQL(
+            host=self._host,
+            user=self._user,
+            password=self._password,
+            port=self._port,
+            database=self._test_db,
+            pool_size=1,
+        ) as db:
+            db.execute("USE mysql")
+            db.execute("SET SESSION time_zone = '+05:00'")
+            _, _, rows = db.execute(
+                "SELECT DATABASE() AS db,"
+                " @@session.time_zone = @@global.time_zone AS default_time_zone"
+            )
+            self.assertEqual(self._test_db, rows[0]["db"])
+            self.assertEqual(1, rows[0]["default_time_zone"])
+
     def test_99_mysql_delete_test_db(self):
         rows_affected, last_row_id, rows = self._db.execute(
             "DROP DATABASE IF EXISTS `{}`".format(self._test_db)
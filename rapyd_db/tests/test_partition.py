@@ -0,0 +1,75 @@
+import datetime
+import time
+import unittest
+
+from functools import partial
+
+from rapyd_db.exceptions import ScanTimeout
+from rapyd_db.partition import _range_starts, _read_partitions
+
+
+def _fail(rows, error):
+    for row in range(rows):
+        yield row
+    raise error
+
+
+def _rows(start, stop, delay=0):
+    for row in range(start, stop):
+        time.sleep(delay)
+        yield row
+
+
+class TestPartition(unittest.TestCase):
+    def test_00_range_starts(self):
+        self.assertEqual([0, 25, 50, 75], _range_starts(0, 100, 4))
+        self.assertEqual([1, 2], _range_starts(1, 3, 4))
+        self.assertEqual([5], _range_starts(5, 5, 4))
+        self.assertEqual([0.0, 0.5], _range_starts(0.0, 1.0, 2))
+        self.assertEqual(
+            [datetime.date(2000, 1, 1), datetime.date(2000, 1, 6)],
+            _range_starts(datetime.date(2000, 1, 1), datetime.date(2000, 1, 11), 2),
+        )
+        self.assertRaises(TypeError, _range_starts, "a", "z", 2)
+
+    def test_01_read_partitions(self):
+        streams = [(i, partial(_rows, i * 100, (i + 1) * 100)) for i in range(4)]
+        rows = list(_read_partitions(streams, queue_size=5))
+        self.assertEqual(list(range(400)), sorted(rows))
+        rows = list(_read_partitions(streams, ordered=True, queue_size=5))
+        self.assertEqual(list(range(400)), rows)
+        self.assertEqual([], list(_read_partitions([])))
+
+    def test_02_read_partitions_concurrently(self):
+        streams = [(i, partial(_rows, 0, 10, delay=0.02)) for i in range(4)]
+        start = time.time()
+        self.assertEqual(40, len(list(_read_partitions(streams))))
+        self.assertLess(time.time() - start, 0.6)
+
+    def test_03_ordered_read_opens_ranges_lazily(self):
+        opened = []
+
+        def open_range(i):
+            opened.append(i)
+            return _rows(i * 10, (i + 1) * 10)
+
+        streams = [(i, partial(open_range, i)) for i in range(4)]
+        rows = _read_partitions(streams, ordered=True, queue_size=20)
+        self.assertEqual(0, next(rows))
+        time.sleep(0.1)
+        # the range being read and the next one
+        self.assertEqual([0, 1], sorted(opened))
+        self.assertEqual(list(range(1, 40)), list(rows))
+
+    def test_04_read_partitions_raises_range_errors(self):
+        for ordered in (False, True):
+            streams = [
+                (0, partial(_rows, 0, 10)),
+                (1, partial(_fail, 5, KeyError("range"))),
+            ]
+            with self.assertRaises(KeyError):
+                list(_read_partitions(streams, ordered=ordered))
+            streams = [(0, partial(_rows, 0, 10)), (1, partial(_rows, 0, 10, delay=1))]
+            with self.assertRaises(ScanTimeout) as context:
+                list(_read_partitions(streams, ordered=ordered, timeout=0.1))
+            self.assertIn("range(s) 1", str(context.exception))
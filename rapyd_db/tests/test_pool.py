@@ -0,0 +1,93 @@
+import threading
+import unittest
+
+from rapyd_db.exceptions import PoolTimeout
+from rapyd_db.pool import ConnectionPool
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = False
+        self.resets = 0
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self._opened = []
+
+    def _creator(self):
+        connection = FakeConnection()
+        self._opened.append(connection)
+        return connection
+
+    def test_00_pool_reuses_connections(self):
+        pool = ConnectionPool(self._creator, pool_size=2)
+        first = pool.acquire()
+        pool.release(first)
+        second = pool.acquire()
+        self.assertIs(first, second)
+        self.assertEqual(1, len(self._opened))
+
+    def test_01_pool_overflow_connections_are_closed(self):
+        pool = ConnectionPool(self._creator, pool_size=1, max_overflow=1, timeout=0)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertRaises(PoolTimeout, pool.acquire)
+        pool.release(first)
+        pool.release(second)
+        self.assertTrue(second.closed)
+        self.assertEqual(1, pool.size)
+        self.assertEqual(1, pool.idle)
+
+    def test_02_pool_waits_for_released_connection(self):
+        pool = ConnectionPool(self._creator, pool_size=1, timeout=5)
+        first = pool.acquire()
+        timer = threading.Timer(0.1, pool.release, (first,))
+        timer.start()
+        self.assertIs(first, pool.acquire())
+        timer.join()
+
+    def test_03_pool_discards_stale_and_old_connections(self):
+        pool = ConnectionPool(self._creator, pool_size=1, ping=lambda c: False)
+        first = pool.acquire()
+        pool.release(first)
+        second = pool.acquire()
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+
+        pool = ConnectionPool(self._creator, pool_size=1, recycle=0)
+        first = pool.acquire()
+        pool.release(first)
+        self.assertIsNot(first, pool.acquire())
+
+    def test_04_pool_resets_and_discards_on_failed_reset(self):
+        def reset(connection):
+            connection.resets += 1
+            if connection.resets > 1:
+                raise ValueError("broken")
+
+        pool = ConnectionPool(self._creator, pool_size=1, reset=reset)
+        first = pool.acquire()
+        pool.release(first)
+        self.assertEqual(1, first.resets)
+        pool.release(pool.acquire())
+        self.assertTrue(first.closed)
+        self.assertEqual(0, pool.size)
+
+    def test_05_pool_dispose_closes_idle_connections(self):
+        pool = ConnectionPool(self._creator, pool_size=2)
+        first = pool.acquire()
+        second = pool.acquire()
+        pool.release(first)
+        pool.dispose()
+        self.assertTrue(first.closed)
+        pool.release(second)
+        self.assertTrue(second.closed)
+        self.assertEqual(0, pool.size)
+
+
+if __name__ == "__main__":
+    unittest.main()
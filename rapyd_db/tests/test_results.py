@@ -0,0 +1,93 @@
+import array
+import unittest
+
+from rapyd_db import results
+
+
+class FakeCursor(object):
+    def __init__(self, description, rows):
+        self.description = description
+        self._rows = list(rows)
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+
+class TestColumnarResults(unittest.TestCase):
+    def setUp(self):
+        self._description = (("emp_no",), ("salary",), ("name",))
+        self._rows = [(i, i * 1.5, "emp{}".format(i)) for i in range(25)]
+
+    def test_00_check_result_format(self):
+        results._check_result_format("rows", True)
+        results._check_result_format("columns", False)
+        self.assertRaises(ValueError, results._check_result_format, "columns", True)
+        self.assertRaises(ValueError, results._check_result_format, "arrow", False)
+
+    @unittest.skipIf(results.numpy is None, "NumPy is not installed")
+    def test_01_fetch_columns_numpy(self):
+        cursor = FakeCursor(self._description, self._rows)
+        row_count, columns = results._fetch_columns(cursor, chunk_size=10)
+        self.assertEqual(25, row_count)
+        self.assertEqual("i", columns["emp_no"].dtype.kind)
+        self.assertEqual("f", columns["salary"].dtype.kind)
+        self.assertEqual(list(range(25)), columns["emp_no"].tolist())
+        self.assertEqual("emp24", columns["name"][-1])
+
+    @unittest.skipIf(results.numpy is None, "NumPy is not installed")
+    def test_02_fetch_columns_numpy_objects(self):
+        description = (("data",), ("notes",), ("emp_no",))
+        rows = [(b"\x01\x00", "x" * (i * 1000), i) for i in range(15)]
+        rows.append((b"", "", None))
+        cursor = FakeCursor(description, rows)
+        _, columns = results._fetch_columns(cursor, chunk_size=10)
+        # fixed width types would strip the NUL and pad every note to the longest
+        self.assertEqual("O", columns["data"].dtype.kind)
+        self.assertEqual(b"\x01\x00", columns["data"][0])
+        self.assertEqual("O", columns["notes"].dtype.kind)
+        self.assertEqual(14000, len(columns["notes"][14]))
+        # integers in the first chunk, a NULL in the second
+        self.assertEqual(list(range(15)) + [None], columns["emp_no"].tolist())
+
+    def test_03_fetch_columns_without_numpy(self):
+        numpy, results.numpy = results.numpy, None
+        try:
+            rows = self._rows + [(None, 1, "last")]
+            cursor = FakeCursor(self._description, rows)
+            row_count, columns = results._fetch_columns(cursor, chunk_size=10)
+        finally:
+            results.numpy = numpy
+        self.assertEqual(26, row_count)
+        self.assertIsInstance(columns["salary"], array.array)
+        self.assertEqual("d", columns["salary"].typecode)
+        # the trailing NULL does not fit an integer array
+        self.assertEqual(list(range(25)) + [None], columns["emp_no"])
+        self.assertEqual("last", columns["name"][-1])
+
+    def test_04_fetch_columns_empty_result(self):
+        cursor = FakeCursor(self._description, [])
+        row_count, columns = results._fetch_columns(cursor)
+        self.assertEqual(0, row_count)
+        self.assertEqual(sorted(["emp_no", "salary", "name"]), sorted(columns))
+
+    def test_05_as_records(self):
+        self.assertRaises(ValueError, results._check_row_type, "object")
+        description = (("emp_no",), ("COUNT(*)",))
+        records = list(results._as_records([(1, 2), (3, 4)], description))
+        self.assertEqual(1, records[0].emp_no)
+        self.assertEqual(4, records[1][1])
+        self.assertIs(type(records[0]), type(records[1]))
+        self.assertEqual(("emp_no", "COUNT(*)"), type(records[0])._columns)
+
+        chunks = list(
+            results._as_records([[(1, 2)], [(3, 4)]], description, chunked=True)
+        )
+        self.assertEqual(3, chunks[1][0].emp_no)
+        # e.g. an INSERT, which has no result set
+        self.assertEqual([], list(results._as_records((), None)))
+        self.assertEqual([], list(results._as_records(iter(()), None, chunked=True)))
+
+
+if __name__ == "__main__":
+    unittest.main()
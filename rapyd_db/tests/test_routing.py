@@ -0,0 +1,81 @@
+import unittest
+
+from rapyd_db.backends import AbstractSQLBackend
+from rapyd_db.exceptions import NoReplicaAvailable
+from rapyd_db.routing import Router
+
+
+class FakeBackend(AbstractSQLBackend):
+    def __init__(self, name, lag=0):
+        self.name = name
+        self.lag = lag
+        self.queries = []
+        self.lag_checks = 0
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def execute(self, query, params=None, stream=False):
+        self.queries.append(query)
+        if stream:
+            return (row for row in [self.name])
+        return 0, None, [self.name]
+
+    def _replica_lag(self):
+        self.lag_checks += 1
+        return self.lag
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self):
+        self.primary = FakeBackend("primary")
+        self.replicas = [FakeBackend("replica0"), FakeBackend("replica1")]
+
+    def test_00_router_splits_reads_and_writes(self):
+        router = Router(self.primary, self.replicas)
+        self.assertEqual("replica1", router.execute("SELECT 1")[2][0])
+        _, _, rows = router.execute("WITH a AS (SELECT 1) SELECT * FROM a")
+        self.assertEqual("replica0", rows[0])
+        for query in (
+            "UPDATE t SET a = 1",
+            "SELECT * FROM t FOR UPDATE",
+            "SELECT * INTO OUTFILE '/tmp/t' FROM t",
+        ):
+            self.assertEqual("primary", router.execute(query)[2][0])
+        self.assertEqual(3, len(self.primary.queries))
+
+    def test_01_router_balances_outstanding_streams(self):
+        router = Router(self.primary, self.replicas)
+        first = router.execute("SELECT 1", stream=True)
+        # the other replica has nothing outstanding
+        self.assertEqual(["replica0"], list(router.execute("SELECT 1", stream=True)))
+        self.assertEqual(["replica0"], list(router.execute("SELECT 1", stream=True)))
+        first.close()
+        with router.execute("SELECT 1", stream=True) as rows:
+            with router.execute("SELECT 1", stream=True) as other_rows:
+                names = set([next(rows), next(other_rows)])
+        self.assertEqual(set(["replica0", "replica1"]), names)
+        # a write returning rows, e.g. with RETURNING or OUTPUT, still goes to the primary
+        rows = router.execute("DELETE FROM t RETURNING id", stream=True)
+        self.assertEqual(["primary"], list(rows))
+
+    def test_02_router_skips_lagging_replicas(self):
+        self.replicas[1].lag = 30
+        router = Router(self.primary, self.replicas, max_lag=10, lag_interval=60)
+        for _ in range(4):
+            self.assertEqual("replica0", router.execute("SELECT 1")[2][0])
+        # measured once per interval
+        self.assertEqual(1, self.replicas[0].lag_checks)
+
+        self.replicas[0].lag = None
+        router = Router(self.primary, self.replicas, max_lag=10)
+        self.assertEqual("primary", router.execute("SELECT 1")[2][0])
+        router = Router(
+            self.primary, self.replicas, max_lag=10, fallback_to_primary=False
+        )
+        with self.assertRaises(NoReplicaAvailable):
+            router.execute("SELECT 1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import threading
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from rapyd_db.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_00_single_flight_shares_concurrent_calls(self):
+        single_flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def query():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return ["row"]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            first = executor.submit(single_flight.do, "key", query)
+            started.wait()
+            others = [executor.submit(single_flight.do, "key", query) for _ in range(7)]
+            results = [first.result()] + [future.result() for future in others]
+        self.assertEqual(1, len(calls))
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(dict(executions=1, shared=7), single_flight.stats)
+
+        # nothing is kept once the call completed
+        self.assertEqual(["row"], single_flight.do("key", query))
+        self.assertEqual(2, len(calls))
+
+    def test_01_single_flight_shares_errors(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+
+        def query():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError("failed")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(single_flight.do, "key", query)
+            started.wait()
+            second = executor.submit(single_flight.do, "key", query)
+            for future in (first, second):
+                with self.assertRaises(ValueError):
+                    future.result()
+        self.assertEqual(dict(executions=1, shared=1), single_flight.stats)
+
+
+if __name__ == "__main__":
+    unittest.main()
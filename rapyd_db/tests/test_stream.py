@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+
+from rapyd_db.exceptions import QueryCancelled, QueryTimeout
+from rapyd_db.stream import Stream, _cancellable
+
+
+class FakeQuery(object):
+    """Yields rows slowly until it is cancelled, like a long running query on a server."""
+
+    def __init__(self, rows, delay=0):
+        self.rows = rows
+        self.delay = delay
+        self.cancelled = threading.Event()
+        self.closed = False
+
+    def open(self, cancel_hook=None):
+        try:
+            with _cancellable(cancel_hook, self.cancelled.set):
+                for row in range(self.rows):
+                    if self.cancelled.wait(self.delay):
+                        raise RuntimeError("Query execution was interrupted")
+                    yield row
+        finally:
+            self.closed = True
+
+
+class TestStream(unittest.TestCase):
+    def test_00_stream_reads_all_rows(self):
+        query = FakeQuery(5)
+        with Stream(query.open) as rows:
+            self.assertEqual([0, 1, 2, 3, 4], list(rows))
+        self.assertFalse(query.cancelled.is_set())
+        self.assertTrue(query.closed)
+
+    def test_01_stream_close_cancels_unread_rows(self):
+        query = FakeQuery(1000)
+        with Stream(query.open) as rows:
+            self.assertEqual(0, next(rows))
+        self.assertTrue(query.cancelled.is_set())
+        self.assertTrue(query.closed)
+        self.assertEqual([], list(rows))
+
+    def test_02_stream_cancel_from_another_thread(self):
+        query = FakeQuery(1000, delay=0.01)
+        rows = Stream(query.open)
+        threading.Timer(0.05, rows.cancel).start()
+        with self.assertRaises(QueryCancelled):
+            list(rows)
+        self.assertTrue(query.closed)
+        self.assertFalse(rows.cancel())
+
+    def test_03_stream_timeout(self):
+        query = FakeQuery(1000, delay=0.01)
+        rows = Stream(query.open, timeout=0.05)
+        start = time.time()
+        with self.assertRaises(QueryTimeout):
+            list(rows)
+        self.assertLess(time.time() - start, 1)
+        self.assertTrue(query.closed)
+
+    def test_04_stream_timeout_releases_abandoned_stream(self):
+        query = FakeQuery(1000)
+        rows = Stream(query.open, timeout=0.05)
+        next(rows)
+        time.sleep(0.2)
+        self.assertTrue(query.closed)
+        with self.assertRaises(QueryTimeout):
+            next(rows)
+
+    def test_05_stream_dropped_unclosed_is_closed(self):
+        query = FakeQuery(1000)
+        for row in Stream(query.open):
+            break
+        self.assertTrue(query.cancelled.is_set())
+        self.assertTrue(query.closed)
+
+    def test_06_stream_ended_is_not_cancelled(self):
+        query = FakeQuery(1)
+        rows = Stream(query.open, timeout=0.05)
+        self.assertEqual([0], list(rows))
+        time.sleep(0.1)
+        # the connection may be in use by another query by now
+        self.assertFalse(rows.cancel())
+        self.assertFalse(query.cancelled.is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import logging
+import unittest
+
+from rapyd_db.utils import _LogValue, _batched
+
+
+class ExplodingValue(object):
+    def __str__(self):
+        raise AssertionError("formatted while logging is disabled")
+
+
+class TestUtils(unittest.TestCase):
+    def test_00_batched(self):
+        batches = list(_batched((i for i in range(7)), 3))
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], batches)
+        self.assertEqual([], list(_batched([], 3)))
+
+    def test_01_log_value_truncates(self):
+        self.assertEqual("abc", str(_LogValue(b"abc")))
+        self.assertEqual(
+            "ab... (2 characters truncated)", str(_LogValue("abcd", max_length=2))
+        )
+
+    def test_02_log_value_is_lazy(self):
+        logger = logging.getLogger("rapyd_db.tests.lazy")
+        logger.setLevel(logging.WARNING)
+        logger.info("%s", _LogValue(ExplodingValue()))
+
+
+if __name__ == "__main__":
+    unittest.main()
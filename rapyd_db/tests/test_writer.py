@@ -0,0 +1,134 @@
+import threading
+import time
+import unittest
+
+from rapyd_db.exceptions import WriterFull
+from rapyd_db.writer import BufferedWriter
+
+
+class FakeBackend(object):
+    def __init__(self, delay=0, error=None):
+        self.delay = delay
+        self.error = error
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def execute_many(self, query, rows, batch_size=1000):
+        self.release.wait()
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        self.batches.append(list(rows))
+        return len(rows)
+
+
+class TestBufferedWriter(unittest.TestCase):
+    def test_00_writer_writes_full_batches_and_flushes_on_close(self):
+        backend = FakeBackend()
+        with BufferedWriter(
+            backend, "INSERT", batch_size=10, flush_interval=60
+        ) as writer:
+            for i in range(25):
+                self.assertTrue(writer.put((i,)))
+            writer.flush()
+            self.assertEqual([10, 10, 5], [len(batch) for batch in backend.batches])
+            writer.put((25,))
+        self.assertEqual(26, sum(len(batch) for batch in backend.batches))
+        self.assertEqual(26, writer.stats["written"])
+        with self.assertRaises(ValueError):
+            writer.put((26,))
+
+    def test_01_writer_flushes_after_interval(self):
+        backend = FakeBackend()
+        with BufferedWriter(
+            backend, "INSERT", batch_size=100, flush_interval=0.05
+        ) as writer:
+            writer.put((1,))
+            writer.put((2,))
+            time.sleep(0.3)
+            self.assertEqual([[(1,), (2,)]], backend.batches)
+
+    def test_02_writer_backpressure(self):
+        backend = FakeBackend()
+        backend.release.clear()
+        writer = BufferedWriter(
+            backend, "INSERT", batch_size=1, capacity=2, on_full="drop"
+        )
+        # the first row is taken by the blocked writer thread, two more fill the queue
+        results = [writer.put((i,)) for i in range(3)]
+        time.sleep(0.1)
+        results += [writer.put((i,)) for i in range(3, 6)]
+        self.assertEqual(3, results.count(False))
+        self.assertEqual(3, writer.stats["dropped"])
+
+        blocking = BufferedWriter(
+            backend, "INSERT", batch_size=1, capacity=1, put_timeout=0.05
+        )
+        with self.assertRaises(WriterFull):
+            for i in range(3):
+                blocking.put((i,))
+        backend.release.set()
+        writer.close()
+        blocking.close()
+
+    def test_03_writer_reports_errors(self):
+        errors = []
+        backend = FakeBackend(error=RuntimeError("server gone"))
+        with BufferedWriter(
+            backend,
+            "INSERT",
+            batch_size=2,
+            on_error=lambda error, rows: errors.append((error, rows)),
+        ) as writer:
+            for i in range(3):
+                writer.put((i,))
+        self.assertEqual([[(0,), (1,)], [(2,)]], [rows for _, rows in errors])
+        self.assertEqual(3, writer.stats["failed"])
+
+    def test_04_writer_close_waits_for_concurrent_puts(self):
+        backend = FakeBackend()
+        writer = BufferedWriter(backend, "INSERT", batch_size=7, capacity=5)
+        queued = []
+
+        def put_until_closed(thread):
+            for i in range(10000):
+                try:
+                    writer.put((thread, i))
+                except ValueError:
+                    return
+                queued.append((thread, i))
+
+        threads = [
+            threading.Thread(target=put_until_closed, args=(i,)) for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        writer.close()
+        for thread in threads:
+            thread.join()
+        # every row a put accepted is written, none after the writer thread stopped
+        written = [row for batch in backend.batches for row in batch]
+        self.assertEqual(sorted(queued), sorted(written))
+        self.assertEqual(0, writer.stats["queued"])
+
+        # a put blocked on a full queue when close starts is still written
+        backend = FakeBackend()
+        backend.release.clear()
+        writer = BufferedWriter(backend, "INSERT", batch_size=1, capacity=1)
+        writer.put((0,))
+        writer.put((1,))
+        blocked = threading.Thread(target=writer.put, args=((2,),))
+        blocked.start()
+        closing = threading.Thread(target=writer.close)
+        closing.start()
+        time.sleep(0.05)
+        backend.release.set()
+        closing.join()
+        blocked.join()
+        self.assertEqual([[(0,)], [(1,)], [(2,)]], backend.batches)
+
+
+if __name__ == "__main__":
+    unittest.main()
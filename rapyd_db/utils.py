@@ -1,3 +1,5 @@
+import itertools
+import time
 import uuid
 
 
@@ -15,3 +17,42 @@ def _assign_if_not_none(obj, param, value):
 def _get_uuid():
     """Returns a unique ID which can be used to track log messages by query."""
     return uuid.uuid4().hex
+
+
+# a monotonic high resolution clock for measuring durations;
+# `time.perf_counter` is not available on python 2
+_monotonic = getattr(time, "perf_counter", time.time)
+
+
+def _batched(iterable, size):
+    """Yields lists of at most `size` items without materializing the whole iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class _LogValue(object):
+    """
+    Wraps a value passed as a logging argument so it is only converted to text,
+    decoded if it is bytes and cut to `max_length` characters when the record is emitted.
+    """
+
+    __slots__ = ("value", "max_length")
+
+    def __init__(self, value, max_length=None):
+        self.value = value
+        self.max_length = max_length
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, bytes):
+            value = value.decode("utf8", "replace")
+        text = value if isinstance(value, str) else str(value)
+        if self.max_length is not None and len(text) > self.max_length:
+            text = "{}... ({} characters truncated)".format(
+                text[: self.max_length], len(text) - self.max_length
+            )
+        return text
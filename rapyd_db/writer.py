@@ -0,0 +1,234 @@
+import atexit
+import logging
+import threading
+
+from six.moves import queue
+
+from .exceptions import WriterFull
+from .utils import _monotonic
+
+
+_logger = logging.getLogger(__name__)
+
+ON_FULL = ("block", "drop", "raise")
+
+# markers put on the queue for the writer thread
+_STOP = object()
+_FLUSH = object()
+
+
+def _check_on_full(on_full):
+    if on_full not in ON_FULL:
+        raise ValueError(
+            "on_full must be one of {}, not {!r}".format(", ".join(ON_FULL), on_full)
+        )
+
+
+class BufferedWriter(object):
+    """
+    Queues rows with `put()` and writes them in batches from a background thread, so
+    callers do not wait for a connection and a round trip per row. A batch is written once
+    `batch_size` rows are queued or its first row has waited `flush_interval` seconds.
+    Rows still queued are written by `close()`, which is also called at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        backend,
+        query=None,
+        database=None,
+        collection=None,
+        batch_size=1000,
+        flush_interval=1,
+        capacity=10000,
+        on_full="block",
+        put_timeout=None,
+        on_error=None,
+    ):
+        """
+        :param backend: Backend instance the rows are written with.
+        :param str query:
+            For SQL backends, the statement run with `execute_many()` for every batch of
+            parameter tuples, e.g. `INSERT INTO events (ts, name) VALUES (%s, %s)`.
+        :param str database: For mongoDB, the database to insert documents into.
+        :param str collection: For mongoDB, the collection to insert documents into.
+        :param int batch_size: Most rows written at a time. Defaults to 1000.
+        :param float flush_interval:
+            Most seconds a row waits for its batch to fill up before it is written.
+            Defaults to 1.
+        :param int capacity: Most rows queued and not yet written. Defaults to 10000.
+        :param str on_full:
+            What `put()` does when `capacity` rows are queued: `block` (default) waits for
+            room, up to `put_timeout` seconds before raising `WriterFull`; `drop` discards
+            the row and returns `False`; `raise` raises `WriterFull`.
+        :param float put_timeout: See `on_full`. `None` (default) waits forever.
+        :param callable on_error:
+            Called as `on_error(error, rows)` in the writer thread when writing a batch
+            fails. The rows are not written again. By default the error is logged.
+        """
+        if query is None and (database is None or collection is None):
+            raise ValueError("Either query or database and collection are required")
+        _check_on_full(on_full)
+        self._backend = backend
+        self._query = query
+        self._database = database
+        self._collection = collection
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._on_full = on_full
+        self._put_timeout = put_timeout
+        self._on_error = on_error
+        self._queue = queue.Queue(maxsize=capacity)
+        self._lock = threading.Lock()
+        # notified when the last put() or flush() in progress is done
+        self._idle = threading.Condition(self._lock)
+        self._putting = 0
+        self._closed = False
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run, name="rapyd_db-writer")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def stats(self):
+        """
+        Returns a dictionary of the rows `queued`, `written`, `failed` and `dropped` and
+        the `batches` written.
+        """
+        with self._lock:
+            return dict(
+                queued=self._queue.qsize(),
+                written=self.written,
+                failed=self.failed,
+                dropped=self.dropped,
+                batches=self.batches,
+            )
+
+    def put(self, row):
+        """
+        Queues a row, a tuple of parameters for SQL backends or a document for mongoDB.
+        Returns `True` once queued and `False` if it was dropped because the writer is full.
+        """
+        self._begin_put()
+        try:
+            if self._on_full == "block":
+                self._queue.put(row, timeout=self._put_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            if self._on_full == "drop":
+                with self._lock:
+                    self.dropped += 1
+                return False
+            raise WriterFull("{} row(s) are queued".format(self._queue.maxsize))
+        finally:
+            self._end_put()
+        return True
+
+    def flush(self):
+        """Waits until every row queued before the call has been written."""
+        done = threading.Event()
+        self._begin_put()
+        try:
+            self._queue.put((_FLUSH, done))
+        finally:
+            self._end_put()
+        done.wait()
+
+    def close(self):
+        """
+        Writes the rows still queued and stops the writer thread. Puts already in progress
+        are queued first, later ones raise `ValueError`.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # the writer thread keeps making room for puts blocked on a full queue
+            while self._putting:
+                self._idle.wait()
+        self._queue.put(_STOP)
+        self._thread.join()
+        # not available on python 2 where the writer simply stays registered
+        if hasattr(atexit, "unregister"):
+            atexit.unregister(self.close)
+
+    def _begin_put(self):
+        """Counts a put in progress so `close()` only stops the writer after it."""
+        with self._lock:
+            if self._closed:
+                raise ValueError("The writer is closed")
+            self._putting += 1
+
+    def _end_put(self):
+        with self._lock:
+            self._putting -= 1
+            if not self._putting:
+                self._idle.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            try:
+                if batch:
+                    item = self._queue.get(timeout=max(0, deadline - _monotonic()))
+                else:
+                    item = self._queue.get()
+            except queue.Empty:
+                # the first row of the batch waited flush_interval seconds
+                batch = self._write(batch)
+                continue
+            if item is _STOP:
+                self._write(batch)
+                return
+            if isinstance(item, tuple) and len(item) == 2 and item[0] is _FLUSH:
+                batch = self._write(batch)
+                item[1].set()
+                continue
+            if not batch:
+                deadline = _monotonic() + self._flush_interval
+            batch.append(item)
+            if len(batch) >= self._batch_size:
+                batch = self._write(batch)
+
+    def _write(self, batch):
+        """Writes a batch and returns a new empty one."""
+        if not batch:
+            return batch
+        try:
+            if self._query is not None:
+                self._backend.execute_many(self._query, batch, batch_size=len(batch))
+            else:
+                self._backend.execute(
+                    "insert_many",
+                    batch,
+                    ordered=False,
+                    database=self._database,
+                    collection=self._collection,
+                )
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            if self._on_error is None:
+                _logger.exception("Could not write %s row(s)", len(batch))
+            else:
+                try:
+                    self._on_error(e, batch)
+                except Exception:
+                    _logger.exception("Error callback of the writer failed")
+        else:
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+        return []
@@ -19,12 +19,17 @@ setup(
     author_email="karthicr@gmail.com",
     url="https://github.com/karthicraghupathi/rapyd_db",
     license=license,
-    packages=find_packages(exclude=("tests", "docs")),
-    install_requires=["Cython", "six"],
+    packages=find_packages(exclude=("tests", "docs", "benchmarks", "benchmarks.*")),
+    install_requires=["Cython", "six", 'futures; python_version < "3"'],
     extras_require={
         "mysql": ["mysqlclient"],
         "mongo": ["pymongo"],
-        "mssql": ["pymssql"],
+        # bulk_load needs pymssql 2.2.0, which no longer supports python 2
+        "mssql": [
+            'pymssql; python_version < "3"',
+            'pymssql>=2.2.0; python_version >= "3"',
+        ],
+        "arrow": ["pyarrow"],
     },
     classifiers=[
         "Intended Audience :: Developers",